@@ -0,0 +1,451 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import smplCGen
+import smplDLX
+import smplDLXGen
+import smplIR
+import smplInterp
+import smplLex
+import smplLLParser
+import smplParser
+import smplPyGen
+import smplSSAGraph
+
+
+def generate_program(n_stats):
+    # a straight-line SMPL program with n_stats assignments
+    lines = ["main", "var a, b, c;", "{"]
+    for i in range(n_stats):
+        lines.append("  let a <- b * {} + (c - a) / 2;".format(i))
+    lines.append("  call OutputNum(a)")
+    lines.append("}.")
+    return "\n".join(lines)
+
+
+def generate_nested_program(depth):
+    # if statements nested depth times
+    lines = ["main", "var a;", "{"]
+    lines.append("if a < 1 then " * depth + "let a <- 1" + " fi" * depth)
+    lines.append("}.")
+    return "\n".join(lines)
+
+
+def generate_nested_while(depth):
+    # while loops nested depth times, each body updates a variable
+    lines = ["main", "var i, a;", "{"]
+    body = "while i < 10 do let a <- a + i; " * depth + "let i <- i + 1"
+    lines.append(body + " od" * depth)
+    lines.append("}.")
+    return "\n".join(lines)
+
+
+def generate_many_vars(n_vars, n_ifs):
+    # n_ifs small if statements over n_vars variables
+    names = ["v%d" % i for i in range(n_vars)]
+    lines = ["main", "var {};".format(", ".join(names)), "{"]
+    for i in range(n_ifs):
+        name = names[i % n_vars]
+        lines.append("  if {0} < {1} then let {0} <- {0} + 1 fi;".format(name, i % 100))
+    lines.append("  call OutputNum(v0)")
+    lines.append("}.")
+    return "\n".join(lines)
+
+
+def generate_sort_program(n):
+    # bubble sort of n pseudo-random numbers, O(n^2) loop iterations
+    return """main
+var i, j, t, n; array[{0}] a;
+{{
+  let n <- {0}; let i <- 0; let j <- 0; let t <- 0;
+  while i < n do
+    let t <- i * 37 + 11; let a[i] <- t - (t / 101) * 101; let i <- i + 1
+  od;
+  let i <- 0;
+  while i < n do
+    let j <- 0;
+    while j < n - i - 1 do
+      if a[j] > a[j + 1] then
+        let t <- a[j]; let a[j] <- a[j + 1]; let a[j + 1] <- t
+      fi;
+      let j <- j + 1
+    od;
+    let i <- i + 1
+  od;
+  call OutputNum(a[0]); call OutputNum(a[n - 1]); call OutputNewLine()
+}}.""".format(n)
+
+
+def compile_program(code):
+    ast = smplParser.Parser(smplLex.Lexer(code)).start_parser()
+    graph = smplSSAGraph.Graph()
+    ast.compile(graph)
+    return graph
+
+
+def bench_lexer(sizes=(1000, 2000, 4000, 8000, 16000)):
+    # time per token should stay flat if lexing is linear in the input size
+    template = "{0:>8}|{1:>10}|{2:>10}|{3:>12}"
+    print(template.format("Stats", "Tokens", "Time (s)", "us / token"))
+    for n in sizes:
+        code = generate_program(n)
+        start = time.perf_counter()
+        n_tokens = sum(1 for _ in smplLex.Lexer(code).tokens())
+        elapsed = time.perf_counter() - start
+        print(
+            template.format(
+                n, n_tokens, "%.3f" % elapsed, "%.3f" % (elapsed / n_tokens * 1e6)
+            )
+        )
+
+
+def bench_token_stream(path="examples"):
+    # every token should be lexed exactly once while parsing
+    files = glob.glob("./{}/**/*.smpl".format(path), recursive=True)
+    lex_calls, n_tokens = 0, 0
+    for f in sorted(files):
+        with open(f, "r") as code:
+            parser = smplParser.Parser(smplLex.Lexer(code.read().strip()))
+        try:
+            parser.start_parser()
+        except Exception as e:
+            print("[SKIP] {}: {}".format(f, e))
+            continue
+        lex_calls += parser.lex.lex_calls
+        n_tokens += parser.tokens.n_consumed
+    print(
+        "{} files, {} tokens, {} lex calls, {:.3f} lex calls / token".format(
+            len(files), n_tokens, lex_calls, lex_calls / n_tokens
+        )
+    )
+
+
+def bench_parser(n_stats=20000, depth=5000):
+    # recursive-descent parser vs table-driven LL(1) parser
+    parsers = [("rd", smplParser.Parser), ("ll1", smplLLParser.TableParser)]
+    template = "{0:>6}|{1:>22}|{2:>22}"
+    print(template.format("Parser", "%d stats (s)" % n_stats, "depth %d (s)" % depth))
+    for name, parser_class in parsers:
+        times = []
+        for code in [generate_program(n_stats), generate_nested_program(depth)]:
+            start = time.perf_counter()
+            try:
+                parser_class(smplLex.Lexer(code)).start_parser()
+                times.append("%.3f" % (time.perf_counter() - start))
+            except RecursionError:
+                times.append("RecursionError")
+        print(template.format(name, *times))
+
+
+def bench_stream(n_stats=20000):
+    # peak Python memory of lexing + parsing, source as one str vs streamed
+    with tempfile.NamedTemporaryFile("w", suffix=".smpl", delete=False) as f:
+        f.write(generate_program(n_stats))
+    print("source size: {} KiB".format(os.path.getsize(f.name) // 1024))
+    for mode in ["str", "mmap", "chunked"]:
+        tracemalloc.start()
+        with open(f.name, "r" if mode == "str" else "rb") as code:
+            if mode == "str":
+                lexer = smplLex.Lexer(code.read().strip())
+            else:
+                lexer = smplLex.StreamLexer(code, use_mmap=(mode == "mmap"))
+            n_tokens = sum(1 for _ in lexer.tokens())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:>8}: {} tokens, peak {} KiB".format(mode, n_tokens, peak // 1024))
+    os.remove(f.name)
+
+
+def bench_nested_while(depths=(4, 8, 16, 32, 64)):
+    # compile time should grow linearly with the loop nesting depth
+    template = "{0:>6}|{1:>10}"
+    print(template.format("Depth", "Time (s)"))
+    for depth in depths:
+        code = generate_nested_while(depth)
+        start = time.perf_counter()
+        compile_program(code)
+        print(template.format(depth, "%.3f" % (time.perf_counter() - start)))
+
+
+def bench_cse(n_stats=12500):
+    # one straight-line block, every statement emits 4 expressions
+    code = generate_program(n_stats)
+    start = time.perf_counter()
+    graph = compile_program(code)
+    elapsed = time.perf_counter() - start
+    n_instrs = len(graph.graphs[0].root.instrs)
+    print(
+        "{} expressions, {} instructions, {:.3f} s".format(
+            n_stats * 4, n_instrs, elapsed
+        )
+    )
+
+
+def bench_symbols(n_vars=2000, n_ifs=5000):
+    # peak memory of compiling, every if statement creates 3 blocks
+    code = generate_many_vars(n_vars, n_ifs)
+    tracemalloc.start()
+    start = time.perf_counter()
+    compile_program(code)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        "{} vars, {} ifs: peak {} MiB, {:.3f} s".format(
+            n_vars, n_ifs, peak // (1024 * 1024), elapsed
+        )
+    )
+
+
+def bench_ir(n_stats=25000):
+    # memory held by the IR and compile time, ~4 instructions per statement
+    code = generate_program(n_stats)
+    ast = smplParser.Parser(smplLex.Lexer(code)).start_parser()
+    tracemalloc.start()
+    graph = smplSSAGraph.Graph()
+    ast.compile(graph)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n_instrs = len(graph.graphs[0].root.instrs)
+    del graph
+    start = time.perf_counter()
+    ast.compile(smplSSAGraph.Graph())
+    elapsed = time.perf_counter() - start
+    print(
+        "{} instructions: {} KiB, {:.0f} bytes / instruction, compile {:.3f} s".format(
+            n_instrs, size // 1024, size / n_instrs, elapsed
+        )
+    )
+
+
+def bench_interp(n=300):
+    # instructions per second of the IR interpreter, before and after the
+    # optimizations that change how many instructions run
+    template = "{0:>10}|{1:>14}|{2:>10}|{3:>16}"
+    print(template.format("Passes", "Instructions", "Time (s)", "Instructions / s"))
+    code = generate_sort_program(n)
+    for name, passes in [
+        ("none", {"constant_elimination": False}),
+        ("default", {}),
+        (
+            "all",
+            {"sccp": True, "memssa": True, "licm": True, "ivsr": True, "dce": True},
+        ),
+    ]:
+        graph = compile_program(code)
+        for i, subgraph in enumerate(graph.graphs):
+            dotgraph = smplIR.DotGraph(graph=subgraph, id=i)
+            dotgraph.build_graph(**passes)
+        interpreter = smplInterp.Interpreter(graph, stdout=io.StringIO()).run()
+        print(
+            template.format(
+                name,
+                interpreter.executed,
+                "%.3f" % interpreter.elapsed,
+                "%.0f" % (interpreter.executed / interpreter.elapsed),
+            )
+        )
+
+
+def bench_backends(n=600, repeat=3):
+    # the IR interpreter against the program compiled to Python, best of repeat
+    template = "{0:>10}|{1:>12}|{2:>12}|{3:>8}"
+    print(template.format("Passes", "Interp (s)", "Python (s)", "Speedup"))
+    code = generate_sort_program(n)
+    for name, passes in [
+        ("default", {}),
+        (
+            "all",
+            {"sccp": True, "memssa": True, "licm": True, "ivsr": True, "dce": True},
+        ),
+    ]:
+        graph = compile_program(code)
+        for i, subgraph in enumerate(graph.graphs):
+            smplIR.DotGraph(graph=subgraph, id=i).build_graph(**passes)
+        code_object = smplPyGen.compile_graph(graph)
+        interp = min(
+            smplInterp.Interpreter(graph, stdout=io.StringIO()).run().elapsed
+            for _ in range(repeat)
+        )
+        python = min(
+            smplPyGen.Runtime(stdout=io.StringIO()).run(code_object).elapsed
+            for _ in range(repeat)
+        )
+        print(
+            template.format(
+                name, "%.3f" % interp, "%.3f" % python, "%.1fx" % (interp / python)
+            )
+        )
+
+
+class Timeout(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    def expire(signum, frame):
+        raise Timeout()
+
+    signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def bench_c(path="examples", timeout=2.0):
+    # the examples and a 600 element bubble sort with every engine, the
+    # numbers fed to InputNum repeat, a program running longer than
+    # timeout (some examples never stop) is left out of the total. The C
+    # times include starting the process, about 1.5 ms here
+    if shutil.which("cc") is None:
+        print("no C compiler (cc) found")
+        return
+    programs = []
+    for f in sorted(glob.glob("./{}/**/*.smpl".format(path), recursive=True)):
+        with open(f, "r") as code:
+            programs.append((os.path.basename(f), code.read().strip()))
+    programs.append(("bubble sort 600", generate_sort_program(600)))
+    numbers = " ".join(["5 3 8 1 9 2 7 4 6 0"] * 100)
+    workdir = tempfile.mkdtemp()
+
+    def interp(graph):
+        stdin = io.StringIO(numbers)
+        return smplInterp.Interpreter(graph, stdin, io.StringIO()).run().elapsed
+
+    def python(graph):
+        code_object = smplPyGen.compile_graph(graph)
+        return (
+            smplPyGen.Runtime(io.StringIO(numbers), io.StringIO())
+            .run(code_object)
+            .elapsed
+        )
+
+    def c(graph):
+        exe = smplCGen.build(smplCGen.generate(graph), os.path.join(workdir, "prog"))
+        with tempfile.TemporaryFile("w+") as stdin:
+            stdin.write(numbers)
+            stdin.seek(0)
+            return smplCGen.run(exe, stdin, subprocess.DEVNULL, timeout)
+
+    template = "{0:>40}|{1:>12}|{2:>12}|{3:>12}"
+    print(template.format("Program", "Interp (s)", "Python (s)", "C (s)"))
+    totals = [0.0, 0.0, 0.0]
+    for name, code in programs:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                graph = compile_program(code)
+                for i, subgraph in enumerate(graph.graphs):
+                    smplIR.DotGraph(graph=subgraph, id=i).build_graph()
+        except Exception:
+            continue  # not a valid program
+        times = []
+        for engine in [interp, python, c]:
+            try:
+                with time_limit(timeout):
+                    times.append(engine(graph))
+            except (Timeout, subprocess.TimeoutExpired):
+                times.append("timeout")
+            except Exception:
+                times.append("error")
+        if all(isinstance(t, float) for t in times):
+            totals = [total + t for total, t in zip(totals, times)]
+        print(
+            template.format(
+                name, *(t if isinstance(t, str) else "%.4f" % t for t in times)
+            )
+        )
+    shutil.rmtree(workdir)
+    print(template.format("total", *("%.4f" % total for total in totals)))
+
+
+def bench_dlx(n=100):
+    # the cost of the sort on the DLX simulator after each pass alone, all
+    # of them and with registers allocated
+    template = "{0:>10}|{1:>12}|{2:>12}|{3:>10}|{4:>10}"
+    print(template.format("Passes", "Instructions", "Cycles", "Loads", "Stores"))
+    code = generate_sort_program(n)
+    for name, passes in [
+        ("default", {}),
+        ("sccp", {"sccp": True}),
+        ("dce", {"dce": True}),
+        ("phielim", {"phielim": True}),
+        ("sroa", {"sroa": True}),
+        ("memssa", {"memssa": True}),
+        ("pre", {"pre": True}),
+        ("licm", {"licm": True}),
+        ("ivsr", {"ivsr": True}),
+        (
+            "all",
+            {
+                "sccp": True,
+                "phielim": True,
+                "sroa": True,
+                "memssa": True,
+                "pre": True,
+                "licm": True,
+                "ivsr": True,
+                "dce": True,
+            },
+        ),
+        ("regs 4", {"regs": 4}),
+        ("regs 8", {"regs": 8}),
+        (
+            "all+regs 8",
+            {
+                "sccp": True,
+                "phielim": True,
+                "sroa": True,
+                "memssa": True,
+                "pre": True,
+                "licm": True,
+                "ivsr": True,
+                "dce": True,
+                "regs": 8,
+            },
+        ),
+    ]:
+        graph = compile_program(code)
+        for i, subgraph in enumerate(graph.graphs):
+            smplIR.DotGraph(graph=subgraph, id=i).build_graph(**passes)
+        machine = smplDLX.Simulator(smplDLXGen.generate(graph), stdout=io.StringIO())
+        machine.run()
+        print(
+            template.format(
+                name, machine.executed, machine.cycles, machine.loads, machine.stores
+            )
+        )
+
+
+BENCHMARKS = {
+    "lexer": bench_lexer,
+    "parser": bench_parser,
+    "stream": bench_stream,
+    "while": bench_nested_while,
+    "cse": bench_cse,
+    "ir": bench_ir,
+    "symbols": bench_symbols,
+    "tokens": bench_token_stream,
+    "interp": bench_interp,
+    "backends": bench_backends,
+    "c": bench_c,
+    "dlx": bench_dlx,
+}
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="SMPL compiler benchmarks")
+    argparser.add_argument("bench", choices=sorted(BENCHMARKS.keys()))
+    args = argparser.parse_args()
+    BENCHMARKS[args.bench]()
@@ -1,10 +1,15 @@
 import argparse
 import os
+import sys
 
 import smplIR
 import smplLex
+import smplLLParser
 import smplParser
+import smplPyGen
+import smplRegAlloc
 import smplSSAGraph
+import smplUnroll
 
 
 def main():
@@ -23,20 +28,164 @@ def main():
     argparser.add_argument(
         "-p", "--output-png", dest="output_png", default=False, action="store_true"
     )
+    argparser.add_argument(
+        "-s",
+        "--stream",
+        dest="stream",
+        default=False,
+        action="store_true",
+        help="lex from a memory-mapped or chunked file instead of one string",
+    )
+    argparser.add_argument(
+        "--sccp",
+        dest="sccp",
+        default=False,
+        action="store_true",
+        help="sparse conditional constant propagation instead of the per-block constant elimination",
+    )
+    argparser.add_argument(
+        "--dce",
+        dest="dce",
+        default=False,
+        action="store_true",
+        help="remove instructions whose values are never used",
+    )
+    argparser.add_argument(
+        "--phielim",
+        dest="phielim",
+        default=False,
+        action="store_true",
+        help="remove trivial phis and phi cycles merging a single value",
+    )
+    argparser.add_argument(
+        "--unroll",
+        dest="unroll",
+        nargs="?",
+        type=int,
+        default=0,
+        const=smplUnroll.UNROLL_BUDGET,
+        metavar="BUDGET",
+        help="unroll loops with a constant trip count, fully if the result has at most BUDGET instructions (default {})".format(
+            smplUnroll.UNROLL_BUDGET
+        ),
+    )
+    argparser.add_argument(
+        "--unroll-factor",
+        dest="unroll_factor",
+        type=int,
+        default=smplUnroll.UNROLL_FACTOR,
+        help="largest factor for loops over the unroll budget",
+    )
+    argparser.add_argument(
+        "--sroa",
+        dest="sroa",
+        default=False,
+        action="store_true",
+        help="replace arrays only indexed by constants with SSA values",
+    )
+    argparser.add_argument(
+        "--memssa",
+        dest="memssa",
+        default=False,
+        action="store_true",
+        help="forward stores to loads and remove redundant loads (memory SSA)",
+    )
+    argparser.add_argument(
+        "--pre",
+        dest="pre",
+        default=False,
+        action="store_true",
+        help="partial redundancy elimination (lazy code motion)",
+    )
+    argparser.add_argument(
+        "--licm",
+        dest="licm",
+        default=False,
+        action="store_true",
+        help="move loop-invariant instructions out of while loops",
+    )
+    argparser.add_argument(
+        "--ivsr",
+        dest="ivsr",
+        default=False,
+        action="store_true",
+        help="strength-reduce induction variables in loops (array addresses)",
+    )
+    argparser.add_argument(
+        "--regs",
+        dest="regs",
+        nargs="?",
+        type=int,
+        default=0,
+        const=smplRegAlloc.DEFAULT_REGISTERS,
+        metavar="N",
+        help="allocate N registers (default {}, at most {}) by graph coloring, "
+        "the drawing shows them and the DLX backend uses them".format(
+            smplRegAlloc.DEFAULT_REGISTERS, smplRegAlloc.MAX_REGISTERS
+        ),
+    )
+    argparser.add_argument(
+        "--stats",
+        dest="stats",
+        default=False,
+        action="store_true",
+        help="print what the optimization passes did for each function",
+    )
+    argparser.add_argument(
+        "--run",
+        dest="run",
+        nargs="?",
+        default=None,
+        const="interp",
+        choices=["interp", "python", "c", "dlx"],
+        help="run the program (after the optimizations) instead of drawing it, "
+        "with the IR interpreter, compiled to Python (cached in {}), "
+        "compiled to C with cc or on the DLX simulator, which reports "
+        "cycles and memory traffic".format(smplPyGen.CACHE_DIR),
+    )
+    argparser.add_argument(
+        "--parser",
+        dest="parser",
+        default="rd",
+        choices=["rd", "ll1"],
+        help="recursive-descent (rd) or table-driven LL(1) (ll1) parser",
+    )
 
     args = argparser.parse_args()
 
     if not args.input:
         raise FileNotFoundError
 
-    code = open(args.input, "r")
+    cache_key = None
+    if args.run == "python":
+        # the same program compiled with the same options runs from the cache
+        options = dict(vars(args))
+        for name in ["input", "no_view", "output_png"]:
+            del options[name]
+        with open(args.input, "rb") as f:
+            cache_key = smplPyGen.cache_key(f.read(), options)
+        cached = smplPyGen.CodeCache().load(cache_key)
+        if cached is not None:
+            code, diagnostics = cached
+            # the warnings and stats of the compilation that stored it
+            sys.stdout.write(diagnostics)
+            print(smplPyGen.Runtime().run(code).report(), file=sys.stderr)
+            return
+
+    code = open(args.input, "rb" if args.stream else "r")
     base = os.path.basename(args.input)
     ext = ".png" if args.output_png else ".pdf"
     output_file = "./output/" + os.path.splitext(base)[0] + ext
 
-    # remove leading and trailing whitespace in input code
-    lexer = smplLex.Lexer(code.read().strip())
-    parser = smplParser.Parser(lexer)
+    if args.stream:
+        lexer = smplLex.StreamLexer(code)
+    else:
+        # remove leading and trailing whitespace in input code
+        lexer = smplLex.Lexer(code.read().strip())
+    if args.parser == "ll1":
+        parser = smplLLParser.TableParser(lexer)
+    else:
+        parser = smplParser.Parser(lexer)
 
     if args.lex:
         lexer.iterate()
@@ -44,6 +193,9 @@ def main():
         return
     if args.ir:
         ast = parser.start_parser()
+        if args.stream:
+            # the parser stops at the final ".", the tokens are all read
+            lexer.close()
         dotgraph = smplSSAGraph.Graph()
         ast.compile(dotgraph)
         smplIR.Output(
@@ -52,6 +204,20 @@ def main():
             view=args.no_view,
             output_png=args.output_png,
             constant_elimination=args.no_ce,
+            sccp=args.sccp,
+            dce=args.dce,
+            phielim=args.phielim,
+            unroll=args.unroll,
+            unroll_factor=args.unroll_factor,
+            regs=args.regs,
+            sroa=args.sroa,
+            memssa=args.memssa,
+            pre=args.pre,
+            licm=args.licm,
+            ivsr=args.ivsr,
+            stats=args.stats,
+            run=args.run,
+            cache_key=cache_key,
         )
 
     code.close()
@@ -3,6 +3,34 @@ import smplSSA
 import smplSSAGraph
 
 
+def assigned_names(statements):
+    # names of the variables assigned in statements, nested statements included
+    names = set()
+    for stmt in statements:
+        if isinstance(stmt, Assignment) and isinstance(stmt.left, Identifier):
+            names.add(stmt.left.name)
+        elif isinstance(stmt, IfStatement):
+            names |= assigned_names(stmt.thenStatement)
+            names |= assigned_names(stmt.elseStatement)
+        elif isinstance(stmt, WhileStatement):
+            names |= assigned_names(stmt.statement)
+    return names
+
+
+def assigns_arrays(statements):
+    # whether statements store to an array, nested statements included
+    for stmt in statements:
+        if isinstance(stmt, Assignment) and isinstance(stmt.left, Array):
+            return True
+        if isinstance(stmt, IfStatement):
+            if assigns_arrays(stmt.thenStatement + stmt.elseStatement):
+                return True
+        elif isinstance(stmt, WhileStatement):
+            if assigns_arrays(stmt.statement):
+                return True
+    return False
+
+
 class Identifier:
     def __init__(self, name):
         self.name = name
@@ -27,26 +55,28 @@ class Array:  # from vid 11
 
     def compile(self, SSAGraph):
         addr_op = self.compile_addr(SSAGraph)
-        load_op = SSAGraph.emit("load", addr_op, check_dup=True)
+        load_op = SSAGraph.emit(smplSSA.Op.LOAD, addr_op, check_dup=True)
         return load_op
 
     def compile_addr(self, SSAGraph):
         name = self.ident.name
         base_addr, strides = SSAGraph.current_block.get_local_var(name)
-        offset_op = smplSSA.ImmediateOp(0)
+        offset_op = smplSSA.ImmediateOp(0)  # interned, not a new object
         # dot product of indices of an element and the strides provides the offset to that element in the buffer
         # https://docs.microsoft.com/en-us/windows/ai/directml/dml-strides
         for i, idx in enumerate(self.array):
             idx_op = idx.compile(SSAGraph)
             this_offset_op = SSAGraph.emit(
-                "mul",
+                smplSSA.Op.MUL,
                 idx_op,
                 smplSSA.ImmediateOp(strides[i]),
                 check_dup=True,
             )
-            offset_op = SSAGraph.emit("add", offset_op, this_offset_op, check_dup=True)
+            offset_op = SSAGraph.emit(
+                smplSSA.Op.ADD, offset_op, this_offset_op, check_dup=True
+            )
         offset_op = SSAGraph.emit(
-            "mul",
+            smplSSA.Op.MUL,
             offset_op,
             smplSSA.ImmediateOp(config.INTEGER_SIZE),
             check_dup=True,
@@ -54,7 +84,7 @@ class Array:  # from vid 11
         # add FP base_addr
         # we do not check duplicate for adda here
         # if needed, when emitting "load", "adda" might be deleted
-        addr_op = SSAGraph.emit("adda", offset_op, base_addr, check_dup=False)
+        addr_op = SSAGraph.emit(smplSSA.Op.ADDA, offset_op, base_addr, check_dup=False)
 
         return addr_op
 
@@ -82,7 +112,7 @@ class VarDecl:
             for d in dims:
                 size *= d
             base_addr = SSAGraph.emit(
-                "alloca", smplSSA.ImmediateOp(size * config.INTEGER_SIZE)
+                smplSSA.Op.ALLOCA, smplSSA.ImmediateOp(size * config.INTEGER_SIZE)
             )
             SSAGraph.current_block.set_local_var(name, base_addr)
         else:
@@ -151,7 +181,7 @@ class Computation:
                 stmt.compile(SSAGraph)
 
         SSAGraph.arg_names = [param.ident.name for param in self.varDecls]
-        SSAGraph.emit("end")
+        SSAGraph.emit(smplSSA.Op.END)
         return None
 
 
@@ -164,14 +194,15 @@ class Operator:
     def compile(self, SSAGraph):
         left = self.left.compile(SSAGraph)
         right = self.right.compile(SSAGraph)
-        result = SSAGraph.emit(config.OP_TABLE[self.op], left, right, check_dup=True)
+        result = SSAGraph.emit(
+            smplSSA.OPCODES[config.OP_TABLE[self.op]], left, right, check_dup=True
+        )
         return result
 
     def compile_conditional_jump(self, SSAGraph, join_block):
         cond_op = self.compile(SSAGraph)
-        SSAGraph.emit(
-            config.BRANCH_OP_MAP[self.op], cond_op, "(BB%s)" % join_block.label
-        )
+        branch = smplSSA.OPCODES[config.BRANCH_OP_MAP[self.op]]
+        SSAGraph.emit(branch, cond_op, join_block)
         return None
 
 
@@ -186,7 +217,7 @@ class Assignment:
             name = self.left.name
             if name not in SSAGraph.current_block.local_variables:
                 raise Exception("[ERROR] Assigning an undeclared variable '%s'" % name)
-            SSAGraph.current_block.set_local_var(self.left.name, val)
+            SSAGraph.assign(self.left.name, val)
 
         elif isinstance(self.left, Array):
             name = self.left.ident.name
@@ -194,7 +225,7 @@ class Assignment:
                 raise Exception("[ERROR] Assigning an undeclared array '%s'" % name)
 
             addr_op = self.left.compile_addr(SSAGraph)
-            SSAGraph.emit("store", val, addr_op)
+            SSAGraph.emit(smplSSA.Op.STORE, val, addr_op)
 
         return None
 
@@ -212,10 +243,10 @@ class FuncCall:
                 params.append(param_op)
         func_name = self.ident.name
         if func_name in config.BUILTIN_FUNCS.keys():
-            func_name = config.BUILTIN_FUNCS[func_name]
-            res_op = SSAGraph.emit("", func_name, *params, check_dup=False)
+            builtin = smplSSA.OPCODES[config.BUILTIN_FUNCS[func_name]]
+            res_op = SSAGraph.emit(builtin, *params, check_dup=False)
         else:
-            res_op = SSAGraph.emit("call", func_name, *params, check_dup=False)
+            res_op = SSAGraph.emit(smplSSA.Op.CALL, func_name, *params, check_dup=False)
         return res_op
 
 
@@ -226,9 +257,12 @@ class IfStatement:
         self.elseStatement = elseStatement
 
     def compile(self, SSAGraph):
-        # at join block, if load (ops) is in this list,
-        # it should be regenerated (should not be eliminated!)
-        possibly_killed_load = []
+        values = SSAGraph.values
+        # scope of the current node, then/else/join are dominated by it
+        mark = values.mark()
+        memory_epoch = values.epoch
+        # set if a store in then/else might have changed the memory
+        memory_killed = False
         # create child nodes with same context of the current node (vars, arrays...)
         then_block = SSAGraph.get_new_block(same_context=True)
         else_block = SSAGraph.get_new_block(same_context=True)
@@ -236,51 +270,59 @@ class IfStatement:
         # add child nodes to the current node
         SSAGraph.current_block.add_child("then", then_block)
         SSAGraph.current_block.add_child("else", else_block)
-        # three new nodes were dominiated by the current node
-        SSAGraph.current_block.dominates.extend([then_block, else_block, join_block])
         # create branch instruction of the current node
         self.relation.compile_conditional_jump(SSAGraph, else_block)
 
         # Compile "then" block
         SSAGraph.set_current_block(then_block)
+        values.push_scope()
+        SSAGraph.push_assigned()
         for stmt in self.thenStatement:
             if stmt:
                 stmt.compile(SSAGraph)
         if len(then_block.instrs) == 0:
-            SSAGraph.emit("\<empty\>", is_empty=True)
-        SSAGraph.emit("bra", "(BB%s)" % join_block.label)
+            SSAGraph.emit(smplSSA.Op.EMPTY, is_empty=True)
+        SSAGraph.emit(smplSSA.Op.BRA, join_block)
         # Add join block for then/else, which should be fall through this join block!
         SSAGraph.current_block.add_child("join", join_block)
-        if SSAGraph.current_block.join_block_killed:
-            possibly_killed_load.extend(list(SSAGraph.current_block.join_block_killed))
+        memory_killed |= values.epoch != memory_epoch
+        values.rewind(mark)
         then_block = SSAGraph.current_block
+        assigned = SSAGraph.pop_assigned()
 
         # Compile "else" block
         SSAGraph.set_current_block(else_block)
+        values.push_scope()
+        SSAGraph.push_assigned()
         for stmt in self.elseStatement:
             if stmt:
                 stmt.compile(SSAGraph)
         if len(else_block.instrs) == 0:
-            SSAGraph.emit("\<empty\>", is_empty=True)
-        SSAGraph.emit("bra", "(BB%s)" % join_block.label)
+            SSAGraph.emit(smplSSA.Op.EMPTY, is_empty=True)
+        SSAGraph.emit(smplSSA.Op.BRA, join_block)
         # Add join block for then/else, which should be fall through this join block!
         SSAGraph.current_block.add_child("join", join_block)
-        if SSAGraph.current_block.join_block_killed:
-            possibly_killed_load.extend(list(SSAGraph.current_block.join_block_killed))
+        memory_killed |= values.epoch != memory_epoch
+        values.rewind(mark)
         else_block = SSAGraph.current_block
+        assigned.update(SSAGraph.pop_assigned())
 
         # Compile "join" block
         SSAGraph.set_current_block(join_block)
-        SSAGraph.current_block.possibly_killed_load = set(possibly_killed_load)
-        for name in SSAGraph.current_block.local_variables:
+        values.push_scope()
+        if memory_killed:
+            # loads before the if statement might be stale on one of the paths
+            values.kill_memory()
+        # only the variables assigned in then/else might need a phi
+        for name in SSAGraph.current_block.local_variables.in_order(assigned):
             val_a, _ = then_block.get_local_var(name)
             val_b, _ = else_block.get_local_var(name)
             if val_a == val_b:
                 # do not need to use phi function here (val from left and right are the same)
                 continue
-            phi_op = SSAGraph.emit("phi", val_a, val_b)
+            phi_op = SSAGraph.emit(smplSSA.Op.PHI, val_a, val_b)
             # change the variable the the new value (phi)
-            SSAGraph.current_block.set_local_var(name, phi_op)
+            SSAGraph.assign(name, phi_op)
 
         return None
 
@@ -291,53 +333,45 @@ class WhileStatement:
         self.statement = statement
 
     def compile(self, SSAGraph):
-        # at exit block, if load (ops) is in this list,
-        # it should be regenerated (should not be eliminated!)
-        possibly_killed_load = []
+        values = SSAGraph.values
         # add starting block for the while statement
         head_block = SSAGraph.get_new_block(same_context=True)
-        SSAGraph.current_block.dominates.append(head_block)
         SSAGraph.current_block.add_child("head", head_block)
-
-        # Compile statements in the body block first (using a temporary block)
-        # since variable might be changed in the body block
-        old_instr_counter = SSAGraph.instr_counter
-        tmp_body_block = SSAGraph.get_new_block(add_counter=False, same_context=True)
-        SSAGraph.set_current_block(tmp_body_block)
-        for stmt in self.statement:
-            if stmt:
-                stmt.compile(SSAGraph)
-        tmp_body_block = SSAGraph.current_block
-
-        # Compile head block, need to check whether we need a phi function
-        # value might came from the body block (using tmp block here)
+        values.push_scope()
+        head_mark = values.mark()
+        if assigns_arrays(self.statement):
+            # the head is reached again after the stores in the body
+            values.kill_memory()
+
+        # Compile head block, the back edge from the body is not known yet,
+        # so every variable assigned in the body gets an incomplete phi
+        # (its second operand is filled in when the head block is sealed)
         # ps. head block only handles conditions (cmp and branch!)
         SSAGraph.set_current_block(head_block)
-        for name in SSAGraph.current_block.local_variables:
+        assigned = assigned_names(self.statement)
+        incomplete_phis = {}
+        for name in SSAGraph.current_block.local_variables.in_order(assigned):
             val_a, _ = SSAGraph.current_block.get_local_var(name)
-            # from the body block (fall through block)
-            val_b, _ = tmp_body_block.get_local_var(name)
-            if val_a != val_b:
-                phi_op = SSAGraph.emit("phi", val_a, val_b)
-                SSAGraph.current_block.set_local_var(name, phi_op)
+            phi_op = SSAGraph.emit(smplSSA.Op.PHI, val_a, None)
+            incomplete_phis[name] = (phi_op, SSAGraph.current_block.instrs[-1])
+            SSAGraph.current_block.set_local_var(name, phi_op)
 
         # (in head) compile cond jump for exit block,
         # it will be done later after finishing this while stat
         exit_block = SSAGraph.get_new_block(same_context=True)
         self.relation.compile_conditional_jump(SSAGraph, exit_block)
 
-        # Create the real body block
-        new_instr_counter = SSAGraph.instr_counter
+        # Compile the body block (only once)
         body_block = SSAGraph.get_new_block(same_context=True)
-        SSAGraph.instr_counter = old_instr_counter
         SSAGraph.set_current_block(body_block)
+        values.push_scope()
+        SSAGraph.push_assigned()
         for stmt in self.statement:
             if stmt:
                 stmt.compile(SSAGraph)
-        if SSAGraph.current_block.join_block_killed:
-            possibly_killed_load.extend(list(SSAGraph.current_block.join_block_killed))
-        SSAGraph.instr_counter = new_instr_counter
-        SSAGraph.emit("bra", "(BB%s)" % head_block.label)
+        SSAGraph.emit(smplSSA.Op.BRA, head_block)
+        SSAGraph.pop_assigned()
+        values.rewind(head_mark)
 
         # Set block links
         head_block.add_child("body", body_block)
@@ -345,15 +379,35 @@ class WhileStatement:
             "head", head_block
         )  # this is because of the looping
         head_block.add_child("exit", exit_block)
-        head_block.dominates.append(body_block)
-        head_block.dominates.append(exit_block)
+
+        # Seal the head block: the value from the back edge is known now.
+        # A dropped phi can still be the binding of another variable (after
+        # "let t <- x"), so every binding is looked up in the replacements
+        replaced = {}  # dropped phi -> the value it stands for
+        resolve = lambda val: replaced.get(val, val)
+        for name, (phi_op, phi) in incomplete_phis.items():
+            val_a = phi.ops[0]
+            # from the body block (fall through block)
+            val_b, _ = SSAGraph.current_block.get_local_var(name)
+            val_b = resolve(val_b)
+            if val_b == phi_op or val_b == val_a:
+                # the value does not change in the loop, drop the phi
+                head_block.instrs.remove(phi)
+                phi.unlink()
+                phi.replace_all_uses(val_a)
+                replaced[phi_op] = val_a
+            else:
+                phi.set_ops(val_a, val_b)
+        for name in incomplete_phis:
+            val, _ = exit_block.get_local_var(name)
+            exit_block.set_local_var(name, resolve(val))
+
         SSAGraph.set_current_block(exit_block)
-        # append possible killed adda's to exit block
-        SSAGraph.current_block.possibly_killed_load = set(possibly_killed_load)
+        values.push_scope()
 
         # body block might be empty
         if len(body_block.instrs) == 0:
-            SSAGraph.emit("\<empty\>", is_empty=True)
+            SSAGraph.emit(smplSSA.Op.EMPTY, is_empty=True)
 
         return None
 
@@ -366,7 +420,7 @@ class ReturnStatement:
         ret = None
         if self.val:
             ret = self.val.compile(SSAGraph)
-            SSAGraph.emit("return", ret)
+            SSAGraph.emit(smplSSA.Op.RETURN, ret)
         else:
-            SSAGraph.emit("return", "")
+            SSAGraph.emit(smplSSA.Op.RETURN, "")
         return ret
@@ -0,0 +1,307 @@
+import os
+import shutil
+import subprocess
+import time
+
+import config
+import smplPyGen
+import smplSSA
+
+Op = smplSSA.Op
+
+# bigger arrays are allocated on the heap
+STACK_ARRAY_LIMIT = 1 << 16
+CFLAGS = ["-std=c99", "-O2"]
+
+# the operators and branch conditions are written as in Python
+BINARY_OPS = smplPyGen.BINARY_OPS
+WRAPPED_OPS = smplPyGen.WRAPPED_OPS
+BRANCH_CONDS = smplPyGen.BRANCH_CONDS
+NEGATED_CONDS = smplPyGen.NEGATED_CONDS
+
+# SMPL values are words of config.INTEGER_SIZE bytes, like the array
+# elements, held in integers as wide as an address as they might be one.
+# The arithmetic wraps around to a word (smplSSA.wrap): it is done unsigned,
+# a signed overflow is undefined
+PRELUDE = """/* generated from SMPL */
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+typedef intptr_t value;
+typedef int%d_t word;
+typedef uint%d_t uword;
+
+#define WRAP(x) ((value)(word)(x))
+
+static void smpl_error(const char *message)
+{
+    fflush(stdout);
+    fprintf(stderr, "[ERROR] %%s\\n", message);
+    exit(1);
+}
+
+static value smpl_read(void)
+{
+    long long number;
+    if (scanf("%%lld", &number) != 1)
+        smpl_error("InputNum: no more input");
+    return WRAP((uword)number);
+}
+
+static void smpl_write(value v)
+{
+    printf("%%lld ", (long long)v);
+}
+
+static value smpl_div(value a, value b)
+{
+    if (b == 0)
+        smpl_error("Division by zero");
+    if (b == -1)
+        return WRAP(0u - (uword)a);
+    return a / b;
+}
+
+static word *smpl_calloc(size_t words)
+{
+    word *array = calloc(words, sizeof(word));
+    if (array == NULL)
+        smpl_error("Out of memory");
+    return array;
+}
+""" % (
+    config.INTEGER_SIZE * 8,
+    config.INTEGER_SIZE * 8,
+)
+
+
+class Lowering:
+    # Lowers one SubGraph to a C function: its blocks in the order they
+    # are printed, a label for every block a goto jumps to, phis lowered to
+    # copies on the edges (through temporaries when a copy overwrites a
+    # value another one still reads). An alloca is an array of this call,
+    # on the stack up to STACK_ARRAY_LIMIT bytes and on the heap above
+    def __init__(self, graph, name, params):
+        self.graph = graph
+        self.name = name
+        self.params = params
+        self.names = {}  # instr -> C local
+        self.arrays = []  # (name, words, on the heap)
+        self.lines = []
+        self.targets = set()  # blocks a goto jumps to
+        self.fused = set()  # cmps only used by their branch
+        self.n_temps = 0
+
+    def signature(self):
+        params = ", ".join("value p_" + param for param in self.params) or "void"
+        return "static value {}({})".format(self.name, params)
+
+    def lower(self):
+        blocks = sorted(self.graph.cfg().rpo, key=lambda block: block.label)
+        for block in blocks:
+            for instr in block.instrs:
+                if not instr.is_empty and instr.instr == Op.CMP:
+                    uses = list(instr.uses)
+                    if len(uses) == 1 and uses[0].instr in smplSSA.BRANCH_OPS:
+                        self.fused.add(instr)
+        body = []
+        for i, block in enumerate(blocks):
+            next_block = blocks[i + 1] if i + 1 < len(blocks) else None
+            self.lines = []
+            self.emit_block(block, next_block)
+            body.append((block, self.lines))
+
+        lines = [self.signature() if self.params is not None else "int main(void)", "{"]
+        if self.names:
+            lines.append("    value {};".format(", ".join(self.names.values())))
+        for i in range(self.n_temps):
+            lines.append("    value t{};".format(i + 1))
+        for name, words, on_heap in self.arrays:
+            if on_heap:
+                lines.append("    word *{} = NULL;".format(name))
+            else:
+                lines.append("    word {}[{}] = {{0}};".format(name, words))
+        for block, block_lines in body:
+            if block in self.targets:
+                lines.append("BB{}:;".format(block.label))
+            lines += block_lines
+        lines.append("}")
+        return lines
+
+    # Values
+    def value(self, op):
+        return smplPyGen.value_name(op, self.names)
+
+    def address(self, addr):
+        return "*(word *)({})".format(self.value(addr))
+
+    # Control flow
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def emit_block(self, block, next_block):
+        for instr in block.instrs:
+            if instr.is_empty or instr.instr == Op.PHI or instr in self.fused:
+                continue
+            opcode = instr.instr
+            if opcode in smplSSA.BRANCH_OPS:
+                self.emit_branch(block, instr, next_block)
+                return
+            if opcode == Op.BRA:
+                self.emit_goto(instr.ops[0], next_block, block)
+                return
+            if opcode in (Op.RETURN, Op.END):
+                self.emit_return(instr)
+                return
+            self.emit_instr(instr)
+        if block.succs:
+            self.emit_goto(block.succs[0], next_block, block)
+        else:
+            self.emit_return(None)
+
+    def emit_branch(self, block, branch, next_block):
+        cond = branch.ops[0]
+        taken = branch.ops[1]
+        fall = [succ for succ in block.succs if succ is not taken][0]
+        if cond in self.fused:
+            left, right = (self.value(op) for op in cond.ops)
+        else:
+            left, right = self.value(cond), "0"
+        conds = BRANCH_CONDS
+        if taken is next_block:
+            # jump to the other block, the taken one comes next anyway
+            conds, taken, fall = NEGATED_CONDS, fall, taken
+        test = "if ({} {} {})".format(left, conds[branch.instr], right)
+        copies = self.copies(block, taken)
+        self.targets.add(taken)
+        if copies:
+            self.emit(test + " {")
+            self.lines += ["    " + line for line in copies]
+            self.emit("    goto BB{};".format(taken.label))
+            self.emit("}")
+        else:
+            self.emit("{} goto BB{};".format(test, taken.label))
+        self.emit_goto(fall, next_block, block)
+
+    def emit_goto(self, succ, next_block, block=None):
+        if block is not None:
+            self.lines += self.copies(block, succ)
+        if succ is not next_block:
+            self.targets.add(succ)
+            self.emit("goto BB{};".format(succ.label))
+
+    def copies(self, block, succ):
+        index = succ.preds.index(block)
+        moves = []
+        for instr in succ.instrs:
+            if not instr.is_empty and instr.instr == Op.PHI:
+                dest, src = self.value(instr), self.value(instr.ops[index])
+                if dest != src:
+                    moves.append((dest, src))
+        dests = {dest for dest, _ in moves}
+        if not any(src in dests for _, src in moves):
+            return ["    {} = {};".format(dest, src) for dest, src in moves]
+        # a parallel copy: every source is read before a phi is set
+        temps = []
+        for _ in moves:
+            self.n_temps = max(self.n_temps, len(temps) + 1)
+            temps.append("t{}".format(len(temps) + 1))
+        lines = [
+            "    {} = {};".format(temp, src) for temp, (_, src) in zip(temps, moves)
+        ]
+        lines += [
+            "    {} = {};".format(dest, temp) for temp, (dest, _) in zip(temps, moves)
+        ]
+        return lines
+
+    # Instructions
+    def emit_return(self, instr):
+        for name, _, on_heap in self.arrays:
+            if on_heap:
+                self.emit("free({});".format(name))
+        if self.params is None or instr is None or instr.instr == Op.END:
+            self.emit("return 0;")
+        elif instr.ops[0] == "":
+            self.emit("return 0;")
+        else:
+            self.emit("return {};".format(self.value(instr.ops[0])))
+
+    def emit_instr(self, instr):
+        opcode = instr.instr
+        ops = [self.value(op) for op in instr.ops if not isinstance(op, str)]
+        if opcode in WRAPPED_OPS:
+            expr = "WRAP((uword){} {} (uword){})".format(
+                ops[0], BINARY_OPS[opcode], ops[1]
+            )
+        elif opcode in BINARY_OPS:
+            expr = "{} {} {}".format(ops[0], BINARY_OPS[opcode], ops[1])
+        elif opcode == Op.DIV:
+            expr = "smpl_div({}, {})".format(*ops)
+        elif opcode == Op.LOAD:
+            expr = self.address(instr.ops[0])
+        elif opcode == Op.STORE:
+            self.emit("{} = (word){};".format(self.address(instr.ops[1]), ops[0]))
+            return
+        elif opcode == Op.ALLOCA:
+            words = instr.ops[0].val // config.INTEGER_SIZE
+            name = "a{}".format(len(self.arrays) + 1)
+            on_heap = instr.ops[0].val > STACK_ARRAY_LIMIT
+            self.arrays.append((name, words, on_heap))
+            if on_heap:
+                self.emit("{} = smpl_calloc({});".format(name, words))
+            expr = "(value){}".format(name)
+        elif opcode == Op.READ:
+            expr = "smpl_read()"
+        elif opcode == Op.WRITE:
+            self.emit("smpl_write({});".format(ops[0]))
+            return
+        elif opcode == Op.WRITENL:
+            self.emit("putchar('\\n');")
+            return
+        elif opcode == Op.CALL:
+            expr = "f_{}({})".format(instr.ops[0], ", ".join(ops))
+        else:
+            raise Exception("[ERROR] Cannot lower '{}' to C".format(instr))
+        self.emit("{} = {};".format(self.value(instr), expr))
+
+
+def generate(graph):
+    # C99 source of a Graph, main() runs the program
+    functions = [
+        Lowering(subgraph, "f_" + subgraph.root.name, subgraph.params)
+        for subgraph in graph.graphs[1:]
+    ]
+    lines = [PRELUDE]
+    lines += [function.signature() + ";" for function in functions]
+    for function in functions:
+        lines += [""] + function.lower()
+    lines += [""] + Lowering(graph.graphs[0], "main", None).lower()
+    return "\n".join(lines) + "\n"
+
+
+def build(source, path, cc=None):
+    # writes path.c and compiles it to path, None if there is no compiler
+    with open(path + ".c", "w") as f:
+        f.write(source)
+    cc = cc or shutil.which("cc")
+    if cc is None:
+        return None
+    result = subprocess.run(
+        [cc] + CFLAGS + ["-o", path, path + ".c"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise Exception("[ERROR] cc failed:\n{}".format(result.stderr))
+    return path
+
+
+def run(path, stdin=None, stdout=None, timeout=None):
+    # runs a built program, returns the elapsed time
+    start = time.perf_counter()
+    result = subprocess.run(
+        [os.path.abspath(path)], stdin=stdin, stdout=stdout, timeout=timeout
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise Exception("[ERROR] {} exited with {}".format(path, result.returncode))
+    return elapsed
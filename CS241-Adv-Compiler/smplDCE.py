@@ -0,0 +1,69 @@
+import smplSSA
+
+Op = smplSSA.Op
+
+# instructions that are kept even if their value is never used
+# (read is kept too: removing it would change which input the next read gets)
+ROOT_OPS = frozenset(
+    {
+        Op.STORE,
+        Op.READ,
+        Op.WRITE,
+        Op.WRITENL,
+        Op.CALL,
+        Op.RETURN,
+        Op.BRA,
+        Op.END,
+    }
+    | smplSSA.BRANCH_OPS
+)
+
+
+class DCE:
+    # Mark-and-sweep dead code elimination over one SubGraph: everything
+    # reachable from a root through the operands is live, the rest is removed
+    def __init__(self, graph):
+        self.graph = graph
+        self.n_removed = 0
+
+    def run(self):
+        blocks = self.graph.cfg().rpo
+        live = self.mark(blocks)
+        self.sweep(blocks, live)
+        self.graph.stats["dce.removed"] += self.n_removed
+        return self
+
+    def mark(self, blocks):
+        live = set()
+        work = [
+            instr
+            for block in blocks
+            for instr in block.instrs
+            if not instr.is_empty and instr.instr in ROOT_OPS
+        ]
+        while work:
+            instr = work.pop()
+            if instr in live:
+                continue
+            live.add(instr)
+            for op in instr.ops:
+                if isinstance(op, smplSSA.Instruction) and op not in live:
+                    work.append(op)
+        return live
+
+    def sweep(self, blocks, live):
+        for block in blocks:
+            dead = [
+                instr
+                for instr in block.instrs
+                if not instr.is_empty and instr not in live
+            ]
+            if not dead:
+                continue
+            # a dead instruction is only used by other dead instructions
+            for instr in dead:
+                instr.unlink()
+            block.instrs = [
+                instr for instr in block.instrs if instr in live or instr.is_empty
+            ]
+            self.n_removed += len(dead)
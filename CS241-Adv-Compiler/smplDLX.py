@@ -0,0 +1,295 @@
+import array
+import sys
+
+import smplInterp
+
+# The DLX of the course: 32 registers (R0 is always 0), byte addresses,
+# word aligned loads and stores, three instruction formats:
+#   F1: op(6) a(5) b(5) c(16, signed)   register, register, immediate
+#   F2: op(6) a(5) b(5) unused(11) c(5) three registers
+#   F3: op(6) c(26)                     an absolute address
+# CMP sets R.a to -1, 0 or 1, the branches compare R.a with 0 and jump c
+# instructions ahead, JSR saves the return address in R31 and RET to
+# address 0 halts the machine
+ADD, SUB, MUL, DIV, MOD, CMP = 0, 1, 2, 3, 4, 5
+OR, AND, BIC, XOR, LSH, ASH, CHK = 8, 9, 10, 11, 12, 13, 14
+ADDI, SUBI, MULI, DIVI, MODI, CMPI = 16, 17, 18, 19, 20, 21
+ORI, ANDI, BICI, XORI, LSHI, ASHI, CHKI = 24, 25, 26, 27, 28, 29, 30
+LDW, LDX, POP, STW, STX, PSH = 32, 33, 34, 36, 37, 38
+BEQ, BNE, BLT, BGE, BLE, BGT, BSR = 40, 41, 42, 43, 44, 45, 46
+JSR, RET = 48, 49
+RDD, WRD, WRH, WRL = 50, 51, 52, 53
+
+MNEMONICS = {
+    ADD: "ADD", SUB: "SUB", MUL: "MUL", DIV: "DIV", MOD: "MOD", CMP: "CMP",
+    OR: "OR", AND: "AND", BIC: "BIC", XOR: "XOR", LSH: "LSH", ASH: "ASH",
+    CHK: "CHK", ADDI: "ADDI", SUBI: "SUBI", MULI: "MULI", DIVI: "DIVI",
+    MODI: "MODI", CMPI: "CMPI", ORI: "ORI", ANDI: "ANDI", BICI: "BICI",
+    XORI: "XORI", LSHI: "LSHI", ASHI: "ASHI", CHKI: "CHKI", LDW: "LDW",
+    LDX: "LDX", POP: "POP", STW: "STW", STX: "STX", PSH: "PSH", BEQ: "BEQ",
+    BNE: "BNE", BLT: "BLT", BGE: "BGE", BLE: "BLE", BGT: "BGT", BSR: "BSR",
+    JSR: "JSR", RET: "RET", RDD: "RDD", WRD: "WRD", WRH: "WRH", WRL: "WRL",
+}  # fmt: skip
+F2_OPS = frozenset(
+    {
+        ADD,
+        SUB,
+        MUL,
+        DIV,
+        MOD,
+        CMP,
+        OR,
+        AND,
+        BIC,
+        XOR,
+        LSH,
+        ASH,
+        CHK,
+        LDX,
+        STX,
+        RET,
+        RDD,
+        WRD,
+        WRH,
+    }
+)
+F3_OPS = frozenset({JSR})
+BRANCH_OPS = frozenset({BEQ, BNE, BLT, BGE, BLE, BGT, BSR})
+LOAD_OPS = frozenset({LDW, LDX, POP})
+STORE_OPS = frozenset({STW, STX, PSH})
+
+# register conventions of the generated code
+RV = 27  # the value returned by a function
+FP = 28  # frame pointer
+SP = 29  # stack pointer, the stack grows down from the end of the memory
+RA = 31  # return address
+
+# the cost model: cycles of an instruction, a taken branch costs one more
+MEMORY_CYCLES = 3
+CYCLES = {op: 1 for op in MNEMONICS}
+CYCLES.update({MUL: 2, MULI: 2, DIV: 10, DIVI: 10, MOD: 10, MODI: 10})
+CYCLES.update({op: MEMORY_CYCLES for op in LOAD_OPS | STORE_OPS})
+CYCLES.update({JSR: 2, RET: 2})
+TAKEN_BRANCH_CYCLES = 1
+
+
+def f1(op, a, b, c):
+    if not -0x8000 <= c < 0x8000:
+        raise Exception("[ERROR] DLX immediate out of range: {}".format(c))
+    return op << 26 | a << 21 | b << 16 | (c & 0xFFFF)
+
+
+def f2(op, a, b, c):
+    return op << 26 | a << 21 | b << 16 | c
+
+
+def f3(op, c):
+    return op << 26 | (c & 0x3FFFFFF)
+
+
+def decode(word):
+    # -> (op, a, b, c), c sign extended for F1
+    op = (word >> 26) & 0x3F
+    if op in F3_OPS:
+        return op, 0, 0, word & 0x3FFFFFF
+    a = (word >> 21) & 0x1F
+    b = (word >> 16) & 0x1F
+    if op in F2_OPS:
+        return op, a, b, word & 0x1F
+    c = word & 0xFFFF
+    return op, a, b, c - 0x10000 if c & 0x8000 else c
+
+
+def disassemble(word):
+    op, a, b, c = decode(word)
+    name = MNEMONICS.get(op, "?{}".format(op))
+    if op in F3_OPS:
+        return "{} {}".format(name, c)
+    if op in F2_OPS:
+        return "{} R{} R{} R{}".format(name, a, b, c)
+    return "{} R{} R{} {}".format(name, a, b, c)
+
+
+def wrap(value):
+    # registers are 32 bits wide
+    return (value + 0x80000000) % 0x100000000 - 0x80000000
+
+
+class Simulator:
+    # Runs DLX words loaded at address 0. Every word is decoded the first
+    # time it runs and kept in a cache indexed by its word address (a store
+    # to it drops the entry). Counts instructions, cycles (see CYCLES) and
+    # the words loaded and stored, the memory traffic
+    def __init__(
+        self, program, stdin=None, stdout=None, memory_size=smplInterp.MEMORY_SIZE
+    ):
+        if len(program) > memory_size:
+            raise Exception("[ERROR] The program does not fit in the DLX memory")
+        self.memory = array.array("i", bytes(4 * memory_size))
+        self.memory[: len(program)] = array.array("i", [wrap(word) for word in program])
+        self.decoded = [None] * memory_size
+        self.registers = [0] * 32
+        self.registers[SP] = 4 * memory_size
+        self.stdout = stdout or sys.stdout
+        self.numbers = smplInterp.read_numbers(stdin or sys.stdin)
+        self.executed = 0
+        self.cycles = 0
+        self.loads = 0
+        self.stores = 0
+
+    def run(self):
+        memory = self.memory
+        decoded = self.decoded
+        R = self.registers
+        pc = 0  # word address
+        executed = cycles = loads = stores = 0
+        try:
+            while True:
+                instr = decoded[pc]
+                if instr is None:
+                    instr = decoded[pc] = decode(memory[pc] & 0xFFFFFFFF)
+                op, a, b, c = instr
+                executed += 1
+                cycles += CYCLES[op]
+                next_pc = pc + 1
+                if op < 16:  # F2 arithmetic
+                    x, y = R[b], R[c]
+                    if op == ADD:
+                        value = x + y
+                    elif op == SUB:
+                        value = x - y
+                    elif op == MUL:
+                        value = x * y
+                    elif op == CMP:
+                        value = (x > y) - (x < y)
+                    else:
+                        value = self.alu(op, x, y)
+                    if a:
+                        R[a] = wrap(value)
+                elif op < 32:  # F1 arithmetic
+                    x = R[b]
+                    if op == ADDI:
+                        value = x + c
+                    elif op == SUBI:
+                        value = x - c
+                    elif op == CMPI:
+                        value = (x > c) - (x < c)
+                    else:
+                        value = self.alu(op - 16, x, c)
+                    if a:
+                        R[a] = wrap(value)
+                elif op < 40:  # memory
+                    if op == LDW:
+                        R[a] = memory[(R[b] + c) >> 2]
+                        loads += 1
+                    elif op == LDX:
+                        R[a] = memory[(R[b] + R[c]) >> 2]
+                        loads += 1
+                    elif op == STW:
+                        self.store((R[b] + c) >> 2, R[a])
+                        stores += 1
+                    elif op == STX:
+                        self.store((R[b] + R[c]) >> 2, R[a])
+                        stores += 1
+                    elif op == PSH:
+                        R[b] += c
+                        self.store(R[b] >> 2, R[a])
+                        stores += 1
+                    elif op == POP:
+                        R[a] = memory[R[b] >> 2]
+                        R[b] += c
+                        loads += 1
+                    else:
+                        raise Exception("[ERROR] Illegal DLX instruction {}".format(op))
+                    R[0] = 0
+                elif op < 48:  # branches
+                    value = R[a]
+                    if op == BEQ:
+                        taken = value == 0
+                    elif op == BNE:
+                        taken = value != 0
+                    elif op == BLT:
+                        taken = value < 0
+                    elif op == BGE:
+                        taken = value >= 0
+                    elif op == BLE:
+                        taken = value <= 0
+                    elif op == BGT:
+                        taken = value > 0
+                    else:  # BSR
+                        R[RA] = next_pc * 4
+                        taken = True
+                    if taken:
+                        next_pc = pc + c
+                        cycles += TAKEN_BRANCH_CYCLES
+                elif op == JSR:
+                    R[RA] = next_pc * 4
+                    next_pc = c >> 2
+                elif op == RET:
+                    if R[c] == 0:
+                        break
+                    next_pc = R[c] >> 2
+                elif op == RDD:
+                    number = next(self.numbers, None)
+                    if number is None:
+                        raise Exception("[ERROR] InputNum: no more input")
+                    if a:
+                        R[a] = wrap(number)
+                elif op == WRD:
+                    self.stdout.write("{} ".format(R[b]))
+                elif op == WRH:
+                    self.stdout.write("{:x} ".format(R[b] & 0xFFFFFFFF))
+                elif op == WRL:
+                    self.stdout.write("\n")
+                else:
+                    raise Exception("[ERROR] Illegal DLX instruction {}".format(op))
+                pc = next_pc
+        except IndexError:
+            raise Exception(
+                "[ERROR] DLX memory access out of range at {}".format(pc * 4)
+            )
+        finally:
+            self.executed += executed
+            self.cycles += cycles
+            self.loads += loads
+            self.stores += stores
+            self.stdout.flush()
+        return self
+
+    def alu(self, op, x, y):
+        # the rarely used F2 operations, F1 ones passed as op - 16
+        if op in (DIV, MOD):
+            if y == 0:
+                raise Exception("[ERROR] Division by zero")
+            q = smplInterp.divide(x, y)
+            return q if op == DIV else x - q * y
+        if op == MUL:
+            return x * y
+        if op == SUB:
+            return x - y
+        if op == OR:
+            return x | y
+        if op == AND:
+            return x & y
+        if op == BIC:
+            return x & ~y
+        if op == XOR:
+            return x ^ y
+        if op == LSH:
+            return x << y if y >= 0 else (x & 0xFFFFFFFF) >> -y
+        if op == ASH:
+            return x << y if y >= 0 else x >> -y
+        if op == CHK:
+            if not 0 <= x < y:
+                raise Exception("[ERROR] Index {} out of bounds {}".format(x, y))
+            return x
+        raise Exception("[ERROR] Illegal DLX instruction {}".format(op))
+
+    def store(self, address, value):
+        self.memory[address] = wrap(value)
+        self.decoded[address] = None
+
+    def report(self):
+        return "[RUN] dlx: {} instructions, {} cycles, {} loads, {} stores".format(
+            self.executed, self.cycles, self.loads, self.stores
+        )
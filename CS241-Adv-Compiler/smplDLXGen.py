@@ -0,0 +1,405 @@
+import config
+import smplDLX as dlx
+import smplSSA
+
+Op = smplSSA.Op
+
+# registers the allocation never hands out: operands that are not in a
+# register are loaded into them, RV doubles as the third one
+SCRATCH = (25, 26, dlx.RV)
+# where a value lives
+REGISTER, SLOT, IMMEDIATE = range(3)
+
+# instructions without a value
+NO_VALUE_OPS = smplSSA.BRANCH_OPS | {
+    Op.EMPTY,
+    Op.BRA,
+    Op.STORE,
+    Op.WRITE,
+    Op.WRITENL,
+    Op.RETURN,
+    Op.END,
+}
+ALU_OPS = {
+    Op.ADD: dlx.ADD,
+    Op.SUB: dlx.SUB,
+    Op.MUL: dlx.MUL,
+    Op.DIV: dlx.DIV,
+    Op.CMP: dlx.CMP,
+    Op.ADDA: dlx.ADD,
+}
+BRANCHES = {
+    Op.BEQ: (dlx.BEQ, dlx.BNE),
+    Op.BNE: (dlx.BNE, dlx.BEQ),
+    Op.BLT: (dlx.BLT, dlx.BGE),
+    Op.BGE: (dlx.BGE, dlx.BLT),
+    Op.BLE: (dlx.BLE, dlx.BGT),
+    Op.BGT: (dlx.BGT, dlx.BLE),
+}
+
+# the frame of a call: the arguments pushed by the caller (the first one
+# highest), the return address and the caller's FP, then the slots of the
+# values and the arrays below FP
+#   FP + 8 + 4 * i   argument n - 1 - i
+#   FP + 4           return address
+#   FP               caller's FP
+#   FP - 4 * (k + 1) slot k
+#   ...              the arrays, zeroed on entry, down to SP
+ARGS_OFFSET = 8
+
+
+def fits(value):
+    return -0x8000 <= value < 0x8000
+
+
+def has_value(instr):
+    return not instr.is_empty and instr.instr not in NO_VALUE_OPS
+
+
+class SlotAllocation:
+    # The simple allocation: every value lives in its own slot of the frame
+    # and is loaded into a scratch register by every instruction using it
+    def __init__(self, graph):
+        self.graph = graph
+        self.slots = {}  # instr -> slot
+        for block in graph.cfg().rpo:
+            for instr in block.instrs:
+                if has_value(instr):
+                    self.slots[instr] = len(self.slots)
+
+    @property
+    def frame(self):
+        # bytes of the value slots
+        return config.INTEGER_SIZE * len(self.slots)
+
+    def location(self, instr):
+        return SLOT, -config.INTEGER_SIZE * (self.slots[instr] + 1)
+
+    def live_across(self, call):
+        # registers to keep over a call, none without registers
+        return ()
+
+
+class Lowering:
+    # Lowers one SubGraph to DLX words: its blocks in the order they are
+    # printed, phis lowered to parallel copies on the edges (sequenced, a
+    # cycle broken through a scratch register). Branch offsets are patched
+    # once the blocks are placed, calls once the functions are
+    def __init__(self, graph, name, allocation):
+        self.graph = graph
+        self.name = name
+        self.allocation = allocation
+        params = graph.params or ()
+        self.params = {
+            param: ARGS_OFFSET + config.INTEGER_SIZE * (len(params) - 1 - i)
+            for i, param in enumerate(params)
+        }
+        self.arrays = {}  # alloca -> its offset in the arrays
+        self.arrays_size = 0
+        self.code = []
+        self.starts = {}  # block -> index of its first word
+        self.fixups = []  # (index, branch opcode, register, block)
+        self.calls = []  # (index, function name)
+
+    def lower(self):
+        blocks = sorted(self.graph.cfg().rpo, key=lambda block: block.label)
+        for block in blocks:
+            for instr in block.instrs:
+                if not instr.is_empty and instr.instr == Op.ALLOCA:
+                    self.arrays[instr] = self.arrays_size
+                    self.arrays_size += instr.ops[0].val
+        self.emit_prologue()
+        for i, block in enumerate(blocks):
+            self.starts[block] = len(self.code)
+            self.emit_block(block, blocks[i + 1] if i + 1 < len(blocks) else None)
+        for index, opcode, reg, block in self.fixups:
+            self.code[index] = dlx.f1(opcode, reg, 0, self.starts[block] - index)
+        return self.code
+
+    def emit(self, word):
+        self.code.append(word)
+
+    # Values
+    def source(self, op):
+        # the location of an operand
+        if isinstance(op, smplSSA.Instruction):
+            return self.allocation.location(op)
+        if isinstance(op, smplSSA.ImmediateOp):
+            # an uninitialized variable reads as 0
+            return IMMEDIATE, 0 if op.un_init else dlx.wrap(op.val)
+        if isinstance(op, smplSSA.ArgumentOp):
+            return SLOT, self.params[op.name]
+        if op == "":  # return without a value
+            return IMMEDIATE, 0
+        raise Exception("[ERROR] Cannot lower the operand '{}' to DLX".format(op))
+
+    def immediate(self, op):
+        # the value of an immediate operand that fits an F1 instruction
+        kind, value = self.source(op)
+        return value if kind == IMMEDIATE and fits(value) else None
+
+    def load_immediate(self, reg, value):
+        if fits(value):
+            self.emit(dlx.f1(dlx.ADDI, reg, 0, value))
+            return
+        high = (value + 0x8000) >> 16
+        low = value - (high << 16)
+        high = ((high + 0x8000) & 0xFFFF) - 0x8000
+        self.emit(dlx.f1(dlx.ADDI, reg, 0, high))
+        self.emit(dlx.f1(dlx.LSHI, reg, reg, 16))
+        self.emit(dlx.f1(dlx.ADDI, reg, reg, low))
+
+    def load(self, location, scratch):
+        # a register holding the value at location, scratch if it is not in one
+        kind, n = location
+        if kind == REGISTER:
+            return n
+        if kind == IMMEDIATE:
+            if n == 0:
+                return 0
+            self.load_immediate(scratch, n)
+        else:
+            self.emit(dlx.f1(dlx.LDW, scratch, dlx.FP, n))
+        return scratch
+
+    def operand(self, op, scratch):
+        return self.load(self.source(op), scratch)
+
+    def result(self, instr):
+        # the register an instruction computes its value in
+        kind, n = self.allocation.location(instr)
+        return n if kind == REGISTER else SCRATCH[0]
+
+    def save(self, instr, reg):
+        kind, n = self.allocation.location(instr)
+        if kind == SLOT:
+            self.emit(dlx.f1(dlx.STW, reg, dlx.FP, n))
+        elif n != reg:
+            self.emit(dlx.f2(dlx.ADD, n, reg, 0))
+
+    def move(self, dest, src):
+        kind, n = dest
+        if kind == REGISTER:
+            reg = self.load(src, n)
+            if reg != n:
+                self.emit(dlx.f2(dlx.ADD, n, reg, 0))
+        else:
+            self.emit(dlx.f1(dlx.STW, self.load(src, SCRATCH[0]), dlx.FP, n))
+
+    def sub_sp(self, size, sign):
+        if fits(size):
+            self.emit(dlx.f1(dlx.ADDI, dlx.SP, dlx.SP, sign * size))
+        else:
+            self.load_immediate(SCRATCH[0], sign * size)
+            self.emit(dlx.f2(dlx.ADD, dlx.SP, dlx.SP, SCRATCH[0]))
+
+    # Calls
+    def emit_prologue(self):
+        self.emit(dlx.f1(dlx.PSH, dlx.RA, dlx.SP, -4))
+        self.emit(dlx.f1(dlx.PSH, dlx.FP, dlx.SP, -4))
+        self.emit(dlx.f2(dlx.ADD, dlx.FP, dlx.SP, 0))
+        self.sub_sp(self.allocation.frame + self.arrays_size, -1)
+        if self.arrays_size:
+            # zero the arrays, from SP up to the value slots
+            p, end, cond = SCRATCH
+            self.emit(dlx.f2(dlx.ADD, p, dlx.SP, 0))
+            self.emit(dlx.f1(dlx.SUBI, end, dlx.FP, self.allocation.frame))
+            self.emit(dlx.f1(dlx.STW, 0, p, 0))
+            self.emit(dlx.f1(dlx.ADDI, p, p, config.INTEGER_SIZE))
+            self.emit(dlx.f2(dlx.CMP, cond, p, end))
+            self.emit(dlx.f1(dlx.BLT, cond, 0, -3))
+
+    def emit_return(self, value):
+        reg = self.operand(value, dlx.RV)
+        if reg != dlx.RV:
+            self.emit(dlx.f2(dlx.ADD, dlx.RV, reg, 0))
+        self.emit(dlx.f2(dlx.ADD, dlx.SP, dlx.FP, 0))
+        self.emit(dlx.f1(dlx.POP, dlx.FP, dlx.SP, 4))
+        self.emit(dlx.f1(dlx.POP, dlx.RA, dlx.SP, 4))
+        # main returns to address 0, which halts
+        self.emit(dlx.f2(dlx.RET, 0, 0, dlx.RA))
+
+    def emit_call(self, instr):
+        saved = self.allocation.live_across(instr)
+        for reg in saved:
+            self.emit(dlx.f1(dlx.PSH, reg, dlx.SP, -4))
+        args = instr.ops[1:]
+        for arg in args:
+            self.emit(dlx.f1(dlx.PSH, self.operand(arg, SCRATCH[0]), dlx.SP, -4))
+        self.calls.append((len(self.code), instr.ops[0]))
+        self.emit(None)  # JSR, patched by generate
+        if args:
+            self.sub_sp(config.INTEGER_SIZE * len(args), 1)
+        self.save(instr, dlx.RV)
+        for reg in reversed(saved):
+            self.emit(dlx.f1(dlx.POP, reg, dlx.SP, 4))
+
+    # Control flow
+    def emit_block(self, block, next_block):
+        for instr in block.instrs:
+            if instr.is_empty or instr.instr == Op.PHI:
+                continue
+            opcode = instr.instr
+            if opcode in smplSSA.BRANCH_OPS:
+                self.emit_branch(block, instr, next_block)
+                return
+            if opcode == Op.BRA:
+                self.emit_goto(block, instr.ops[0], next_block)
+                return
+            if opcode == Op.RETURN:
+                self.emit_return(instr.ops[0])
+                return
+            if opcode == Op.END:
+                self.emit_return("")
+                return
+            self.emit_instr(instr)
+        if block.succs:
+            self.emit_goto(block, block.succs[0], next_block)
+        else:
+            self.emit_return("")
+
+    def emit_branch(self, block, branch, next_block):
+        taken = branch.ops[1]
+        fall = [succ for succ in block.succs if succ is not taken][0]
+        opcode, negated = BRANCHES[branch.instr]
+        cond = self.operand(branch.ops[0], SCRATCH[0])
+        taken_moves = self.moves(block, taken)
+        fall_moves = self.moves(block, fall)
+        if not taken_moves and (fall_moves or taken is not next_block):
+            self.jump(opcode, cond, taken)
+            self.emit_copies(fall_moves)
+            self.jump_unless_next(fall, next_block)
+        elif not fall_moves:
+            self.jump(negated, cond, fall)
+            self.emit_copies(taken_moves)
+            self.jump_unless_next(taken, next_block)
+        else:
+            skip = len(self.code)
+            self.emit(None)
+            self.emit_copies(taken_moves)
+            self.jump(dlx.BEQ, 0, taken)
+            self.code[skip] = dlx.f1(negated, cond, 0, len(self.code) - skip)
+            self.emit_copies(fall_moves)
+            self.jump_unless_next(fall, next_block)
+
+    def emit_goto(self, block, succ, next_block):
+        self.emit_copies(self.moves(block, succ))
+        self.jump_unless_next(succ, next_block)
+
+    def jump(self, opcode, reg, block):
+        self.fixups.append((len(self.code), opcode, reg, block))
+        self.emit(None)
+
+    def jump_unless_next(self, block, next_block):
+        if block is not next_block:
+            self.jump(dlx.BEQ, 0, block)
+
+    def moves(self, block, succ):
+        # dest location -> source location of the phis of succ on this edge
+        index = succ.preds.index(block)
+        moves = {}
+        for instr in succ.instrs:
+            if not instr.is_empty and instr.instr == Op.PHI:
+                dest = self.allocation.location(instr)
+                src = self.source(instr.ops[index])
+                if dest != src:
+                    moves[dest] = src
+        return moves
+
+    def emit_copies(self, moves):
+        # a parallel copy: a move is done once no other move reads its dest,
+        # a cycle is broken by saving one dest in a scratch register
+        moves = dict(moves)
+        temp = (REGISTER, SCRATCH[1])
+        while moves:
+            ready = [dest for dest in moves if dest not in moves.values()]
+            if ready:
+                for dest in ready:
+                    self.move(dest, moves.pop(dest))
+                continue
+            dest = next(iter(moves))
+            self.move(temp, dest)
+            moves = {d: temp if src == dest else src for d, src in moves.items()}
+
+    # Instructions
+    def emit_instr(self, instr):
+        opcode = instr.instr
+        ops = instr.ops
+        if opcode in ALU_OPS:
+            self.emit_alu(instr)
+        elif opcode == Op.LOAD:
+            dest = self.result(instr)
+            self.emit(dlx.f1(dlx.LDW, dest, self.operand(ops[0], SCRATCH[0]), 0))
+            self.save(instr, dest)
+        elif opcode == Op.STORE:
+            value = self.operand(ops[0], SCRATCH[0])
+            addr = self.operand(ops[1], SCRATCH[1])
+            self.emit(dlx.f1(dlx.STW, value, addr, 0))
+        elif opcode == Op.ALLOCA:
+            dest = self.result(instr)
+            # the arrays end at the value slots
+            offset = self.arrays[instr] - self.arrays_size - self.allocation.frame
+            if fits(offset):
+                self.emit(dlx.f1(dlx.ADDI, dest, dlx.FP, offset))
+            else:
+                self.load_immediate(SCRATCH[1], offset)
+                self.emit(dlx.f2(dlx.ADD, dest, dlx.FP, SCRATCH[1]))
+            self.save(instr, dest)
+        elif opcode == Op.READ:
+            dest = self.result(instr)
+            self.emit(dlx.f2(dlx.RDD, dest, 0, 0))
+            self.save(instr, dest)
+        elif opcode == Op.WRITE:
+            self.emit(dlx.f2(dlx.WRD, 0, self.operand(ops[0], SCRATCH[0]), 0))
+        elif opcode == Op.WRITENL:
+            self.emit(dlx.f1(dlx.WRL, 0, 0, 0))
+        elif opcode == Op.CALL:
+            self.emit_call(instr)
+        else:
+            raise Exception("[ERROR] Cannot lower '{}' to DLX".format(instr))
+
+    def emit_alu(self, instr):
+        a, b = instr.ops
+        opcode = ALU_OPS[instr.instr]
+        if opcode == dlx.CMP and any(
+            use.instr not in smplSSA.BRANCH_OPS for use in instr.uses
+        ):
+            # the branches only look at the sign, anything else at a - b
+            opcode = dlx.SUB
+        if opcode in (dlx.ADD, dlx.MUL) and self.immediate(a) is not None:
+            a, b = b, a
+        dest = self.result(instr)
+        left = self.operand(a, SCRATCH[0])
+        value = self.immediate(b)
+        if value is not None:
+            self.emit(dlx.f1(opcode + 16, dest, left, value))
+        else:
+            self.emit(dlx.f2(opcode, dest, left, self.operand(b, SCRATCH[1])))
+        self.save(instr, dest)
+
+
+def generate(graph):
+    # DLX words of a Graph loaded at address 0: main first, it starts the
+    # program, then the functions. A SubGraph without registers allocated
+    # keeps all its values in memory
+    functions = []
+    for subgraph in graph.graphs:
+        name = subgraph.root.name if functions else "main"
+        allocation = subgraph.allocation or SlotAllocation(subgraph)
+        functions.append(Lowering(subgraph, name, allocation))
+    words = []
+    addresses = {}
+    for function in functions:
+        if function is not functions[0]:
+            addresses[function.name] = len(words) * 4
+        words += function.lower()
+    offset = 0
+    for function in functions:
+        for index, name in function.calls:
+            if name not in addresses:
+                raise Exception(
+                    "[ERROR] Calling an undefined function '{}'".format(name)
+                )
+            words[offset + index] = dlx.f3(dlx.JSR, addresses[name])
+        offset += len(function.code)
+    return words
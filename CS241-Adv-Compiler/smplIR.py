@@ -1,6 +1,26 @@
+import contextlib
+import io
+import os
+import sys
+
 import graphviz
 
+import smplCGen
+import smplDCE
+import smplDLX
+import smplDLXGen
+import smplIVSR
+import smplInterp
+import smplLICM
+import smplMemSSA
+import smplPRE
+import smplPhiElim
+import smplPyGen
+import smplRegAlloc
+import smplSCCP
+import smplSROA
 import smplSSA
+import smplUnroll
 
 
 class DotGraph:
@@ -11,7 +31,7 @@ class DotGraph:
         self.graph_label = graph_label
         self.block_labels = []
         self.block_offset = 0
-        self.uninit_vars = set()
+        self.uninit_vars = {}  # dict as an ordered set, for a stable output
         self.block_label_table = {}  # orig label -> printout label
         self.graph_name = graph_name
         # for fixing instruction order
@@ -26,7 +46,7 @@ class DotGraph:
         for instr in instrs:
             for op in instr.ops:
                 if isinstance(op, smplSSA.ImmediateOp) and op.un_init:
-                    self.uninit_vars.add(op.name)
+                    self.uninit_vars[op.name] = None
 
     def print_uninit_var(self):
         for warn in self.uninit_vars:
@@ -42,46 +62,118 @@ class DotGraph:
             self.block_label_table[keys[i]] = i + 1
         return self.block_labels
 
+    def instr_str(self, instr):
+        # branch targets refer to blocks, print their relabeled number
+        text = instr.format(
+            lambda block: self.block_label_table.get(block.label, block.label)
+        )
+        if self.Graph.allocation is not None:
+            # the register of the value, or its slot if it was spilled
+            where = self.Graph.allocation.annotation(instr)
+            if where is not None:
+                text += " [{}]".format(where)
+        return text
+
     def instr_reorder(self, block):
-        reorder_table_keys = self.graph_reorder_table.keys()
+        # operands refer to their instructions, they follow automatically
         for instr in block.instrs:
-            if instr.i in reorder_table_keys and not instr.has_reordered:
+            if instr.i in self.graph_reorder_table:
                 instr.i = self.graph_reorder_table[instr.i]
-                instr.has_reordered = True
 
-            # reorder arguments
-            for arg in instr.ops:
-                if isinstance(arg, smplSSA.InstructionOp):
-                    if arg.i in reorder_table_keys and not arg.has_reordered:
-                        arg.i = self.graph_reorder_table[arg.i]
-                        arg.has_reordered = True
+    def print_stats(self):
+        for name, val in sorted(self.Graph.stats.items()):
+            print("[STATS] [{}] {}: {}".format(self.graph_name, name, val))
+        self.print_pre_report()
+
+    def print_pre_report(self):
+        # one line for every expression PRE moved: the edges it was inserted
+        # on, the blocks it was removed from and, for each edge into them,
+        # whether that path evaluates it once less now
+        label = lambda block: self.block_label_table.get(block.label, block.label)
+        for expr, inserted, deleted in self.Graph.pre_report:
+            parts = [
+                "inserted on BB{}->BB{}".format(label(pred), label(block))
+                for pred, block in inserted
+            ]
+            for block, paths in deleted:
+                edges = [
+                    "saved {} on BB{}->BB{}".format(
+                        int(saved), label(pred), label(block)
+                    )
+                    for pred, saved in paths
+                ]
+                parts.append(
+                    "removed from BB{} ({})".format(label(block), ", ".join(edges))
+                )
+            print(
+                "[PRE] [{}] {}: {}".format(
+                    self.graph_name,
+                    expr.format(label).split(": ", 1)[1],
+                    "; ".join(parts),
+                )
+            )
 
-    def build_graph(self, constant_elimination=True):
-        block_stack = set([self.Block])
+    def fold_constants(self):
+        for block in self.Graph.cfg().rpo:
+            block.constant_elimination()
+
+    def build_graph(
+        self,
+        constant_elimination=True,
+        sccp=False,
+        dce=False,
+        licm=False,
+        ivsr=False,
+        pre=False,
+        memssa=False,
+        sroa=False,
+        phielim=False,
+        unroll=0,
+        unroll_factor=smplUnroll.UNROLL_FACTOR,
+        regs=0,
+    ):
+        if sccp:
+            # replaces the constant elimination of each block
+            smplSCCP.SCCP(self.Graph).run()
+        elif constant_elimination:
+            self.fold_constants()
+        fold = constant_elimination or sccp
+        if phielim:
+            # a removed phi can make an instruction constant, and the
+            # folded instruction a phi trivial
+            while smplPhiElim.PhiElimination(self.Graph).run().n_removed and fold:
+                self.fold_constants()
+        if unroll:
+            smplUnroll.Unroll(self.Graph, unroll, unroll_factor).run()
+        if sroa:
+            smplSROA.SROA(self.Graph).run()
+        if memssa:
+            smplMemSSA.LoadElimination(self.Graph).run()
+        if (sroa or memssa) and fold:
+            # stored constants that reach a load directly can be folded now
+            self.fold_constants()
+        if pre:
+            smplPRE.PRE(self.Graph).run()
+        if licm:
+            smplLICM.LICM(self.Graph).run()
+        if ivsr:
+            smplIVSR.IVSR(self.Graph).run()
+        if dce:
+            smplDCE.DCE(self.Graph).run()
+        if regs:
+            # after every pass, the code does not change anymore
+            smplRegAlloc.RegisterAllocation(self.Graph, regs).run()
         block_table = {}  # The table that will be used for outputing the result
 
-        while block_stack:  # Using DFS to print each block
-            # A new block found!
-            block = block_stack.pop()
-
-            # Do constant elimination
-            if constant_elimination:
-                block.constant_elimination()
-
+        for block in self.Graph.cfg().rpo:  # every reachable block
             # No instruction in this block, insert empty placement
             if len(block.instrs) == 0:
                 self.Graph.set_current_block(block)
-                self.Graph.emit("\<empty\>", is_empty=True)
+                self.Graph.emit(smplSSA.Op.EMPTY, is_empty=True)
 
             # Add this block to the table, so that we can process it later
             block_table[block.label] = block
 
-            for _, children in block.children.items():
-                # DFS, add children to the stack
-                for child in children:
-                    if child.label not in block_table.keys():
-                        block_stack.add(child)
-
         defines = []
         connection = []
         # Start parsing block table by block label
@@ -91,24 +183,27 @@ class DotGraph:
         block_labels = self.fix_block_labels_order()
 
         # Reorder instructions
-        if constant_elimination:
+        optimized = any(
+            (constant_elimination, sccp, dce, licm, ivsr, pre, memssa, sroa, phielim)
+        )
+        if optimized or unroll:
             instr_reorder_i = 1
             for block_idx in block_labels:
                 block = block_table[block_idx]
                 instr_reorder_i = block.build_instr_reorder_table(
                     self.graph_reorder_table, instr_reorder_i
                 )
+            # Start reordering for the instructions (all blocks before printing,
+            # an operand might refer to an instruction of a later block)
+            for block_idx in block_labels:
+                self.instr_reorder(block_table[block_idx])
 
         # Reorder block labels
         for block_idx in block_labels:
             block = block_table[block_idx]
 
-            # Start reordering for the instructions in this block (if constant elimination is enabled)
-            if constant_elimination:
-                self.instr_reorder(block)
-
             # get instrs of the block
-            block_instrs = list(map(str, block.instrs))
+            block_instrs = list(map(self.instr_str, block.instrs))
 
             # print warning if uninitialized variables found
             self.check_uninit_var(block.instrs)
@@ -175,7 +270,27 @@ class DotGraph:
         return code, num_block_labels
 
 
-def Output(Graph=None, fn="", view=True, output_png=False, constant_elimination=True):
+def Output(
+    Graph=None,
+    fn="",
+    view=True,
+    output_png=False,
+    constant_elimination=True,
+    sccp=False,
+    dce=False,
+    licm=False,
+    ivsr=False,
+    pre=False,
+    memssa=False,
+    sroa=False,
+    phielim=False,
+    unroll=0,
+    unroll_factor=smplUnroll.UNROLL_FACTOR,
+    regs=0,
+    stats=False,
+    run=None,
+    cache_key=None,
+):
     if not Graph:
         raise ValueError("Graph object not specified")
     id = 0
@@ -207,14 +322,60 @@ def Output(Graph=None, fn="", view=True, output_png=False, constant_elimination=
     block_codes = []
     graph_offset = 0
 
-    # Draw other blocks in the main
-    for graph in output_list:
-        graph.set_block_offset(graph_offset)
-        code, block_offset = graph.build_graph(
-            constant_elimination=constant_elimination
-        )
-        graph_offset += block_offset
-        block_codes.append(code)
+    # what is printed while compiling is kept with a cached program, to
+    # print it again when the program runs from the cache
+    diagnostics = io.StringIO()
+    capture = contextlib.redirect_stdout(diagnostics)
+    with capture if cache_key is not None else contextlib.nullcontext():
+        # Draw other blocks in the main
+        for graph in output_list:
+            graph.set_block_offset(graph_offset)
+            code, block_offset = graph.build_graph(
+                constant_elimination=constant_elimination,
+                sccp=sccp,
+                dce=dce,
+                licm=licm,
+                ivsr=ivsr,
+                pre=pre,
+                memssa=memssa,
+                sroa=sroa,
+                phielim=phielim,
+                unroll=unroll,
+                unroll_factor=unroll_factor,
+                regs=regs,
+            )
+            if stats:
+                graph.print_stats()
+            graph_offset += block_offset
+            block_codes.append(code)
+    sys.stdout.write(diagnostics.getvalue())
+
+    if run == "c":
+        # written next to the drawing, built and run if there is a cc
+        path = os.path.splitext(fn)[0]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        exe = smplCGen.build(smplCGen.generate(Graph), path)
+        if exe is None:
+            print("[RUN] no C compiler, wrote {}.c".format(path), file=sys.stderr)
+            return
+        sys.stdout.flush()
+        print("[RUN] c backend: {:.3f} s".format(smplCGen.run(exe)), file=sys.stderr)
+        return
+    if run == "dlx":
+        machine = smplDLX.Simulator(smplDLXGen.generate(Graph)).run()
+        print(machine.report(), file=sys.stderr)
+        return
+    if run == "python":
+        code = smplPyGen.compile_graph(Graph)
+        if cache_key is not None:
+            smplPyGen.CodeCache().store(cache_key, code, diagnostics.getvalue())
+        print(smplPyGen.Runtime().run(code).report(), file=sys.stderr)
+        return
+    if run:
+        # execute the optimized program instead of drawing it
+        interpreter = smplInterp.Interpreter(Graph).run()
+        print(interpreter.report(), file=sys.stderr)
+        return
 
     output = "digraph G {{\n{}\n}}".format("\n".join(block_codes))
     print(output)
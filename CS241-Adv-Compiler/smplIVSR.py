@@ -0,0 +1,269 @@
+import smplSSA
+
+Op = smplSSA.Op
+
+LINEAR_OPS = frozenset({Op.ADD, Op.SUB, Op.MUL, Op.ADDA})
+
+
+# A linear form is (phi, scale, const, terms): the value is
+# scale * phi + const + sum(coef * op for op, coef in terms), with phi a
+# basic induction variable (None for loop invariants) and terms a dict of
+# loop invariant operands -> coefficient
+def add_forms(x, y, sign=1):
+    if x[0] is not None and y[0] is not None and x[0] is not y[0]:
+        return None
+    terms = dict(x[3])
+    for op, coef in y[3].items():
+        terms[op] = terms.get(op, 0) + sign * coef
+        if terms[op] == 0:
+            del terms[op]
+    return (x[0] or y[0], x[1] + sign * y[1], x[2] + sign * y[2], terms)
+
+
+def scale_form(x, k):
+    return (x[0], x[1] * k, x[2] * k, {op: coef * k for op, coef in x[3].items()})
+
+
+def is_constant(x):
+    return x[0] is None and not x[3]
+
+
+def is_address(op):
+    return isinstance(op, smplSSA.Instruction) and op.instr in (Op.ALLOCA, Op.ADDA)
+
+
+class IVSR:
+    # Induction variable strength reduction: a basic induction variable is a
+    # loop header phi stepped by a constant (i = phi(i0, i + c)). Values
+    # linear in it, like the mul/add/mul/adda chain of an array access,
+    # become a new header phi stepped by a constant instead, and a loop
+    # exit cmp on the induction variable is rewritten to use the new phi
+    # (linear-function test replacement), so the old variable can go away
+    def __init__(self, graph):
+        self.graph = graph
+        self.n_reduced = 0
+        self.n_replaced_tests = 0
+        self.emitted = {}
+
+    def run(self):
+        cfg = self.graph.cfg()
+        for loop in cfg.loop_postorder():
+            preheader = loop.preheader()
+            if preheader is None or len(loop.header.preds) != 2:
+                continue
+            blocks = [block for block in cfg.rpo if block in loop.blocks]
+            self.reduce(loop, blocks, preheader)
+        self.graph.stats["ivsr.reduced"] += self.n_reduced
+        self.graph.stats["ivsr.tests_replaced"] += self.n_replaced_tests
+        return self
+
+    # Analysis
+    def basic_ivs(self, header, back, in_loop):
+        # phi -> (update instruction, step)
+        ivs = {}
+        for phi in header.instrs:
+            if phi.instr != Op.PHI:
+                continue
+            update = phi.ops[back]
+            if update not in in_loop or update.instr not in (Op.ADD, Op.SUB):
+                continue
+            left, right = update.ops
+            if left is phi and self.constant(right) is not None:
+                step = self.constant(right)
+                ivs[phi] = (update, step if update.instr == Op.ADD else -step)
+            elif right is phi and update.instr == Op.ADD:
+                if self.constant(left) is not None:
+                    ivs[phi] = (update, self.constant(left))
+        return ivs
+
+    def constant(self, op):
+        if isinstance(op, smplSSA.ImmediateOp) and not op.un_init:
+            return op.val
+        return None
+
+    def form_of(self, op, forms, in_loop):
+        if op in forms:
+            return forms[op]
+        if self.constant(op) is not None:
+            return (None, 0, op.val, {})
+        if isinstance(op, smplSSA.ArgumentOp) or (
+            isinstance(op, smplSSA.Instruction) and op not in in_loop
+        ):
+            return (None, 0, 0, {op: 1})
+        return None
+
+    def linear_forms(self, blocks, ivs, in_loop):
+        forms = {phi: (phi, 1, 0, {}) for phi in ivs}
+        scaled = set()  # computed with a mul, worth reducing
+        for block in blocks:
+            for instr in block.instrs:
+                if instr.is_empty or instr.instr not in LINEAR_OPS:
+                    continue
+                left, right = (self.form_of(op, forms, in_loop) for op in instr.ops)
+                if left is None or right is None:
+                    continue
+                if instr.instr == Op.MUL:
+                    if is_constant(right):
+                        form = scale_form(left, right[2])
+                    elif is_constant(left):
+                        form = scale_form(right, left[2])
+                    else:
+                        continue
+                else:
+                    form = add_forms(left, right, -1 if instr.instr == Op.SUB else 1)
+                if form is None or form[0] is None or form[1] == 0:
+                    continue
+                forms[instr] = form
+                if instr.instr == Op.MUL or any(op in scaled for op in instr.ops):
+                    scaled.add(instr)
+        return forms, scaled
+
+    # Transformation
+    def materialize(self, form, init, code, add):
+        # instructions computing form with the phi replaced by init, summed
+        # with add: an address is offset with adda from its base, the add of
+        # numbers wraps around in C
+        scale, const, terms = form[1], form[2], dict(form[3])
+        if self.constant(init) is not None:
+            const += scale * init.val
+        else:
+            terms[init] = terms.get(init, 0) + scale
+        acc = None
+        for op, coef in sorted(terms.items(), key=lambda term: not is_address(term[0])):
+            if coef == 0:
+                continue
+            if coef != 1:
+                op = self.emit(code, Op.MUL, op, smplSSA.ImmediateOp(coef))
+            acc = op if acc is None else self.emit_add(code, add, acc, op)
+        if acc is None:
+            return smplSSA.ImmediateOp(const)
+        if const != 0:
+            acc = self.emit_add(code, add, acc, smplSSA.ImmediateOp(const))
+        return acc
+
+    def emit_add(self, code, add, acc, op):
+        # adda takes the offset first, then the address
+        if add == Op.ADDA:
+            return self.emit(code, add, op, acc)
+        return self.emit(code, add, acc, op)
+
+    def emit(self, code, opcode, *ops):
+        # the same preheader computation is only emitted once
+        key = (opcode,) + ops
+        instr = self.emitted.get(key)
+        if instr is None:
+            instr = self.emitted[key] = self.graph.new_instr(opcode, *ops)
+            code.append(instr)
+        return instr
+
+    def reduce(self, loop, blocks, preheader):
+        header = loop.header
+        entry = header.preds.index(preheader)
+        back = 1 - entry
+        block_of = {}
+        for block in blocks:
+            for instr in block.instrs:
+                block_of[instr] = block
+        ivs = self.basic_ivs(header, back, block_of)
+        if not ivs:
+            return
+        forms, scaled = self.linear_forms(blocks, ivs, block_of)
+
+        # the values used outside of the linear computations are reduced,
+        # one new phi for every distinct form
+        pre_code = []
+        self.emitted = {}
+        new_phis = []
+        reduced = {}  # form key -> new phi
+        first_reduced = {}  # basic phi -> (form, new phi, add), for the exit test
+        for instr in list(forms):
+            if instr not in scaled or all(use in forms for use in instr.uses):
+                continue
+            phi, scale, const, terms = forms[instr]
+            key = (phi, scale, const, frozenset(terms.items()))
+            if key not in reduced:
+                update, step = ivs[phi]
+                add = Op.ADDA if instr.instr == Op.ADDA else Op.ADD
+                init = self.materialize(forms[instr], phi.ops[entry], pre_code, add)
+                new_phi = self.graph.new_instr(Op.PHI, init, init)
+                if add == Op.ADDA:
+                    ops = smplSSA.ImmediateOp(scale * step), new_phi
+                else:
+                    ops = new_phi, smplSSA.ImmediateOp(scale * step)
+                new_update = self.graph.new_instr(add, *ops)
+                ops = [None, None]
+                ops[entry], ops[back] = init, new_update
+                new_phi.set_ops(*ops)
+                update_block = block_of[update]
+                at = update_block.instrs.index(update) + 1
+                update_block.instrs.insert(at, new_update)
+                block_of[new_update] = update_block
+                new_phis.append(new_phi)
+                reduced[key] = new_phi
+                first_reduced.setdefault(phi, (forms[instr], new_phi, add))
+                self.n_reduced += 1
+            instr.replace_all_uses(reduced[key])
+
+        for phi, (form, new_phi, add) in first_reduced.items():
+            self.replace_test(phi, form, new_phi, add, block_of, pre_code)
+
+        if not new_phis:
+            return
+        n_phis = 0
+        while n_phis < len(header.instrs) and header.instrs[n_phis].instr == Op.PHI:
+            n_phis += 1
+        header.instrs[n_phis:n_phis] = new_phis
+        for new_phi in new_phis:
+            block_of[new_phi] = header
+        self.insert_preheader(preheader, pre_code)
+        self.remove_dead(list(forms) + [update for update, _ in ivs.values()], block_of)
+
+    def replace_test(self, phi, form, new_phi, add, block_of, pre_code):
+        # cmp phi, n  ->  cmp new_phi, scale * n + offset (same sign if scale > 0)
+        if form[1] <= 0:
+            return
+        for cmp in list(phi.uses):
+            if cmp.instr != Op.CMP:
+                continue
+            left, right = cmp.ops
+            bound = right if left is phi else left
+            # the bound has to be loop invariant
+            if bound is phi or self.form_of(bound, {}, block_of) is None:
+                continue
+            new_bound = self.materialize(form, bound, pre_code, add)
+            if left is phi:
+                cmp.set_ops(new_phi, new_bound)
+            else:
+                cmp.set_ops(new_bound, new_phi)
+            self.n_replaced_tests += 1
+
+    def insert_preheader(self, preheader, code):
+        preheader.instrs = [instr for instr in preheader.instrs if not instr.is_empty]
+        at = len(preheader.instrs)
+        if at and preheader.instrs[-1].instr in smplSSA.BRANCH_OPS | {Op.BRA}:
+            at -= 1
+        preheader.instrs[at:at] = code
+
+    def remove_dead(self, candidates, block_of):
+        # the old computations, and the old induction variable if only its
+        # own update uses it
+        changed = True
+        while changed:
+            changed = False
+            for instr in candidates:
+                block = block_of.get(instr)
+                if block is None or instr not in block.instrs:
+                    continue
+                users = set(instr.uses)
+                if instr.instr == Op.PHI and len(users) == 1:
+                    (update,) = users
+                    if set(update.uses) == {instr}:
+                        for dead in (instr, update):
+                            block_of[dead].instrs.remove(dead)
+                            dead.unlink()
+                        changed = True
+                        continue
+                if not users:
+                    block.instrs.remove(instr)
+                    instr.unlink()
+                    changed = True
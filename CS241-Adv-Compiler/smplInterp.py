@@ -0,0 +1,302 @@
+import array
+import operator
+import sys
+import time
+
+import config
+import smplSCCP
+import smplSSA
+
+Op = smplSSA.Op
+WORD_SIGN = smplSSA.WORD_SIGN
+WORD_MASK = smplSSA.WORD_MASK
+
+# words of the flat memory the arrays are allocated in
+MEMORY_SIZE = 1 << 20
+# register 0 of every frame takes the (unused) result of a store or a write
+SCRATCH = 0
+
+# how a segment ends
+JUMP, BRANCH, CALL, RETURN, END = range(5)
+
+
+def divide(a, b):
+    # rounded toward zero, like the folding of constants
+    if b == 0:
+        raise Exception("[ERROR] Division by zero")
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def read_numbers(stream):
+    for line in stream:
+        for word in line.split():
+            yield int(word)
+
+
+class Segment:
+    # A straight run of decoded instructions, (handler, dest, a, b) with
+    # regs[dest] = handler(regs[a], regs[b]), and how it ends. A block is
+    # split after every call, the segment after it continues the block
+    __slots__ = (
+        "code",
+        "size",
+        "kind",
+        "cond",
+        "test",
+        "taken",
+        "fall",
+        "value",
+        "callee",
+        "args",
+        "dest",
+        "next",
+    )
+
+    def __init__(self):
+        self.code = []
+        self.size = 0  # IR instructions executed by running it
+        self.kind = JUMP
+        self.cond = SCRATCH  # register compared by the branch
+        self.test = None
+        # edges: (segment, phi registers, their values on this edge)
+        self.taken = None
+        self.fall = None
+        self.value = SCRATCH  # register returned
+        self.callee = None
+        self.args = ()  # registers passed to the callee
+        self.dest = SCRATCH  # register of the call result
+        self.next = None  # the segment after the call
+
+
+class Function:
+    # A SubGraph decoded once before running: every value (instruction,
+    # immediate or parameter) gets a register, the immediates are stored in
+    # the register template every frame starts as a copy of
+    def __init__(self, graph, name):
+        self.graph = graph
+        self.name = name
+        self.registers = {}  # value -> register
+        self.template = [0]  # SCRATCH
+        self.params = [self.register(("@", param)) for param in graph.params]
+        self.entry = None
+        self.heads = {}  # block -> its first segment
+
+    def register(self, key, value=None):
+        if key not in self.registers:
+            self.registers[key] = len(self.template)
+            self.template.append(value)
+        return self.registers[key]
+
+    def operand(self, op):
+        if isinstance(op, smplSSA.Instruction):
+            return self.register(op)
+        if isinstance(op, smplSSA.ImmediateOp):
+            # an uninitialized variable reads as 0
+            val = 0 if op.un_init else smplSSA.wrap(op.val)
+            return self.register(("#", val), val)
+        if isinstance(op, smplSSA.ArgumentOp):
+            return self.register(("@", op.name))
+        if op == "":  # return without a value
+            return self.register(("#", 0), 0)
+        raise Exception("[ERROR] Cannot execute the operand '{}'".format(op))
+
+
+class Interpreter:
+    # Runs a Graph: main and the functions it calls. Each SubGraph is
+    # decoded into segments first, so running an instruction is a lookup of
+    # its handler in a table instead of a dispatch on the opcode. Phis are
+    # resolved on the edge taken into their block, all read before any is
+    # set. Calls push the caller's registers on a frame stack, the arrays of
+    # a call are freed when it returns
+    def __init__(self, graph, stdin=None, stdout=None, memory_size=MEMORY_SIZE):
+        self.stdout = stdout or sys.stdout
+        self.numbers = read_numbers(stdin or sys.stdin)
+        self.memory = array.array("q", bytes(8 * memory_size))
+        self.sp = 0  # the next free word
+        self.executed = 0
+        self.elapsed = 0.0
+        self.handlers = {
+            # wrapped around to a word (smplSSA.wrap, inlined)
+            Op.ADD: lambda a, b: (a + b + WORD_SIGN & WORD_MASK) - WORD_SIGN,
+            Op.SUB: lambda a, b: (a - b + WORD_SIGN & WORD_MASK) - WORD_SIGN,
+            Op.MUL: lambda a, b: (a * b + WORD_SIGN & WORD_MASK) - WORD_SIGN,
+            Op.DIV: lambda a, b: smplSSA.wrap(divide(a, b)),
+            # compared against zero by the branch that uses it
+            Op.CMP: operator.sub,
+            Op.ADDA: operator.add,
+            Op.LOAD: self.load,
+            Op.STORE: self.store,
+            Op.ALLOCA: self.alloca,
+            Op.READ: self.read,
+            Op.WRITE: self.write,
+            Op.WRITENL: self.write_nl,
+        }
+        self.main = Function(graph.graphs[0], "main")
+        self.functions = {
+            g.root.name: Function(g, g.root.name) for g in graph.graphs[1:]
+        }
+        for function in [self.main] + list(self.functions.values()):
+            self.decode(function)
+
+    # Decoding
+    def decode(self, function):
+        blocks = function.graph.cfg().rpo
+        for block in blocks:
+            function.heads[block] = Segment()
+        for block in blocks:
+            self.decode_block(function, block)
+        function.entry = function.heads[blocks[0]]
+
+    def decode_block(self, function, block):
+        segment = function.heads[block]
+        operand = function.operand
+        for instr in block.instrs:
+            if instr.is_empty:
+                continue
+            opcode = instr.instr
+            ops = instr.ops
+            segment.size += 1
+            if opcode == Op.PHI:
+                continue  # set on the edge into the block
+            if opcode in smplSSA.BRANCH_OPS:
+                segment.kind = BRANCH
+                segment.cond = operand(ops[0])
+                segment.test = smplSCCP.BRANCH_FUNCS[opcode]
+                fall = [succ for succ in block.succs if succ is not ops[1]]
+                segment.taken = self.edge(function, block, ops[1])
+                segment.fall = self.edge(function, block, fall[0])
+                return
+            if opcode == Op.BRA:
+                segment.fall = self.edge(function, block, ops[0])
+                return
+            if opcode == Op.RETURN:
+                segment.kind = RETURN
+                segment.value = operand(ops[0])
+                return
+            if opcode == Op.END:
+                segment.kind = END
+                return
+            if opcode == Op.CALL:
+                if ops[0] not in self.functions:
+                    raise Exception(
+                        "[ERROR] Calling an undefined function '{}'".format(ops[0])
+                    )
+                segment.kind = CALL
+                segment.callee = self.functions[ops[0]]
+                segment.args = tuple(operand(op) for op in ops[1:])
+                segment.dest = operand(instr)
+                segment.next = segment = Segment()
+                continue
+            a = operand(ops[0]) if ops else SCRATCH
+            b = operand(ops[1]) if len(ops) > 1 else SCRATCH
+            dest = (
+                SCRATCH
+                if opcode in (Op.STORE, Op.WRITE, Op.WRITENL)
+                else operand(instr)
+            )
+            segment.code.append((self.handlers[opcode], dest, a, b))
+        if block.succs:
+            # falls through to the next block
+            segment.fall = self.edge(function, block, block.succs[0])
+        else:
+            # the end of a function without a return
+            segment.kind = END if function is self.main else RETURN
+            segment.value = operand("")
+
+    def edge(self, function, block, succ):
+        index = succ.preds.index(block)
+        phis = [
+            instr
+            for instr in succ.instrs
+            if not instr.is_empty and instr.instr == Op.PHI
+        ]
+        dests = tuple(function.operand(phi) for phi in phis)
+        srcs = tuple(function.operand(phi.ops[index]) for phi in phis)
+        return function.heads[succ], dests, srcs
+
+    # Handlers
+    def load(self, addr, _):
+        return self.memory[addr // config.INTEGER_SIZE]
+
+    def store(self, value, addr):
+        self.memory[addr // config.INTEGER_SIZE] = value
+
+    def alloca(self, size, _):
+        base = self.sp
+        words = size // config.INTEGER_SIZE
+        if base + words > len(self.memory):
+            raise Exception("[ERROR] Out of memory")
+        # freed arrays of earlier calls are reused, they start zeroed
+        self.memory[base : base + words] = array.array("q", bytes(8 * words))
+        self.sp = base + words
+        return base * config.INTEGER_SIZE
+
+    def read(self, _, __):
+        number = next(self.numbers, None)
+        if number is None:
+            raise Exception("[ERROR] InputNum: no more input")
+        return smplSSA.wrap(number)
+
+    def write(self, value, _):
+        self.stdout.write("{} ".format(value))
+
+    def write_nl(self, _, __):
+        self.stdout.write("\n")
+
+    # Execution
+    def run(self):
+        regs = list(self.main.template)
+        segment = self.main.entry
+        stack = []  # (caller registers, calling segment, sp)
+        executed = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                for handler, dest, a, b in segment.code:
+                    regs[dest] = handler(regs[a], regs[b])
+                executed += segment.size
+                kind = segment.kind
+                if kind == JUMP:
+                    edge = segment.fall
+                elif kind == BRANCH:
+                    edge = (
+                        segment.taken
+                        if segment.test(regs[segment.cond])
+                        else segment.fall
+                    )
+                elif kind == CALL:
+                    callee = segment.callee
+                    frame = list(callee.template)
+                    for param, arg in zip(callee.params, segment.args):
+                        frame[param] = regs[arg]
+                    stack.append((regs, segment, self.sp))
+                    regs = frame
+                    segment = callee.entry
+                    continue
+                elif kind == RETURN and stack:
+                    value = regs[segment.value]
+                    regs, segment, self.sp = stack.pop()
+                    regs[segment.dest] = value
+                    segment = segment.next
+                    continue
+                else:
+                    break  # the end of main
+                segment, dests, srcs = edge
+                if dests:
+                    values = [regs[src] for src in srcs]
+                    for dest, value in zip(dests, values):
+                        regs[dest] = value
+        except IndexError:
+            raise Exception("[ERROR] Array access out of the memory")
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.executed += executed
+            self.stdout.flush()
+        return self
+
+    def report(self):
+        rate = self.executed / self.elapsed if self.elapsed else 0.0
+        return "[RUN] {} instructions in {:.3f} s ({:.0f} instructions/s)".format(
+            self.executed, self.elapsed, rate
+        )
@@ -0,0 +1,105 @@
+import smplSSA
+
+Op = smplSSA.Op
+
+# no side effects and cannot fail, safe to run even if the loop body is not
+PURE_OPS = frozenset({Op.ADD, Op.SUB, Op.MUL, Op.CMP, Op.ADDA})
+# a load is invariant if nothing in the loop may write to memory, it is
+# hoisted if it runs whenever the preheader does (it is in the header, the
+# loops are not rotated) or it cannot fail (see in_bounds)
+MEMORY_KILL_OPS = frozenset({Op.STORE, Op.CALL})
+BRANCH_OPS = smplSSA.BRANCH_OPS | {Op.BRA}
+
+
+class LICM:
+    # Loop-invariant code motion: instructions of a natural loop whose
+    # operands are all defined outside of it (or are invariant themselves)
+    # are moved to the end of the loop preheader. Inner loops are handled
+    # first, so an expression can move out of a whole loop nest.
+    def __init__(self, graph):
+        self.graph = graph
+        self.n_hoisted = 0
+        self.n_loops = 0
+
+    def run(self):
+        cfg = self.graph.cfg()
+        for loop in cfg.loop_postorder():
+            preheader = loop.preheader()
+            if preheader is None:
+                continue
+            self.n_loops += 1
+            blocks = [block for block in cfg.rpo if block in loop.blocks]
+            self.hoist(blocks, preheader)
+        self.graph.stats["licm.loops"] += self.n_loops
+        self.graph.stats["licm.hoisted"] += self.n_hoisted
+        return self
+
+    def in_bounds(self, addr):
+        # an element of an array at a constant index below its size
+        if isinstance(addr, smplSSA.Instruction) and addr.instr == Op.ALLOCA:
+            return True
+        if not isinstance(addr, smplSSA.Instruction) or addr.instr != Op.ADDA:
+            return False
+        offset, base = addr.ops
+        return (
+            isinstance(offset, smplSSA.ImmediateOp)
+            and not offset.un_init
+            and isinstance(base, smplSSA.Instruction)
+            and base.instr == Op.ALLOCA
+            and 0 <= offset.val < base.ops[0].val
+        )
+
+    def is_invariant(self, instr, defined_in_loop, memory_killed, in_header):
+        if instr.is_empty:
+            return False
+        if instr.instr == Op.LOAD:
+            if memory_killed:
+                return False
+            if not in_header and not self.in_bounds(instr.ops[0]):
+                # its guard might be what keeps it inside the array
+                return False
+        elif instr.instr == Op.DIV:
+            # only when it cannot divide by zero
+            divisor = instr.ops[1]
+            if (
+                not isinstance(divisor, smplSSA.ImmediateOp)
+                or smplSSA.wrap(divisor.val) == 0
+            ):
+                return False
+        elif instr.instr not in PURE_OPS:
+            return False
+        return not any(op in defined_in_loop for op in instr.ops)
+
+    def hoist(self, blocks, preheader):
+        defined_in_loop = set()
+        memory_killed = False
+        for block in blocks:
+            for instr in block.instrs:
+                defined_in_loop.add(instr)
+                memory_killed |= instr.instr in MEMORY_KILL_OPS
+
+        hoisted = []
+        # in reverse postorder, the operands of an instruction are seen first
+        # (the header comes first)
+        for block in blocks:
+            kept = []
+            in_header = block is blocks[0]
+            for instr in block.instrs:
+                if self.is_invariant(instr, defined_in_loop, memory_killed, in_header):
+                    defined_in_loop.discard(instr)
+                    hoisted.append(instr)
+                else:
+                    kept.append(instr)
+            if len(kept) != len(block.instrs):
+                # an empty block gets its placeholder back when it is printed
+                block.instrs = kept
+        if not hoisted:
+            return
+
+        # before the branch ending the preheader, if any
+        preheader.instrs = [instr for instr in preheader.instrs if not instr.is_empty]
+        at = len(preheader.instrs)
+        if at and preheader.instrs[-1].instr in BRANCH_OPS:
+            at -= 1
+        preheader.instrs[at:at] = hoisted
+        self.n_hoisted += len(hoisted)
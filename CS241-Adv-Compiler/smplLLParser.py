@@ -0,0 +1,342 @@
+import smplAST as ast
+import smplLex
+import smplParser
+
+T = smplLex.TokenKind
+EOF = -1  # end of input marker in the parse table
+
+# tokens whose value is pushed on the value stack when consumed
+VALUE_TOKENS = frozenset(
+    {
+        T.IDENT,
+        T.NUMBER,
+        T.PLUS,
+        T.MINUS,
+        T.ASTERISK,
+        T.SLASH,
+        T.OP_EQ,
+        T.OP_NEQ,
+        T.OP_LT,
+        T.OP_LE,
+        T.OP_GT,
+        T.OP_GE,
+    }
+)
+
+
+# Semantic actions, they build the smplAST nodes on the value stack
+def new_list(values):
+    values.append([])
+
+
+def append(values):
+    item = values.pop()
+    values[-1].append(item)
+
+
+def extend(values):
+    items = values.pop()
+    values[-1].extend(items)
+
+
+def push_none(values):
+    values.append(None)
+
+
+def push_true(values):
+    values.append(True)
+
+
+def push_false(values):
+    values.append(False)
+
+
+def ident(values):
+    values.append(ast.Identifier(values.pop().val))
+
+
+def number(values):
+    values.append(ast.Number(int(values.pop().val)))
+
+
+def designator(values):
+    arr = values.pop()
+    name = values.pop()
+    values.append(ast.Array(name, arr) if arr else name)
+
+
+def operator(values):
+    right = values.pop()
+    op = values.pop()
+    left = values.pop()
+    values.append(ast.Operator(op.token, left, right))
+
+
+def assignment(values):
+    right = values.pop()
+    left = values.pop()
+    values.append(ast.Assignment(left, right))
+
+
+def func_call(values):
+    params = values.pop()
+    funcName = values.pop()
+    values.append(ast.FuncCall(funcName, params))
+
+
+def if_stat(values):
+    elseStatement = values.pop()
+    thenStatement = values.pop()
+    relation = values.pop()
+    values.append(ast.IfStatement(relation, thenStatement, elseStatement))
+
+
+def while_stat(values):
+    statement = values.pop()
+    relation = values.pop()
+    values.append(ast.WhileStatement(relation, statement))
+
+
+def return_stat(values):
+    values.append(ast.ReturnStatement(values.pop()))
+
+
+def var_decl(values):
+    idents = values.pop()
+    arr = values.pop()
+    values.append([ast.VarDecl(ident, arr) for ident in idents])
+
+
+def func_body(values):
+    stats = values.pop()
+    varDecl = values.pop()
+    values.append({"vars": varDecl, "stats": stats})
+
+
+def func_decl(values):
+    body = values.pop()
+    params = values.pop()
+    funcIdent = values.pop()
+    is_void = values.pop()
+    values.append(
+        ast.FuncDecl(func_name=funcIdent, params=params, body=body, is_void=is_void)
+    )
+
+
+def computation(values):
+    statements = values.pop()
+    funcDecl = values.pop()
+    varDecl = values.pop()
+    values.append(ast.Computation(varDecl, funcDecl, statements))
+
+
+# The SMPL grammar of smplParser.Parser rewritten in LL(1) form,
+# nonterminal -> list of productions. A production is a list of terminals
+# (TokenKind), nonterminals (str) and semantic actions (functions)
+GRAMMAR = {
+    # computation = "main" { varDecl } { funcDecl } "{" statSequence "}" "."
+    "computation": [
+        [T.MAIN, new_list, "varDecls", new_list, "funcDecls"]
+        + [T.LBRACE, "statSequence", T.RBRACE, T.PERIOD, computation]
+    ],
+    "varDecls": [["varDecl", extend, "varDecls"], []],
+    # varDecl = typeDecl ident { "," ident } ";"
+    "varDecl": [
+        ["typeDecl", new_list, "ident", append, "identList", T.SEMICOLON, var_decl]
+    ],
+    "identList": [[T.COMMA, "ident", append, "identList"], []],
+    # typeDecl = "var" | "array" "[" number "]" { "[" number "]" }
+    "typeDecl": [
+        [T.VAR, new_list],
+        [T.ARRAY, new_list, T.LBRACKET, "number", append, T.RBRACKET, "dimList"],
+    ],
+    "dimList": [[T.LBRACKET, "number", append, T.RBRACKET, "dimList"], []],
+    "funcDecls": [["funcDecl", append, "funcDecls"], []],
+    # funcDecl = [ "void" ] "function" ident formalParam ";" funcBody ";"
+    "funcDecl": [
+        ["isVoid", T.FUNCTION, "ident", "formalParam", T.SEMICOLON]
+        + ["funcBody", T.SEMICOLON, func_decl]
+    ],
+    "isVoid": [[T.VOID, push_true], [push_false]],
+    # formalParam = "(" [ident { "," ident }] ")"
+    "formalParam": [[T.LPAREN, new_list, "formalList", T.RPAREN]],
+    "formalList": [["ident", append, "identList"], []],
+    # funcBody = { varDecl } "{" [ statSequence ] "}"
+    "funcBody": [[new_list, "varDecls", T.LBRACE, "bodyStats", T.RBRACE, func_body]],
+    "bodyStats": [["statSequence"], [new_list]],
+    # statSequence = statement { ";" statement } [ ";" ]
+    "statSequence": [[new_list, "statement", append, "statTail"]],
+    "statTail": [[T.SEMICOLON, "statOpt"], []],
+    "statOpt": [["statement", append, "statTail"], []],
+    # statement = assignment | funcCall | ifStatement | whileStatement | returnStatement
+    "statement": [
+        ["assignment"],
+        ["funcCall"],
+        ["ifStatement"],
+        ["whileStatement"],
+        ["returnStatement"],
+    ],
+    # assignment = "let" designator "<-" expression
+    "assignment": [[T.LET, "designator", T.ASSIGN, "expression", assignment]],
+    # funcCall = "call" ident [ "(" [expression { "," expression } ] ")" ]
+    "funcCall": [[T.CALL, "ident", "argsOpt", func_call]],
+    "argsOpt": [[T.LPAREN, new_list, "argList", T.RPAREN], [new_list]],
+    "argList": [["expression", append, "exprTail"], []],
+    "exprTail": [[T.COMMA, "expression", append, "exprTail"], []],
+    # ifStatement = "if" relation "then" statSequence [ "else" statSequence ] "fi"
+    "ifStatement": [
+        [T.IF, "relation", T.THEN, "statSequence", "elseOpt", T.FI, if_stat]
+    ],
+    "elseOpt": [[T.ELSE, "statSequence"], [new_list]],
+    # whileStatement = "while" relation "do" StatSequence "od"
+    "whileStatement": [[T.WHILE, "relation", T.DO, "statSequence", T.OD, while_stat]],
+    # returnStatement = "return" [ expression ]
+    "returnStatement": [[T.RETURN, "returnOpt", return_stat]],
+    "returnOpt": [["expression"], [push_none]],
+    # relation = expression relOp expression
+    "relation": [["expression", "relOp", "expression", operator]],
+    "relOp": [[T.OP_EQ], [T.OP_NEQ], [T.OP_LT], [T.OP_LE], [T.OP_GT], [T.OP_GE]],
+    # expression = term {("+" | "-") term}
+    "expression": [["term", "exprRest"]],
+    "exprRest": [["addOp", "term", operator, "exprRest"], []],
+    "addOp": [[T.PLUS], [T.MINUS]],
+    # term = factor { ("*" | "/") factor}
+    "term": [["factor", "termRest"]],
+    "termRest": [["mulOp", "factor", operator, "termRest"], []],
+    "mulOp": [[T.ASTERISK], [T.SLASH]],
+    # factor = designator | number | "(" expression ")" | funcCall
+    "factor": [
+        ["designator"],
+        ["number"],
+        [T.LPAREN, "expression", T.RPAREN],
+        ["funcCall"],
+    ],
+    # designator = ident{ "[" expression "]" }
+    "designator": [["ident", new_list, "indexList", designator]],
+    "indexList": [[T.LBRACKET, "expression", append, T.RBRACKET, "indexList"], []],
+    "ident": [[T.IDENT, ident]],
+    "number": [[T.NUMBER, number]],
+}
+START = "computation"
+
+
+def grammar_symbols(production):
+    # drop the semantic actions, only terminals and nonterminals are left
+    return [sym for sym in production if not callable(sym)]
+
+
+def first_of(symbols, first):
+    # FIRST set of a sequence of symbols, None stands for the empty string
+    result = set()
+    for sym in symbols:
+        if isinstance(sym, str):
+            result |= first[sym] - {None}
+            if None not in first[sym]:
+                return result
+        else:
+            result.add(sym)
+            return result
+    result.add(None)
+    return result
+
+
+def build_first_sets(grammar):
+    first = {nt: set() for nt in grammar}
+    changed = True
+    while changed:
+        changed = False
+        for nt, productions in grammar.items():
+            for production in productions:
+                new = first_of(grammar_symbols(production), first) - first[nt]
+                if new:
+                    first[nt] |= new
+                    changed = True
+    return first
+
+
+def build_follow_sets(grammar, first, start):
+    follow = {nt: set() for nt in grammar}
+    follow[start].add(EOF)
+    changed = True
+    while changed:
+        changed = False
+        for nt, productions in grammar.items():
+            for production in productions:
+                symbols = grammar_symbols(production)
+                for i, sym in enumerate(symbols):
+                    if not isinstance(sym, str):
+                        continue
+                    rest = first_of(symbols[i + 1 :], first)
+                    new = rest - {None}
+                    if None in rest:
+                        new |= follow[nt]
+                    new -= follow[sym]
+                    if new:
+                        follow[sym] |= new
+                        changed = True
+    return follow
+
+
+def build_parse_table(grammar, start):
+    # nonterminal -> {lookahead token kind -> production}
+    first = build_first_sets(grammar)
+    follow = build_follow_sets(grammar, first, start)
+    table = {nt: {} for nt in grammar}
+    for nt, productions in grammar.items():
+        for production in productions:
+            lookaheads = first_of(grammar_symbols(production), first)
+            if None in lookaheads:
+                lookaheads = (lookaheads - {None}) | follow[nt]
+            for tok in lookaheads:
+                if tok in table[nt]:
+                    raise Exception(
+                        "[ERROR] Grammar is not LL(1): conflict at {} on {}".format(
+                            nt, T(tok).name if tok != EOF else "EOF"
+                        )
+                    )
+                # push in reverse order, so the first symbol ends up on top,
+                # terminals are stored as plain ints for a cheap type check
+                table[nt][tok] = [
+                    int(sym) if isinstance(sym, T) else sym
+                    for sym in reversed(production)
+                ]
+    return table
+
+
+PARSE_TABLE = build_parse_table(GRAMMAR, START)
+
+
+class TableParser(smplParser.Parser):
+    # Table-driven LL(1) parser: the production is picked by a single lookup
+    # in PARSE_TABLE and an explicit stack replaces Python recursion,
+    # so deeply nested programs do not hit the recursion limit
+    def start_parser(self):
+        stack = [START]
+        values = []
+        # the lookahead only changes when a terminal is consumed
+        next = self.tokens.peek()
+        lookahead = EOF if next is None else next.kind
+        while stack:
+            sym = stack.pop()
+            kind = type(sym)
+            if kind is str:  # nonterminal
+                production = PARSE_TABLE[sym].get(lookahead)
+                if production is None:
+                    raise Exception(
+                        "[ERROR] Unexpected token: POS: {}, Rule: {}, Token: {}.".format(
+                            next.pos if next else self.lex.pos,
+                            sym,
+                            next.val if next else "<EOF>",
+                        )
+                    )
+                stack.extend(production)
+            elif kind is int:  # terminal
+                tok = self.consume(sym)
+                if sym in VALUE_TOKENS:
+                    values.append(tok)
+                next = self.tokens.peek()
+                lookahead = EOF if next is None else next.kind
+            else:  # semantic action
+                sym(values)
+        # The return value will be an ASTree
+        return values.pop()
@@ -1,34 +1,83 @@
+import enum
+import io
+import mmap
 import re
 
 import config
 
+# token kinds are small ints, numbered in the order of config.TOKENS
+TokenKind = enum.IntEnum("TokenKind", [t for t, _ in config.TOKENS], start=0)
+
 
 class Token:
     def __init__(self, token, val, pos):
         self.token = token
+        self.kind = TokenKind[token]
         self.val = val
         self.pos = pos
         self.toklen = len(val)
 
 
+def build_master_pattern():
+    # Combine every token of config.TOKENS into one alternation, so that a
+    # single pattern.match(text, pos) finds the next token
+    # - reserved words are not part of the alternation, they are matched as
+    #   identifiers and resolved with a dict lookup (see KEYWORDS)
+    # - literal tokens are tried longest first ("<-" and "<=" before "<")
+    literals = [
+        (tokenType, tok)
+        for tokenType, tok in config.TOKENS
+        if isinstance(tok, str) and tokenType not in config.RESERVED_TABLE
+    ]
+    literals.sort(key=lambda t: len(t[1]), reverse=True)
+    alternatives = ["(?P<{}>{})".format(t, re.escape(tok)) for t, tok in literals]
+    for tokenType, tok in config.TOKENS:
+        if isinstance(tok, re.Pattern):
+            alternatives.append("(?P<{}>{})".format(tokenType, tok.pattern))
+    return re.compile("|".join(alternatives))
+
+
+# keyword -> token type, e.g. "while" -> "WHILE"
+KEYWORDS = {
+    tok: tokenType
+    for tokenType, tok in config.TOKENS
+    if tokenType in config.RESERVED_TABLE
+}
+MASTER_PATTERN = build_master_pattern()
+WHITESPACE = re.compile(r"[ \n\t\r\a]*")
+# same patterns for lexing bytes (see StreamLexer)
+MASTER_PATTERN_BYTES = re.compile(MASTER_PATTERN.pattern.encode())
+WHITESPACE_BYTES = re.compile(WHITESPACE.pattern.encode())
+# a token that does not match yet might still match with this many more bytes
+LONGEST_LITERAL = max(len(tok) for _, tok in config.TOKENS if isinstance(tok, str))
+
+
 class Lexer:
     def __init__(self, inFile):
         self.input = inFile
         self.pos = 0
         self.currToken = None
+        self.lex_calls = 0  # number of times the matching loop ran
 
     def iterate(self):
         print("=" * 26)
         template = "{0:^5}|{1:^11}|{2:^10}"
         print(template.format("Pos", "Type", "Token"))
         print("=" * 26)
-        while self.pos < len(self.input):
+        for next in self.tokens():
+            print(template.format(next.pos, next.token, next.val))
+        print("=" * 26)
+
+    def tokens(self):
+        # Lex the whole input in one linear pass
+        while not self.at_end():
             next = self.next()
-            if next:
-                print(template.format(next.pos, next.token, next.val))
-            else:
+            if not next:
                 raise Exception("[ERROR] Lexer iteration failed.")
-        print("=" * 26)
+            yield next
+
+    def at_end(self):
+        return self.pos >= len(self.input)
 
     def peek(self):
         next, _ = self.lexer()
@@ -36,48 +85,155 @@ class Lexer:
 
     def next(self):
         nextTok, consumedLen = self.lexer()
-        delimiter = {" ", "\n", "\t", "\r", "\a"}
         # skip whitespace
-        while (
-            self.pos + consumedLen < len(self.input)
-            and self.input[self.pos + consumedLen] in delimiter
-        ):
-            # ignore white spaces
-            consumedLen += 1
+        if nextTok:
+            consumedLen = (
+                WHITESPACE.match(self.input, self.pos + consumedLen).end() - self.pos
+            )
         self.pos += consumedLen
         return nextTok
 
     def lexer(self):
-        remainStr = self.input[self.pos :]
-        if not remainStr:
+        self.lex_calls += 1
+        match = MASTER_PATTERN.match(self.input, self.pos)
+        if not match:
             return None, 0
 
-        token, consumedLen = None, 0
-
-        for tokenType, tok in config.TOKENS:
-            tempToken, tempTokenLen = None, 0
-            if isinstance(tok, re.Pattern):
-                match = tok.match(remainStr)
-                if match:
-                    tempToken = Token(tokenType, match.group(0), self.pos)
-                    tempTokenLen = match.end(0)
-                else:
-                    # skip this token
-                    continue
-            else:
-                if remainStr.startswith(tok):
-                    tempToken = Token(tokenType, tok, self.pos)
-                    tempTokenLen = len(tok)
-                else:
-                    # skip this token
-                    continue
-
-            if token is not None and tempTokenLen > token.toklen:
-                if tempToken.val.upper() not in config.RESERVED_TABLE:
-                    token = tempToken
-                    consumedLen = tempTokenLen
-            elif token is None:
-                token = tempToken
-                consumedLen = tempTokenLen
-
-        return token, consumedLen
+        tokenType, val = match.lastgroup, match.group()
+        if tokenType == "IDENT":
+            tokenType = KEYWORDS.get(val, tokenType)
+        return Token(tokenType, val, self.pos), match.end() - self.pos
+
+
+class StreamLexer(Lexer):
+    # Lexes a binary file without reading it into one str: the file is
+    # memory-mapped when possible, otherwise it is read chunk by chunk and
+    # only the unconsumed tail of the previous chunk is kept.
+    # self.pos is always the offset in the file, self.input[0] is at self.base.
+    # The mapping is closed once every token is lexed, or by close() (also a
+    # context manager)
+    def __init__(self, inFile, chunk_size=1 << 16, use_mmap=True):
+        super().__init__(bytearray())
+        self.file = inFile
+        self.chunk_size = chunk_size
+        self.base = 0
+        self.eof = False
+        if use_mmap:
+            try:
+                self.input = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+                self.eof = True
+            except (OSError, ValueError, io.UnsupportedOperation):
+                # pipes and empty files cannot be mapped
+                pass
+        # skip leading whitespace (same as strip() on the whole input)
+        self.skip(WHITESPACE_BYTES)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # the tokens are str copies, they outlive the mapping
+        if isinstance(self.input, mmap.mmap):
+            self.input.close()
+        self.input = bytearray()
+        self.base = self.pos
+        self.eof = True
+
+    def read_chunk(self):
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return
+        # drop everything that was already consumed
+        del self.input[: self.pos - self.base]
+        self.base = self.pos
+        self.input += data
+
+    def match(self, pattern):
+        # a match that reaches the end of the buffer might continue
+        # in the next chunk (e.g. an identifier cut in half, or "<" of "<=")
+        while True:
+            match = pattern.match(self.input, self.pos - self.base)
+            if self.eof:
+                return match
+            if match and match.end() < len(self.input):
+                return match
+            remain = len(self.input) - (self.pos - self.base)
+            if not match and remain >= LONGEST_LITERAL:
+                return match
+            self.read_chunk()
+
+    def skip(self, pattern):
+        match = self.match(pattern)
+        self.pos = self.base + match.end()
+
+    def at_end(self):
+        while not self.eof and self.pos - self.base >= len(self.input):
+            self.read_chunk()
+        if self.pos - self.base < len(self.input):
+            return False
+        self.close()
+        return True
+
+    def next(self):
+        nextTok, consumedLen = self.lexer()
+        self.pos += consumedLen
+        if nextTok:
+            self.skip(WHITESPACE_BYTES)
+        return nextTok
+
+    def lexer(self):
+        self.lex_calls += 1
+        match = self.match(MASTER_PATTERN_BYTES)
+        if not match:
+            self.at_end()  # closes the mapping once it is all lexed
+            return None, 0
+
+        tokenType, val = match.lastgroup, match.group().decode()
+        if tokenType == "IDENT":
+            tokenType = KEYWORDS.get(val, tokenType)
+        return Token(tokenType, val, self.pos), len(val)
+
+
+class TokenStream:
+    # Sits between the Lexer and the Parser: every token is lexed exactly once
+    # into a ring buffer, peek(k) looks k tokens ahead and consume() only
+    # advances the cursor
+    def __init__(self, lex, size=4):
+        self.lex = lex
+        self.size = size
+        self.buffer = [None] * size
+        self.head = 0  # index of the next token in the ring buffer
+        self.count = 0  # number of tokens buffered after head
+        self.n_consumed = 0
+
+    def fill(self, k):
+        while self.count < k:
+            tail = (self.head + self.count) % self.size
+            self.buffer[tail] = self.lex.next()
+            self.count += 1
+
+    def peek(self, k=1):
+        if k > self.size:
+            raise Exception(
+                "[ERROR] Lookahead {} exceeds token buffer size {}".format(k, self.size)
+            )
+        self.fill(k)
+        return self.buffer[(self.head + k - 1) % self.size]
+
+    def consume(self):
+        self.fill(1)
+        tok = self.buffer[self.head]
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        if tok:
+            self.n_consumed += 1
+        return tok
+
+    def lex_calls_per_token(self):
+        if not self.n_consumed:
+            return 0.0
+        return self.lex.lex_calls / self.n_consumed
@@ -0,0 +1,283 @@
+import smplSSA
+
+Op = smplSSA.Op
+
+# instructions that may write to memory, a call might store to any array
+MEMORY_DEF_OPS = frozenset({Op.STORE, Op.CALL})
+
+NO_ALIAS, MAY_ALIAS, MUST_ALIAS = range(3)
+
+
+class MemoryDef:
+    # a store or a call, defining a new state of the whole memory
+    __slots__ = ("instr", "defining", "block")
+
+    def __init__(self, instr, block):
+        self.instr = instr
+        self.defining = None  # the memory state it changes
+        self.block = block
+
+
+class MemoryUse:
+    # a load, reading the memory state of its defining access
+    __slots__ = ("instr", "defining", "block")
+
+    def __init__(self, instr, block):
+        self.instr = instr
+        self.defining = None
+        self.block = block
+
+
+class MemoryPhi:
+    # merges the memory states of the predecessors, in the order of block.preds
+    __slots__ = ("ops", "block")
+
+    def __init__(self, block):
+        self.ops = []
+        self.block = block
+
+
+# the memory state when the function is entered
+LIVE_ON_ENTRY = MemoryDef(None, None)
+
+
+class AliasOracle:
+    # Tells whether two addresses (the operand of a load or a store) refer to
+    # the same array element. Arrays are told apart by their alloca, indices
+    # by their linear form: a[i] and a[i + 1] never alias, a[i] and a[j] may
+    def address(self, addr):
+        # addr -> (base, offset), an adda with a #0 offset was folded away
+        if isinstance(addr, smplSSA.Instruction):
+            if addr.instr == Op.ADDA:
+                return addr.ops[1], addr.ops[0]
+            if addr.instr == Op.ALLOCA:
+                return addr, smplSSA.ImmediateOp(0)
+        return addr, None
+
+    def linear(self, op):
+        # op -> (term, scale, const) with op = scale * term + const
+        if isinstance(op, smplSSA.ImmediateOp) and not op.un_init:
+            return None, 0, op.val
+        if isinstance(op, smplSSA.Instruction) and op.instr in (Op.ADD, Op.SUB, Op.MUL):
+            left, right = op.ops
+            if isinstance(right, smplSSA.ImmediateOp) and not right.un_init:
+                term, scale, const = self.linear(left)
+                if op.instr == Op.ADD:
+                    return term, scale, const + right.val
+                if op.instr == Op.SUB:
+                    return term, scale, const - right.val
+                return term, scale * right.val, const * right.val
+            if (
+                op.instr == Op.ADD
+                and isinstance(left, smplSSA.ImmediateOp)
+                and not left.un_init
+            ):
+                term, scale, const = self.linear(right)
+                return term, scale, const + left.val
+        return op, 1, 0
+
+    def alias(self, addr_a, addr_b):
+        base_a, offset_a = self.address(addr_a)
+        base_b, offset_b = self.address(addr_b)
+        if offset_a is None or offset_b is None:
+            return MAY_ALIAS
+        if base_a is not base_b:
+            # two arrays of this function, or two global arrays
+            if self.is_alloca(base_a) and self.is_alloca(base_b):
+                return NO_ALIAS
+            return MAY_ALIAS
+        if offset_a is offset_b:
+            return MUST_ALIAS
+        term_a, scale_a, const_a = self.linear(offset_a)
+        term_b, scale_b, const_b = self.linear(offset_b)
+        if term_a is term_b and scale_a == scale_b:
+            return MUST_ALIAS if const_a == const_b else NO_ALIAS
+        return MAY_ALIAS
+
+    def is_alloca(self, op):
+        return isinstance(op, smplSSA.Instruction) and op.instr == Op.ALLOCA
+
+
+class MemorySSA:
+    # Memory SSA of one SubGraph: every store and call is a MemoryDef, every
+    # load a MemoryUse, and a MemoryPhi starts the blocks in the iterated
+    # dominance frontier of the definitions. Renamed along the dominator tree
+    def __init__(self, graph):
+        self.graph = graph
+        self.cfg = graph.cfg()
+        self.access = {}  # instr -> its MemoryDef or MemoryUse
+        self.phis = {}  # block -> MemoryPhi
+        self.uses = {}  # defining access -> loads reading it, in dominator order
+        self.block_of = {}
+        self.position = {}  # instr -> index in its block, kept while loads go
+        self.build()
+
+    def build(self):
+        def_blocks = []
+        for block in self.cfg.rpo:
+            for i, instr in enumerate(block.instrs):
+                self.block_of[instr] = block
+                self.position[instr] = i
+                if instr.is_empty:
+                    continue
+                if instr.instr in MEMORY_DEF_OPS:
+                    self.access[instr] = MemoryDef(instr, block)
+                    def_blocks.append(block)
+                elif instr.instr == Op.LOAD:
+                    self.access[instr] = MemoryUse(instr, block)
+
+        frontiers = self.cfg.dominance_frontiers()
+        work = list(dict.fromkeys(def_blocks))
+        while work:
+            block = work.pop()
+            for join in frontiers[block]:
+                if join not in self.phis:
+                    self.phis[join] = MemoryPhi(join)
+                    work.append(join)
+        self.rename()
+
+    def rename(self):
+        # walk the dominator tree with the current memory state
+        stack = [(self.cfg.rpo[0], LIVE_ON_ENTRY)]
+        while stack:
+            block, state = stack.pop()
+            if block in self.phis:
+                state = self.phis[block]
+            for instr in block.instrs:
+                access = self.access.get(instr)
+                if access is None:
+                    continue
+                access.defining = state
+                if isinstance(access, MemoryDef):
+                    state = access
+                else:
+                    self.uses.setdefault(state, []).append(access)
+            for succ in block.succs:
+                phi = self.phis.get(succ)
+                if phi is not None:
+                    phi.ops.append((block, state))
+            for child in reversed(self.cfg.dom_tree[block]):
+                stack.append((child, state))
+        # in the order of the predecessors, like the phi instructions
+        for block, phi in self.phis.items():
+            states = dict(phi.ops)
+            phi.ops = [states[pred] for pred in block.preds if pred in states]
+
+    def dominates(self, instr, load):
+        # whether the value instr is available at load
+        if not isinstance(instr, smplSSA.Instruction):
+            return True
+        block = self.block_of.get(instr)
+        load_block = self.block_of[load]
+        if block is None:
+            return False
+        if block is load_block:
+            return self.position[instr] < self.position[load]
+        return self.cfg.dominates(block, load_block)
+
+
+class LoadElimination:
+    # Store-to-load forwarding and redundant load elimination on top of the
+    # memory SSA: a load is walked up its memory states, skipping the stores
+    # that cannot alias it, until a store to the same element (its value is
+    # forwarded), an earlier load of it (that value is reused) or a store or
+    # call that may change it. At a MemoryPhi every path has to agree
+    def __init__(self, graph):
+        self.graph = graph
+        self.oracle = AliasOracle()
+        self.value = {}  # removed load -> the value replacing it
+        self.n_forwarded = 0
+        self.n_reused = 0
+
+    def run(self):
+        self.mssa = MemorySSA(self.graph)
+        for block in self.mssa.cfg.rpo:
+            for instr in list(block.instrs):
+                if instr.is_empty or instr.instr != Op.LOAD:
+                    continue
+                self.eliminate(instr, block)
+        self.graph.stats["mem.forwarded"] += self.n_forwarded
+        self.graph.stats["mem.loads_removed"] += self.n_reused
+        return self
+
+    def eliminate(self, load, block):
+        found = self.walk(self.mssa.access[load].defining, load)
+        if not found:
+            return
+        value, forwarded = found
+        if not self.mssa.dominates(value, load):
+            return
+        self.value[load] = value
+        if forwarded:
+            self.n_forwarded += 1
+        else:
+            self.n_reused += 1
+        load.replace_all_uses(value)
+        block.instrs.remove(load)
+        load.unlink()
+        addr = load.ops[0]
+        if addr.instr == Op.ADDA and not addr.uses and addr in block.instrs:
+            # its adda is only used by this load
+            block.instrs.remove(addr)
+            addr.unlink()
+
+    def walk(self, state, load):
+        # -> (value, forwarded from a store) or None if unknown. At a
+        # MemoryPhi every operand is walked in turn, with a stack of the
+        # phis being walked rather than recursing, a program might be a long
+        # chain of ifs. A phi seen again closes a loop, that path cannot
+        # change the element either: its result is () while it is walked
+        visiting = {}  # phi -> its result
+        stack = []  # [phi, operands walked, result so far]
+        found = self.walk_up(state, load)
+        while True:
+            if isinstance(found, MemoryPhi) and found not in visiting:
+                visiting[found] = ()
+                stack.append([found, 0, ()])
+            else:
+                if isinstance(found, MemoryPhi):
+                    found = visiting[found]
+                if not stack:
+                    return found or None
+                frame = stack[-1]
+                result = frame[2]
+                if found is None or (
+                    found != () and result != () and found[0] is not result[0]
+                ):
+                    frame[2] = None
+                    frame[1] = len(frame[0].ops)  # the paths disagree, done
+                elif found != ():
+                    frame[2] = found
+            phi, walked, result = stack[-1]
+            if walked < len(phi.ops):
+                stack[-1][1] += 1
+                found = self.walk_up(phi.ops[walked], load)
+            else:
+                stack.pop()
+                visiting[phi] = result
+                found = phi
+
+    def walk_up(self, state, load):
+        # -> (value, forwarded from a store), None if unknown, or the
+        # MemoryPhi reached
+        addr = load.ops[0]
+        while True:
+            for other in self.mssa.uses.get(state, ()):
+                other_load = other.instr
+                if other_load is load or not self.mssa.dominates(other_load, load):
+                    continue
+                if self.oracle.alias(other_load.ops[0], addr) == MUST_ALIAS:
+                    return self.value.get(other_load, other_load), False
+            if state is LIVE_ON_ENTRY:
+                return None
+            if isinstance(state, MemoryPhi):
+                return state
+            instr = state.instr
+            if instr.instr == Op.CALL:
+                return None
+            alias = self.oracle.alias(instr.ops[1], addr)
+            if alias == MUST_ALIAS:
+                return instr.ops[0], True
+            if alias == MAY_ALIAS:
+                return None
+            state = state.defining
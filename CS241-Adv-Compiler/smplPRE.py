@@ -0,0 +1,239 @@
+import config
+import smplPhiElim
+import smplSSA
+import smplSSAGraph
+
+Op = smplSSA.Op
+
+# the arithmetic opcodes of the source operators
+PRE_OPS = frozenset(smplSSA.OPCODES[name] for name in config.OP_TABLE.values())
+BRANCH_OPS = smplSSA.BRANCH_OPS | {Op.BRA}
+
+
+class PRE:
+    # Partial redundancy elimination by lazy code motion (Knoop, Ruthing &
+    # Steffen), in the edge based form of Drechsler & Stadel. Every
+    # (opcode, operands) pair is one expression, a block kills it if it
+    # defines one of the operands. Computations are inserted on the edges
+    # where the expression is missing, as late as possible, which makes the
+    # partially redundant ones fully redundant: those are deleted, and
+    # their value comes from a new phi where the paths join.
+    def __init__(self, graph):
+        self.graph = graph
+        self.values = smplSSAGraph.ValueTable()  # for the expression keys
+        self.n_inserted = 0
+        self.n_removed = 0
+        self.n_saved = 0
+
+    def run(self):
+        cfg = self.graph.cfg()
+        self.blocks = cfg.rpo
+        self.order = cfg.order
+        self.collect()
+        if self.exprs:
+            self.solve()
+            for e in range(len(self.exprs)):
+                self.transform(e)
+        self.graph.stats["pre.inserted"] += self.n_inserted
+        self.graph.stats["pre.removed"] += self.n_removed
+        self.graph.stats["pre.saved"] += self.n_saved
+        return self
+
+    # Local properties, one bit per expression
+    def collect(self):
+        self.exprs = {}  # key -> expression number
+        self.occurrences = {}  # (block, expression) -> instrs in order
+        self.sample = []  # expression number -> one of its instrs
+        block_of = {}
+        for block in self.blocks:
+            for instr in block.instrs:
+                block_of[instr] = block
+
+        self.antloc = {}  # computed before an operand is defined in the block
+        self.comp = {}  # computed after the last operand definition
+        self.kill = {}  # an operand is defined in the block
+        for block in self.blocks:
+            self.antloc[block] = self.comp[block] = self.kill[block] = 0
+        for block in self.blocks:
+            for instr in block.instrs:
+                if instr.is_empty or instr.instr not in PRE_OPS:
+                    continue
+                key = self.values.key(instr)
+                e = self.exprs.get(key)
+                if e is None:
+                    e = self.exprs[key] = len(self.sample)
+                    self.sample.append(instr)
+                self.occurrences.setdefault((block, e), []).append(instr)
+                bit = 1 << e
+                self.comp[block] |= bit
+                defined_here = False
+                for op in instr.ops:
+                    if isinstance(op, smplSSA.Instruction):
+                        self.kill[block_of[op]] |= bit
+                        defined_here |= block_of[op] is block
+                if not defined_here:
+                    self.antloc[block] |= bit
+
+    # Global properties
+    def solve(self):
+        blocks, order = self.blocks, self.order
+        ones = (1 << len(self.sample)) - 1
+        preds = {block: [p for p in block.preds if p in order] for block in blocks}
+        root = blocks[0]
+
+        # anticipated: computed on every path from here before a kill
+        ant_in = {block: ones for block in blocks}
+        ant_out = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(blocks):
+                out = ones if block.succs else 0
+                for succ in block.succs:
+                    out &= ant_in[succ]
+                ant_out[block] = out
+                new = self.antloc[block] | (out & ~self.kill[block])
+                if new != ant_in[block]:
+                    ant_in[block] = new
+                    changed = True
+
+        # available: computed on every path to here after the last kill
+        av_out = {block: ones for block in blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in blocks:
+                av_in = ones if preds[block] else 0
+                for pred in preds[block]:
+                    av_in &= av_out[pred]
+                new = self.comp[block] | (av_in & ~self.kill[block])
+                if new != av_out[block]:
+                    av_out[block] = new
+                    changed = True
+
+        # the earliest edges where the expression can go, then moved down
+        # as long as that does not lengthen a path with no use of it
+        earliest = {}
+        for block in blocks:
+            for pred in preds[block]:
+                earliest[pred, block] = (
+                    ant_in[block] & ~av_out[pred] & (self.kill[pred] | ~ant_out[pred])
+                )
+        later_in = {block: ones for block in blocks}
+        later_in[root] = ant_in[root]
+        later = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in blocks:
+                if block is root:
+                    continue
+                new = ones
+                for pred in preds[block]:
+                    later[pred, block] = earliest[pred, block] | (
+                        later_in[pred] & ~self.antloc[pred]
+                    )
+                    new &= later[pred, block]
+                if new != later_in[block]:
+                    later_in[block] = new
+                    changed = True
+
+        self.insert = {
+            edge: bits & ~later_in[edge[1]] & ones
+            for edge, bits in later.items()
+            if bits & ~later_in[edge[1]] & ones
+        }
+        self.delete = {
+            block: self.antloc[block] & ~later_in[block]
+            for block in blocks
+            if block is not root and self.antloc[block] & ~later_in[block]
+        }
+
+    # Transformation
+    def transform(self, e):
+        bit = 1 << e
+        deleted = {block for block, bits in self.delete.items() if bits & bit}
+        if not deleted:
+            return
+        edges = [edge for edge, bits in self.insert.items() if bits & bit]
+        for pred, block in edges:
+            # a critical edge would have to be split first, leave it alone
+            if len(pred.succs) > 1 and len(block.preds) > 1:
+                return
+
+        sample = self.sample[e]
+        self.at_end = {}  # block computing the expression -> its value at the end
+        self.at_entry = {}
+        self.new_phis = {}  # phi -> block
+        for pred, block in edges:
+            instr = self.graph.new_instr(sample.instr, *sample.ops)
+            if len(pred.succs) == 1:
+                self.place(pred, instr, at_end=True)
+                self.at_end[pred] = instr
+            else:
+                self.place(block, instr, at_end=False)
+                self.at_entry[block] = instr
+            self.n_inserted += 1
+
+        # the first occurrence of a block defines the value, unless it is
+        # deleted, later ones are redundant anyway
+        replace = []
+        for block in self.blocks:
+            occurrences = self.occurrences.get((block, e))
+            if not occurrences:
+                continue
+            value = None
+            for instr in occurrences:
+                if value is None and block not in deleted:
+                    value = instr
+                    continue
+                replace.append((instr, block, value))
+            if value is not None:
+                self.at_end.setdefault(block, value)
+
+        removed = {}  # dict as an ordered set of the blocks
+        for instr, block, value in replace:
+            if value is None:
+                value = self.value_at_entry(block)
+                removed[block] = None
+            instr.replace_all_uses(value)
+            block.instrs.remove(instr)
+            instr.unlink()
+            self.n_removed += 1
+        smplPhiElim.remove_trivial_phis(self.new_phis)
+
+        deleted_paths = []
+        for block in removed:
+            paths = []
+            for pred in block.preds:
+                # no evaluation on this edge any more, unless one was inserted
+                saved = (pred, block) not in edges
+                self.n_saved += saved
+                paths.append((pred, saved))
+            deleted_paths.append((block, paths))
+        self.graph.pre_report.append((sample, edges, deleted_paths))
+
+    def place(self, block, instr, at_end):
+        block.instrs = [other for other in block.instrs if not other.is_empty]
+        if at_end:
+            at = len(block.instrs)
+            if at and block.instrs[-1].instr in BRANCH_OPS:
+                at -= 1
+        else:
+            at = 0
+            while at < len(block.instrs) and block.instrs[at].instr == Op.PHI:
+                at += 1
+        block.instrs.insert(at, instr)
+
+    def value_at_entry(self, block):
+        return smplPhiElim.value_at_entry(
+            self.graph,
+            block,
+            self.at_end.get,
+            self.at_entry,
+            self.new_phis,
+            self.not_available,
+        )
+
+    def not_available(self):
+        raise Exception("[ERROR] PRE: expression not available in the entry block")
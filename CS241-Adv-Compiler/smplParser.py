@@ -1,57 +1,77 @@
 import smplAST as ast
+import smplLex
+
+T = smplLex.TokenKind
+
+# FIRST sets used to pick a grammar branch
+EXPRESSION_FIRST = frozenset({T.IDENT, T.NUMBER, T.LPAREN, T.CALL})
+STATEMENT_FIRST = frozenset({T.LET, T.CALL, T.IF, T.WHILE, T.RETURN})
+VAR_DECL_FIRST = frozenset({T.VAR, T.ARRAY})
+FUNC_DECL_FIRST = frozenset({T.VOID, T.FUNCTION})
+MUL_OPS = frozenset({T.ASTERISK, T.SLASH})
+ADD_OPS = frozenset({T.PLUS, T.MINUS})
+REL_OPS = frozenset({T.OP_EQ, T.OP_NEQ, T.OP_LT, T.OP_LE, T.OP_GT, T.OP_GE})
 
 
 class Parser:
     def __init__(self, lex):
         self.lex = lex
+        self.tokens = smplLex.TokenStream(lex)
 
     def start_parser(self):
         # The return value will be an ASTree
         return self.computation()
 
-    def peek(self):
-        return self.lex.peek().token
+    def peek(self, k=1):
+        next = self.tokens.peek(k)
+        return next.kind if next else None
 
     def consume(self, type):
-        next = self.lex.next()
-        if next and next.token == type:
+        next = self.tokens.consume()
+        if next and next.kind == type:
             return next
 
         if not next:
             raise Exception(
-                "[ERROR] POS: {}, Type: {}, Token: {} not consumed.".format(
-                    self.lex.pos, type, self.lex.input[self.lex.pos]
+                "[ERROR] POS: {}, Type: {}, Token: <EOF> not consumed.".format(
+                    self.lex.pos, T(type).name
                 )
             )
         raise Exception(
             "[ERROR] Unexpected token: POS: {}, Type: {}, Token: {}.".format(
-                self.lex.pos, type, self.lex.input[self.lex.pos]
+                next.pos, T(type).name, next.val
             )
         )
 
     def relOp(self):
-        op = self.peek()
-        self.consume(self.peek())
-        return op
+        if self.peek() not in REL_OPS:
+            next = self.tokens.peek(1)
+            raise Exception(
+                "[ERROR] Unexpected token: POS: {}, Rule: relOp, Token: {}.".format(
+                    next.pos if next else self.lex.pos,
+                    next.val if next else "<EOF>",
+                )
+            )
+        return self.consume(self.peek()).token
 
     # ident = letter {letter | digit}
     def ident(self):
-        letter = self.consume("IDENT")
+        letter = self.consume(T.IDENT)
         return ast.Identifier(letter.val)
 
     # number = digit {digit}
     def number(self):
-        num = self.consume("NUMBER")
+        num = self.consume(T.NUMBER)
         return ast.Number(int(num.val))
 
     # designator = ident{ "[" expression "]" }
     def designator(self):
         ident = self.ident()
         arr = []
-        while self.peek() == "LBRACKET":
-            self.consume("LBRACKET")
+        while self.peek() == T.LBRACKET:
+            self.consume(T.LBRACKET)
             arr.append(self.expression())
-            self.consume("RBRACKET")
+            self.consume(T.RBRACKET)
         if not arr:
             return ident
         return ast.Array(ident, arr)
@@ -59,25 +79,24 @@ class Parser:
     # factor = designator | number | "(" expression ")" | funcCall
     def factor(self):
         res = None
-        if self.peek() == "IDENT":
+        if self.peek() == T.IDENT:
             return self.designator()
-        if self.peek() == "NUMBER":
+        if self.peek() == T.NUMBER:
             return self.number()
-        if self.peek() == "CALL":
+        if self.peek() == T.CALL:
             return self.func_call()
-        if self.peek() == "LPAREN":
-            self.consume("LPAREN")
+        if self.peek() == T.LPAREN:
+            self.consume(T.LPAREN)
             res = self.expression()
-            self.consume("RPAREN")
+            self.consume(T.RPAREN)
 
         return res
 
     # term = factor { ("*" | "/") factor}
     def term(self):
         left = self.factor()
-        while self.peek() in {"ASTERISK", "SLASH"}:
-            op = "ASTERISK" if self.peek() == "ASTERISK" else "SLASH"
-            self.consume(op)
+        while self.peek() in MUL_OPS:
+            op = self.consume(self.peek()).token
             right = self.factor()
             left = ast.Operator(op, left, right)
         return left
@@ -85,9 +104,8 @@ class Parser:
     # expression = term {("+" | "-") term}
     def expression(self):
         left = self.term()
-        while self.peek() in {"PLUS", "MINUS"}:
-            op = "PLUS" if self.peek() == "PLUS" else "MINUS"
-            self.consume(op)
+        while self.peek() in ADD_OPS:
+            op = self.consume(self.peek()).token
             right = self.term()
             left = ast.Operator(op, left, right)
         return left
@@ -101,80 +119,80 @@ class Parser:
 
     # assignment = "let" designator "<-" expression
     def assignment(self):
-        self.consume("LET")
+        self.consume(T.LET)
         left = self.designator()
-        self.consume("ASSIGN")
+        self.consume(T.ASSIGN)
         right = self.expression()
         return ast.Assignment(left, right)
 
     # funcCall = "call" ident [ "(" [expression { "," expression } ] ")" ]
     def func_call(self):
-        self.consume("CALL")
+        self.consume(T.CALL)
         funcName = self.ident()
         params = []
-        if self.peek() == "LPAREN":
-            self.consume("LPAREN")
-            if self.peek() in {"IDENT", "NUMBER", "LPAREN", "CALL"}:
+        if self.peek() == T.LPAREN:
+            self.consume(T.LPAREN)
+            if self.peek() in EXPRESSION_FIRST:
                 params.append(self.expression())
-                while self.peek() == "COMMA":
-                    self.consume("COMMA")
+                while self.peek() == T.COMMA:
+                    self.consume(T.COMMA)
                     params.append(self.expression())
-            self.consume("RPAREN")
+            self.consume(T.RPAREN)
         return ast.FuncCall(funcName, params)
 
     # ifStatement = "if" relation "then" statSequence [ "else" statSequence ] "fi"
     def if_stat(self):
-        self.consume("IF")
+        self.consume(T.IF)
         relation = self.relation()
-        self.consume("THEN")
+        self.consume(T.THEN)
         thenStatement = self.stat_sequence()
         elseStatement = None
-        if self.peek() == "ELSE":
-            self.consume("ELSE")
+        if self.peek() == T.ELSE:
+            self.consume(T.ELSE)
             elseStatement = self.stat_sequence()
-        self.consume("FI")
+        self.consume(T.FI)
         if not elseStatement:
             elseStatement = []
         return ast.IfStatement(relation, thenStatement, elseStatement)
 
     # whileStatement = "while" relation "do" StatSequence "od"
     def while_stat(self):
-        self.consume("WHILE")
+        self.consume(T.WHILE)
         relation = self.relation()
-        self.consume("DO")
+        self.consume(T.DO)
         statement = self.stat_sequence()
-        self.consume("OD")
+        self.consume(T.OD)
         return ast.WhileStatement(relation, statement)
 
     # returnStatement = "return" [ expression ]
     def return_stat(self):
-        self.consume("RETURN")
+        self.consume(T.RETURN)
         # expression -> [ident, number, (expression), call]
         ret = None
-        if self.peek() in {"IDENT", "NUMBER", "LPAREN", "CALL"}:
+        if self.peek() in EXPRESSION_FIRST:
             ret = self.expression()
 
         return ast.ReturnStatement(ret)
 
     # statement = assignment | funcCall | ifStatement | whileStatement | returnStatemen
     def statement(self):
-        if self.peek() == "LET":
+        if self.peek() == T.LET:
             return self.assignment()
-        if self.peek() == "CALL":
+        if self.peek() == T.CALL:
             return self.func_call()
-        if self.peek() == "IF":
+        if self.peek() == T.IF:
             return self.if_stat()
-        if self.peek() == "WHILE":
+        if self.peek() == T.WHILE:
             return self.while_stat()
-        if self.peek() == "RETURN":
+        if self.peek() == T.RETURN:
             return self.return_stat()
 
     # statSequence = statement { ";" statement } [ ";" ]
     def stat_sequence(self):
         statements = [self.statement()]
-        while self.peek() == "SEMICOLON":
-            self.consume("SEMICOLON")
-            if self.peek() in {"LET", "CALL", "IF", "WHILE", "RETURN"}:
+        while self.peek() == T.SEMICOLON:
+            self.consume(T.SEMICOLON)
+            if self.peek() in STATEMENT_FIRST:
                 statements.append(self.statement())
 
         return statements
@@ -182,71 +200,71 @@ class Parser:
     # typeDecl = "var" | "array" "[" number "]" { "[" number "]" }
     def type_decl(self):
         type = (
-            "VAR" if self.peek() == "VAR" else "ARRAY"
+            T.VAR if self.peek() == T.VAR else T.ARRAY
         )  # get variable type (var or array)
-        if type == "ARRAY":
+        if type == T.ARRAY:
             arr = []
-            self.consume("ARRAY")
-            self.consume("LBRACKET")
+            self.consume(T.ARRAY)
+            self.consume(T.LBRACKET)
             arr.append(self.number())
-            self.consume("RBRACKET")
-            while self.peek() == "LBRACKET":
-                self.consume("LBRACKET")
+            self.consume(T.RBRACKET)
+            while self.peek() == T.LBRACKET:
+                self.consume(T.LBRACKET)
                 arr.append(self.number())
-                self.consume("RBRACKET")
+                self.consume(T.RBRACKET)
             return arr
         else:
-            self.consume("VAR")
+            self.consume(T.VAR)
             return []
 
     # varDecl = typeDecl ident { "," ident } ";"
     def var_decl(self):
         arr = self.type_decl()
         idents = [self.ident()]
-        while self.peek() == "COMMA":
-            self.consume("COMMA")
+        while self.peek() == T.COMMA:
+            self.consume(T.COMMA)
             idents.append(self.ident())
-        self.consume("SEMICOLON")
+        self.consume(T.SEMICOLON)
         return [ast.VarDecl(ident, arr) for ident in idents]
 
     # funcDecl = [ "void" ] "function" ident formalParam ";" funcBody ";"
     def func_decl(self):
         is_void = False
-        if self.peek() == "VOID":
-            self.consume("VOID")
+        if self.peek() == T.VOID:
+            self.consume(T.VOID)
             is_void = True
-        self.consume("FUNCTION")
+        self.consume(T.FUNCTION)
         funcIdent = self.ident()
         params = self.formal_param()
-        self.consume("SEMICOLON")
+        self.consume(T.SEMICOLON)
         body = self.func_body()
-        self.consume("SEMICOLON")
+        self.consume(T.SEMICOLON)
         return ast.FuncDecl(
             func_name=funcIdent, params=params, body=body, is_void=is_void
         )
 
     # formalParam = "(" [ident { "," ident }] ")"
     def formal_param(self):
-        self.consume("LPAREN")
+        self.consume(T.LPAREN)
         idents = []
-        if self.peek() == "IDENT":
+        if self.peek() == T.IDENT:
             idents.append(self.ident())
-            while self.peek() == "COMMA":
-                self.consume("COMMA")
+            while self.peek() == T.COMMA:
+                self.consume(T.COMMA)
                 idents.append(self.ident())
-        self.consume("RPAREN")
+        self.consume(T.RPAREN)
         return idents
 
     # funcBody = { varDecl } "{" [ statSequence ] "}"
     def func_body(self):
         varDecl = []
         stats = []
-        while self.peek() in {"VAR", "ARRAY"}:
+        while self.peek() in VAR_DECL_FIRST:
             varDecl.extend(self.var_decl())
-        self.consume("LBRACE")
-        if self.peek() in {"LET", "CALL", "IF", "WHILE", "RETURN"}:
+        self.consume(T.LBRACE)
+        if self.peek() in STATEMENT_FIRST:
             stats = self.stat_sequence()
-        self.consume("RBRACE")
+        self.consume(T.RBRACE)
         return {"vars": varDecl, "stats": stats}
 
     # computation = "main" { varDecl } { funcDecl } "{" statSequence "}" "."
@@ -254,15 +272,15 @@ class Parser:
         varDecl = []
         funcDecl = []
 
-        self.consume("MAIN")
-        while self.peek() in {"VAR", "ARRAY"}:
+        self.consume(T.MAIN)
+        while self.peek() in VAR_DECL_FIRST:
             varDecl.extend(self.var_decl())
-        while self.peek() in {"VOID", "FUNCTION"}:
+        while self.peek() in FUNC_DECL_FIRST:
             funcDecl.append(self.func_decl())
 
-        self.consume("LBRACE")
+        self.consume(T.LBRACE)
         statements = self.stat_sequence()
-        self.consume("RBRACE")
-        self.consume("PERIOD")
+        self.consume(T.RBRACE)
+        self.consume(T.PERIOD)
 
         return ast.Computation(varDecl, funcDecl, statements)
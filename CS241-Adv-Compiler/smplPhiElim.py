@@ -0,0 +1,186 @@
+import smplSSA
+
+Op = smplSSA.Op
+
+
+def trivial_value(phi):
+    # the one value a phi merges, its own operands ignored, None if several
+    value = None
+    for op in phi.ops:
+        if op is phi or op is value:
+            continue
+        if value is not None:
+            return None
+        value = op
+    return value
+
+
+def remove_trivial_phis(phis):
+    # phis: phi -> block. A phi merging a single value is replaced by that
+    # value, the phis using it might become trivial then, so they are
+    # checked again. Returns the number of phis removed
+    work = list(phis)
+    n_removed = 0
+    while work:
+        phi = work.pop()
+        if phi not in phis:
+            continue
+        value = trivial_value(phi)
+        if value is None:
+            continue
+        users = [user for user in phi.uses if user in phis and user is not phi]
+        phi.replace_all_uses(value)
+        phis.pop(phi).instrs.remove(phi)
+        phi.unlink()
+        n_removed += 1
+        work.extend(users)
+    return n_removed
+
+
+def value_at_entry(graph, block, defined_at_end, at_entry, new_phis, at_root):
+    # The value reaching the entry of block, built on demand (Braun et al.):
+    # the value at the end of its single predecessor, or a new phi of the
+    # values at the end of all of them. defined_at_end(pred) gives the value
+    # a block leaves at its end, None if it passes the one at its entry on,
+    # at_root() the value in the root, at_entry (block -> value) caches the
+    # result and new_phis (phi -> block) collects the phis placed, for
+    # remove_trivial_phis. Walks with a stack of the phis still missing
+    # operands instead of recursing, a program might be a long chain of ifs
+    stack = []  # [phi, block, operands so far]
+
+    def entry(block):
+        # up the single predecessors, to a value or a block needing a phi
+        chain = []
+        while block not in at_entry:
+            if not block.preds:
+                at_entry[block] = at_root()
+            elif len(block.preds) > 1:
+                # registered before the operands, a loop leads back here
+                phi = graph.new_instr(Op.PHI)
+                at_entry[block] = phi
+                place(block, phi)
+                new_phis[phi] = block
+                stack.append([phi, block, []])
+            else:
+                chain.append(block)
+                value = defined_at_end(block.preds[0])
+                if value is not None:
+                    at_entry[block] = value
+                else:
+                    block = block.preds[0]
+        value = at_entry[block]
+        for other in chain:
+            at_entry[other] = value
+        return value
+
+    value = entry(block)
+    while stack:
+        phi, block, ops = stack[-1]
+        if len(ops) == len(block.preds):
+            stack.pop()
+            phi.set_ops(*ops)
+            continue
+        pred = block.preds[len(ops)]
+        op = defined_at_end(pred)
+        ops.append(entry(pred) if op is None else op)
+    return value
+
+
+def place(block, phi):
+    # after the phis of the block
+    block.instrs = [instr for instr in block.instrs if not instr.is_empty]
+    at = 0
+    while at < len(block.instrs) and block.instrs[at].instr == Op.PHI:
+        at += 1
+    block.instrs.insert(at, phi)
+
+
+class PhiElimination:
+    # Removes the phis that do not merge anything: trivial ones, phi(x, x)
+    # or phi(x, itself), and cycles of phis with a single value coming in
+    # from outside the cycle, like the phis of a variable that is copied
+    # around a loop but never changed. Iterated to a fixed point
+    def __init__(self, graph):
+        self.graph = graph
+        self.n_removed = 0
+
+    def run(self):
+        phis = {}
+        for block in self.graph.cfg().rpo:
+            for instr in block.instrs:
+                if not instr.is_empty and instr.instr == Op.PHI:
+                    phis[instr] = block
+        changed = True
+        while changed:
+            n_removed = remove_trivial_phis(phis)
+            n_removed += self.remove_cycles(phis)
+            self.n_removed += n_removed
+            changed = n_removed > 0
+        self.graph.stats["phi.removed"] += self.n_removed
+        return self
+
+    def remove_cycles(self, phis):
+        # a strongly connected set of phis (phi -> phi operand) with one
+        # value from outside stands for that value
+        n_removed = 0
+        for scc in self.phi_sccs(phis):
+            if len(scc) < 2:
+                continue
+            outside = {}  # dict as an ordered set
+            for phi in scc:
+                for op in phi.ops:
+                    if op not in scc:
+                        outside[op] = None
+            if len(outside) != 1:
+                continue
+            (value,) = outside
+            for phi in scc:
+                phi.replace_all_uses(value)
+            for phi in scc:
+                phis.pop(phi).instrs.remove(phi)
+                phi.unlink()
+            n_removed += len(scc)
+        return n_removed
+
+    def phi_sccs(self, phis):
+        # Tarjan's algorithm without recursion, operands before users
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        sccs = []
+        for root in phis:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(root.ops))]
+            while work:
+                phi, ops = work[-1]
+                for op in ops:
+                    if op not in phis:
+                        continue
+                    if op not in index:
+                        index[op] = low[op] = len(index)
+                        stack.append(op)
+                        on_stack.add(op)
+                        work.append((op, iter(op.ops)))
+                        break
+                    if op in on_stack:
+                        low[phi] = min(low[phi], index[op])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[phi])
+                    if low[phi] == index[phi]:
+                        scc = set()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            scc.add(member)
+                            if member is phi:
+                                break
+                        sccs.append(scc)
+        return sccs
@@ -0,0 +1,437 @@
+import array
+import glob
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import time
+
+import config
+import smplInterp
+import smplSSA
+
+Op = smplSSA.Op
+
+# compiled programs, <key>.pyc
+CACHE_DIR = "./cache"
+# byte address -> word index, a shift if the size is a power of 2
+WORD_SHIFT = config.INTEGER_SIZE.bit_length() - 1
+if 1 << WORD_SHIFT == config.INTEGER_SIZE:
+    WORD_INDEX = "mem[({}) >> %d]" % WORD_SHIFT
+else:
+    WORD_INDEX = "mem[({}) // %d]" % config.INTEGER_SIZE
+
+BINARY_OPS = {Op.ADD: "+", Op.SUB: "-", Op.MUL: "*", Op.ADDA: "+", Op.CMP: "-"}
+# the arithmetic wrapping around to a word (smplSSA.wrap), once for a whole
+# expression of them: it is the same modulo the size of a word
+WRAPPED_OPS = frozenset({Op.ADD, Op.SUB, Op.MUL})
+WRAP = "({} + %#x & %#x) - %#x" % (
+    smplSSA.WORD_SIGN,
+    smplSSA.WORD_MASK,
+    smplSSA.WORD_SIGN,
+)
+# the condition under which a branch is taken, a fused cmp compares its
+# operands instead of their difference with 0
+BRANCH_CONDS = {
+    Op.BEQ: "==",
+    Op.BNE: "!=",
+    Op.BLT: "<",
+    Op.BLE: "<=",
+    Op.BGT: ">",
+    Op.BGE: ">=",
+}
+NEGATED_CONDS = {
+    Op.BEQ: "!=",
+    Op.BNE: "==",
+    Op.BLT: ">=",
+    Op.BLE: ">",
+    Op.BGT: "<=",
+    Op.BGE: "<",
+}
+# a jump that leaves the statement list it is in
+JUMP_STATEMENTS = ("break", "continue", "return")
+
+
+def value_name(op, names):
+    # an operand written in Python or C: SSA values are locals named in the
+    # order they are first seen (names: instr -> name), parameters p_<name>
+    if isinstance(op, smplSSA.Instruction):
+        if op not in names:
+            names[op] = "v{}".format(len(names) + 1)
+        return names[op]
+    if isinstance(op, smplSSA.ImmediateOp):
+        # an uninitialized variable reads as 0
+        return "0" if op.un_init else str(smplSSA.wrap(op.val))
+    if isinstance(op, smplSSA.ArgumentOp):
+        return "p_" + op.name
+    raise Exception("[ERROR] Cannot lower the operand '{}'".format(op))
+
+
+class Lowering:
+    # Lowers one SubGraph to a Python function. The CFG of a SMPL program
+    # is structured, so it is written back as if statements and while
+    # loops along the dominator tree: a block whose single forward
+    # predecessor is its dominator is nested in the arm branching to it,
+    # the other blocks it dominates (the joins) follow the statement. A
+    # jump becomes nothing (the next statement is its target), continue
+    # (the loop header) or break (the loop exit). Phis are copies on the
+    # edges, one tuple assignment so they are read before any is set.
+    # SSA values are Python locals, arrays live in the memory of Runtime
+    def __init__(self, graph, name, params):
+        self.graph = graph
+        self.cfg = graph.cfg()
+        self.name = name
+        self.params = params
+        self.names = {}  # instr -> Python local
+        self.lines = []
+        self.indent = 1
+        self.headers = {loop.header: loop for loop in self.cfg.loop_postorder()}
+        self.fused = set()  # instructions written into their users
+        self.has_alloca = False
+
+    def lower(self):
+        blocks = self.cfg.rpo
+        for block in blocks:
+            instrs = set(block.instrs)
+            for instr in block.instrs:
+                if not instr.is_empty:
+                    self.fuse(instr, instrs)
+                    self.has_alloca |= instr.instr == Op.ALLOCA
+        if self.has_alloca:
+            # the arrays of this call are freed when it returns
+            self.emit("_sp = rt.sp")
+        self.emit_tree(blocks[0], None, None)
+        params = ", ".join("p_" + param for param in self.params or ())
+        return ["def {}({}):".format(self.name, params)] + (self.lines or ["    pass"])
+
+    def fuse(self, instr, block_instrs):
+        # a cmp only used by its branch becomes the condition, an adda only
+        # used as an address the index of the memory access, and other
+        # arithmetic used once in its block the operand of its user (the
+        # phis of a block are only set on the edges leaving it, so every
+        # operand still has the same value there)
+        uses = list(instr.uses)
+        if instr.instr == Op.CMP:
+            if len(uses) == 1 and uses[0].instr in smplSSA.BRANCH_OPS:
+                self.fused.add(instr)
+        elif instr.instr == Op.ADDA and uses:
+            if all(self.is_address(use, instr) for use in uses):
+                self.fused.add(instr)
+        elif instr.instr in BINARY_OPS and len(uses) == 1:
+            if uses[0] in block_instrs and uses[0].instr != Op.PHI:
+                self.fused.add(instr)
+
+    def is_address(self, use, addr):
+        if use.instr == Op.LOAD:
+            return True
+        return use.instr == Op.STORE and use.ops[0] is not addr
+
+    # Values
+    def value(self, op):
+        if op in self.fused:
+            return self.expression(op)
+        return value_name(op, self.names)
+
+    def operand(self, op, wrapped):
+        # the value of op as an operand of an expression, not wrapped
+        # itself in one that wraps around
+        if op in self.fused:
+            if wrapped and op.instr in WRAPPED_OPS:
+                return "({})".format(self.arithmetic(op))
+            return "({})".format(self.value(op))
+        return self.value(op)
+
+    def expression(self, instr):
+        if instr.instr in WRAPPED_OPS:
+            return WRAP.format(self.arithmetic(instr))
+        return self.arithmetic(instr)
+
+    def arithmetic(self, instr):
+        wrapped = instr.instr in WRAPPED_OPS
+        left, right = (self.operand(op, wrapped) for op in instr.ops)
+        if instr.instr in (Op.ADD, Op.SUB) and right.startswith("-"):
+            # x + -4 is written x - 4
+            return "{} {} {}".format(left, "+-"[instr.instr == Op.ADD], right[1:])
+        return "{} {} {}".format(left, BINARY_OPS[instr.instr], right)
+
+    def address(self, addr):
+        return WORD_INDEX.format(self.value(addr))
+
+    # Control flow
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def forward_preds(self, block):
+        return [
+            pred
+            for pred in block.preds
+            if pred in self.cfg.order and not self.cfg.dominates(block, pred)
+        ]
+
+    def nested(self, block, succ):
+        # whether succ is written in the arm of block branching to it
+        if succ not in self.cfg.dom_tree[block] or len(self.forward_preds(succ)) != 1:
+            return False
+        loop = self.headers.get(block)
+        return loop is None or succ in loop.blocks
+
+    def emit_tree(self, block, follow, loop):
+        # follow: the block running after the statement written for block,
+        # loop: (header, exit) of the innermost Python loop
+        joins = [
+            child for child in self.cfg.dom_tree[block] if not self.nested(block, child)
+        ]
+        follows = joins[1:] + [follow]
+        if block in self.headers:
+            self.emit("while True:")
+            self.indent += 1
+            start = len(self.lines)
+            self.emit_block(block, block, (block, joins[0] if joins else None))
+            if len(self.lines) == start:
+                # a header jumping to itself, an endless empty loop
+                self.emit("pass")
+            self.indent -= 1
+        else:
+            self.emit_block(block, joins[0] if joins else follow, loop)
+        for join, join_follow in zip(joins, follows):
+            self.emit_tree(join, join_follow, loop)
+
+    def emit_block(self, block, follow, loop):
+        for instr in block.instrs:
+            if instr.is_empty or instr.instr == Op.PHI or instr in self.fused:
+                continue
+            opcode = instr.instr
+            if opcode in smplSSA.BRANCH_OPS:
+                self.emit_branch(block, instr, follow, loop)
+                return
+            if opcode == Op.BRA:
+                self.goto(block, instr.ops[0], follow, loop)
+                return
+            if opcode in (Op.RETURN, Op.END):
+                self.emit_return(instr)
+                return
+            self.emit_instr(instr)
+        if block.succs:
+            self.goto(block, block.succs[0], follow, loop)
+        else:
+            self.emit_return(None)
+
+    def emit_branch(self, block, branch, follow, loop):
+        cond = branch.ops[0]
+        taken = branch.ops[1]
+        fall = [succ for succ in block.succs if succ is not taken][0]
+        if cond in self.fused:
+            left, right = (self.operand(op, False) for op in cond.ops)
+        else:
+            left, right = self.value(cond), "0"
+        taken_if = "if {} {} {}:".format(left, BRANCH_CONDS[branch.instr], right)
+        fall_if = "if {} {} {}:".format(left, NEGATED_CONDS[branch.instr], right)
+        taken_lines = self.arm(block, taken, follow, loop)
+        fall_lines = self.arm(block, fall, follow, loop)
+        if not fall_lines:
+            self.emit(taken_if)
+            self.lines += taken_lines or ["    " * (self.indent + 1) + "pass"]
+        elif not taken_lines:
+            self.emit(fall_if)
+            self.lines += fall_lines
+        elif len(taken_lines) == 1 and taken_lines[0].split()[0] in JUMP_STATEMENTS:
+            # the other arm does not need to be nested
+            self.emit(taken_if)
+            self.lines += taken_lines
+            self.lines += [line[4:] for line in fall_lines]
+        else:
+            self.emit(fall_if)
+            self.lines += fall_lines
+            self.emit("else:")
+            self.lines += taken_lines
+
+    def arm(self, block, succ, follow, loop):
+        # the lines of the jump block -> succ, one level deeper
+        lines, self.lines = self.lines, []
+        self.indent += 1
+        self.goto(block, succ, follow, loop)
+        self.indent -= 1
+        lines, self.lines = self.lines, lines
+        return lines
+
+    def goto(self, block, succ, follow, loop):
+        self.emit_copies(block, succ)
+        if self.nested(block, succ):
+            self.emit_tree(succ, follow, loop)
+        elif succ is follow:
+            pass  # the next statement
+        elif loop is not None and succ is loop[0]:
+            self.emit("continue")
+        elif loop is not None and succ is loop[1]:
+            self.emit("break")
+        else:
+            raise Exception(
+                "[ERROR] Cannot lower the jump BB{} -> BB{} to Python".format(
+                    block.label, succ.label
+                )
+            )
+
+    def emit_copies(self, block, succ):
+        index = succ.preds.index(block)
+        dests, srcs = [], []
+        for instr in succ.instrs:
+            if not instr.is_empty and instr.instr == Op.PHI:
+                dest, src = self.value(instr), self.value(instr.ops[index])
+                if dest != src:
+                    dests.append(dest)
+                    srcs.append(src)
+        if dests:
+            self.emit("{} = {}".format(", ".join(dests), ", ".join(srcs)))
+
+    # Instructions
+    def emit_return(self, instr):
+        if self.has_alloca:
+            self.emit("rt.sp = _sp")
+        if instr is None or instr.instr == Op.END or instr.ops[0] == "":
+            self.emit("return 0" if self.params is not None else "return")
+        else:
+            self.emit("return {}".format(self.value(instr.ops[0])))
+
+    def emit_instr(self, instr):
+        opcode = instr.instr
+        ops = [self.value(op) for op in instr.ops if not isinstance(op, str)]
+        if opcode in BINARY_OPS:
+            expr = self.expression(instr)
+        elif opcode == Op.DIV:
+            expr = "div({}, {})".format(*ops)
+        elif opcode == Op.LOAD:
+            expr = self.address(instr.ops[0])
+        elif opcode == Op.STORE:
+            self.emit("{} = {}".format(self.address(instr.ops[1]), ops[0]))
+            return
+        elif opcode == Op.ALLOCA:
+            expr = "alloca({})".format(ops[0])
+        elif opcode == Op.READ:
+            expr = "read()"
+        elif opcode == Op.WRITE:
+            self.emit("write({})".format(ops[0]))
+            return
+        elif opcode == Op.WRITENL:
+            self.emit("write_nl()")
+            return
+        elif opcode == Op.CALL:
+            expr = "f_{}({})".format(instr.ops[0], ", ".join(ops))
+        else:
+            raise Exception("[ERROR] Cannot lower '{}' to Python".format(instr))
+        self.emit("{} = {}".format(self.value(instr), expr))
+
+
+def generate(graph):
+    # Python source of a Graph, smpl_main() runs the program
+    lines = ["# generated from SMPL"]
+    for subgraph in graph.graphs[1:]:
+        name = subgraph.root.name
+        lines += Lowering(subgraph, "f_" + name, subgraph.params).lower()
+    lines += Lowering(graph.graphs[0], "smpl_main", None).lower()
+    return "\n".join(lines) + "\n"
+
+
+def cache_key(source, options):
+    # the SMPL source, the compiler options and the compiler itself
+    digest = hashlib.sha256(source)
+    digest.update(repr(sorted(options.items())).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(here, "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class CodeCache:
+    # code objects marshaled like a .pyc, behind the magic number of the
+    # running Python so another version compiles them again. An entry
+    # keeps what the compiler printed (warnings, stats) with the code, to
+    # print it again when the entry is used
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pyc")
+
+    def load(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        magic = importlib.util.MAGIC_NUMBER
+        if not data.startswith(magic):
+            return None
+        return marshal.loads(data[len(magic) :])  # (code, diagnostics)
+
+    def store(self, key, code, diagnostics=""):
+        os.makedirs(self.directory, exist_ok=True)
+        # written next to the entry first, a reader never sees half of it
+        path = self.path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(importlib.util.MAGIC_NUMBER + marshal.dumps((code, diagnostics)))
+        os.replace(path + ".tmp", path)
+
+
+def compile_graph(graph, filename="<smpl>"):
+    return compile(generate(graph), filename, "exec")
+
+
+class Runtime:
+    # What the generated code runs on: the flat memory (words, like the
+    # interpreter), the stack pointer of the arrays and buffered I/O
+    def __init__(self, stdin=None, stdout=None, memory_size=smplInterp.MEMORY_SIZE):
+        self.stdout = stdout or sys.stdout
+        self.numbers = smplInterp.read_numbers(stdin or sys.stdin)
+        self.memory = array.array("q", bytes(8 * memory_size))
+        self.sp = 0
+        self.elapsed = 0.0
+
+    def alloca(self, size):
+        base = self.sp
+        words = size // config.INTEGER_SIZE
+        if base + words > len(self.memory):
+            raise Exception("[ERROR] Out of memory")
+        self.memory[base : base + words] = array.array("q", bytes(8 * words))
+        self.sp = base + words
+        return base * config.INTEGER_SIZE
+
+    def read(self):
+        number = next(self.numbers, None)
+        if number is None:
+            raise Exception("[ERROR] InputNum: no more input")
+        return smplSSA.wrap(number)
+
+    def run(self, code):
+        out = []  # flushed at the end and before every read
+        write = out.append
+
+        def read():
+            self.stdout.write("".join(out))
+            out.clear()
+            return self.read()
+
+        namespace = {
+            "mem": self.memory,
+            "rt": self,
+            "alloca": self.alloca,
+            "div": lambda a, b: smplSSA.wrap(smplInterp.divide(a, b)),
+            "read": read,
+            "write": lambda value: write("{} ".format(value)),
+            "write_nl": lambda: write("\n"),
+        }
+        start = time.perf_counter()
+        try:
+            exec(code, namespace)
+            namespace["smpl_main"]()
+        except IndexError:
+            raise Exception("[ERROR] Array access out of the memory")
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.stdout.write("".join(out))
+            self.stdout.flush()
+        return self
+
+    def report(self):
+        return "[RUN] python backend: {:.3f} s".format(self.elapsed)
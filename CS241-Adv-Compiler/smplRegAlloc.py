@@ -0,0 +1,255 @@
+import config
+import smplDLXGen
+import smplSSA
+
+Op = smplSSA.Op
+
+# registers for the --regs flag without a count
+DEFAULT_REGISTERS = 8
+# R1 up to R24, the others are scratch registers or reserved (see smplDLX)
+MAX_REGISTERS = 24
+# a use or definition costs this many times more for each enclosing loop
+LOOP_WEIGHT = 10
+
+
+class RegisterAllocation:
+    # Register allocation of a SubGraph by coloring its interference graph.
+    # The interference graph of a strict SSA program is chordal: coloring the
+    # values in the order of their definitions along the dominator tree uses
+    # no more colors than the most values live at one point. So the spilling
+    # happens first, until at most n_registers values are live everywhere,
+    # taking the values cheapest to keep in memory (uses and definitions
+    # weighted by LOOP_WEIGHT for each loop around them) that are live at
+    # the most of the crowded points. A spilled value lives in a slot of the
+    # frame, like every value of smplDLXGen.SlotAllocation. The coloring is
+    # biased to give a phi and its operands the same register, which
+    # coalesces the copy on that edge.
+    def __init__(self, graph, n_registers=DEFAULT_REGISTERS):
+        if not 1 <= n_registers <= MAX_REGISTERS:
+            raise Exception(
+                "[ERROR] The number of registers must be between 1 and {}".format(
+                    MAX_REGISTERS
+                )
+            )
+        self.graph = graph
+        self.n_registers = n_registers
+        self.cfg = graph.cfg()
+        self.values = {}  # instr -> None, every value in the order it is defined
+        self.block_of = {}  # instr -> its block
+        self.registers = {}  # instr -> register
+        self.slots = {}  # spilled instr -> slot
+        self.live_after = {}  # call -> values in registers live after it
+        self.n_moves = 0
+        self.n_coalesced = 0
+
+    def run(self):
+        for block in self.dom_order():
+            for instr in block.instrs:
+                self.block_of[instr] = block
+                if smplDLXGen.has_value(instr):
+                    self.values[instr] = None
+        self.spill()
+        self.color()
+        for block in self.cfg.rpo:
+            for phi in self.phis(block):
+                for op in phi.ops:
+                    if op in self.values or isinstance(op, smplSSA.ArgumentOp):
+                        self.n_moves += 1
+                        if op in self.registers and self.registers[
+                            op
+                        ] == self.registers.get(phi):
+                            self.n_coalesced += 1
+        self.graph.stats["regalloc.registers"] += len(set(self.registers.values()))
+        self.graph.stats["regalloc.spills"] += len(self.slots)
+        self.graph.stats["regalloc.coalesced"] += self.n_coalesced
+        self.graph.stats["regalloc.moves"] += self.n_moves - self.n_coalesced
+        self.graph.allocation = self
+        return self
+
+    def dom_order(self):
+        # dominators first
+        order = []
+        stack = [self.cfg.rpo[0]]
+        while stack:
+            block = stack.pop()
+            order.append(block)
+            stack.extend(reversed(self.cfg.dom_tree[block]))
+        return order
+
+    def phis(self, block):
+        return [
+            instr
+            for instr in block.instrs
+            if not instr.is_empty and instr.instr == Op.PHI
+        ]
+
+    # Liveness
+    def live_out(self, block, live_in, values):
+        live = set()
+        for succ in block.succs:
+            live |= live_in.get(succ, set())
+            index = succ.preds.index(block)
+            live.update(
+                phi.ops[index] for phi in self.phis(succ) if phi.ops[index] in values
+            )
+        return live
+
+    def liveness(self, values):
+        # the values live into each block (after its phis), to a fixed point
+        live_in = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.cfg.rpo):
+                live = self.live_out(block, live_in, values)
+                for instr in reversed(block.instrs):
+                    if instr.is_empty or instr.instr == Op.PHI:
+                        continue
+                    live.discard(instr)
+                    live.update(op for op in instr.ops if op in values)
+                live.difference_update(self.phis(block))
+                if live != live_in.get(block):
+                    live_in[block] = live
+                    changed = True
+        return live_in
+
+    def walk(self, values, visit):
+        # visit(defined values, values live after them) at every definition,
+        # backwards through each block, the phis of a block together
+        live_in = self.liveness(values)
+        for block in self.cfg.rpo:
+            live = self.live_out(block, live_in, values)
+            for instr in reversed(block.instrs):
+                if instr.is_empty or instr.instr == Op.PHI:
+                    continue
+                live.discard(instr)
+                if instr in values:
+                    visit((instr,), live)
+                if instr.instr == Op.CALL:
+                    self.live_after[instr] = set(live)
+                live.update(op for op in instr.ops if op in values)
+            phis = [phi for phi in self.phis(block) if phi in values]
+            if phis:
+                live.difference_update(phis)
+                visit(phis, live)
+
+    # Spilling
+    def cost(self, instr):
+        depth = self.cfg.loop_depth
+        cost = LOOP_WEIGHT ** depth(self.block_of[instr])
+        for use in instr.uses or ():
+            block = self.block_of.get(use)
+            if block is None:
+                continue  # not reachable
+            if use.instr == Op.PHI:
+                # copied at the end of the predecessor
+                for pred, op in zip(block.preds, use.ops):
+                    if op is instr:
+                        cost += LOOP_WEIGHT ** depth(pred)
+            else:
+                cost += LOOP_WEIGHT ** depth(block)
+        return cost
+
+    def spill(self):
+        crowded = []  # the values live at each point with too many of them
+
+        def visit(defined, live):
+            if len(defined) + len(live) > self.n_registers:
+                crowded.append(set(defined) | live)
+
+        self.walk(self.values, visit)
+        order = {value: i for i, value in enumerate(self.values)}
+        costs = {}
+        while crowded:
+            # the value relieving the most crowded points for its cost
+            points = {}
+            for values in crowded:
+                for value in values:
+                    points[value] = points.get(value, 0) + 1
+            for value in points:
+                if value not in costs:
+                    costs[value] = self.cost(value)
+            spilled = min(
+                points, key=lambda value: (costs[value] / points[value], order[value])
+            )
+            self.slots[spilled] = None
+            for values in crowded:
+                values.discard(spilled)
+            crowded = [values for values in crowded if len(values) > self.n_registers]
+        for i, value in enumerate(sorted(self.slots, key=order.__getitem__)):
+            self.slots[value] = i
+
+    # Coloring
+    def color(self):
+        values = {value: None for value in self.values if value not in self.slots}
+        neighbors = {value: set() for value in values}
+
+        def visit(defined, live):
+            for value in defined:
+                neighbors[value].update(live)
+                neighbors[value].update(
+                    other for other in defined if other is not value
+                )
+                for other in live:
+                    neighbors[other].add(value)
+
+        self.live_after = {}
+        self.walk(values, visit)
+        for value in values:  # in the order of their definitions
+            taken = {
+                self.registers[other]
+                for other in neighbors[value]
+                if other in self.registers
+            }
+            register = None
+            for preferred in self.preferences(value):
+                if preferred not in taken:
+                    register = preferred
+                    break
+            if register is None:
+                free = [r for r in range(1, self.n_registers + 1) if r not in taken]
+                if not free:
+                    # not strict SSA here, keep it in memory
+                    self.slots[value] = len(self.slots)
+                    continue
+                register = free[0]
+            self.registers[value] = register
+        for call, live in self.live_after.items():
+            self.live_after[call] = sorted(
+                {self.registers[v] for v in live if v in self.registers}
+            )
+
+    def preferences(self, value):
+        # the registers of the phis it is copied to, of the other values
+        # copied to them and of its operands if it is a phi
+        phis = [use for use in value.uses or () if use.instr == Op.PHI]
+        if value.instr == Op.PHI:
+            phis.append(value)
+        related = []
+        for phi in phis:
+            related.append(phi)
+            related += [op for op in phi.ops if isinstance(op, smplSSA.Instruction)]
+        return [self.registers[other] for other in related if other in self.registers]
+
+    # The allocation smplDLXGen lowers with
+    @property
+    def frame(self):
+        # bytes of the slots of the spilled values
+        return config.INTEGER_SIZE * len(self.slots)
+
+    def location(self, instr):
+        if instr in self.registers:
+            return smplDLXGen.REGISTER, self.registers[instr]
+        if instr not in self.slots:
+            raise Exception("[ERROR] No register or slot for '{}'".format(instr))
+        return smplDLXGen.SLOT, -config.INTEGER_SIZE * (self.slots[instr] + 1)
+
+    def live_across(self, call):
+        return self.live_after.get(call, ())
+
+    def annotation(self, instr):
+        if instr in self.registers:
+            return "R{}".format(self.registers[instr])
+        if instr in self.slots:
+            return "spill {}".format(self.slots[instr])
+        return None
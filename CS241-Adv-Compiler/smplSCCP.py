@@ -0,0 +1,214 @@
+import operator
+
+import smplSSA
+
+Op = smplSSA.Op
+
+# lattice values besides constants: TOP (no value seen yet) is a missing
+# entry in SCCP.values, BOTTOM is this marker
+BOTTOM = object()
+
+FOLD_FUNCS = {
+    Op.ADD: lambda a, b: smplSSA.wrap(a + b),
+    Op.SUB: lambda a, b: smplSSA.wrap(a - b),
+    Op.MUL: lambda a, b: smplSSA.wrap(a * b),
+    Op.DIV: lambda a, b: smplSSA.wrap(int(a / b)),
+    # compared against zero by the branch that uses it
+    Op.CMP: operator.sub,
+}
+
+# branch taken if the cmp result satisfies the condition
+BRANCH_FUNCS = {
+    Op.BEQ: lambda v: v == 0,
+    Op.BNE: lambda v: v != 0,
+    Op.BLT: lambda v: v < 0,
+    Op.BLE: lambda v: v <= 0,
+    Op.BGT: lambda v: v > 0,
+    Op.BGE: lambda v: v >= 0,
+}
+
+# for removing unnecessary ops (ex: add 0, sub 0...)
+LEFT_UNIT = {Op.ADD: 0, Op.MUL: 1}
+RIGHT_UNIT = {Op.ADD: 0, Op.SUB: 0, Op.MUL: 1, Op.DIV: 1}
+
+
+class SCCP:
+    # Sparse conditional constant propagation (Wegman & Zadeck) over one
+    # SubGraph: constants are propagated through phis along the CFG edges
+    # that can be executed, branches on constant conditions are resolved
+    # and the blocks that can never run are removed
+    def __init__(self, graph):
+        self.graph = graph
+        self.values = {}  # instr -> constant or BOTTOM
+        self.executable_blocks = set()
+        self.executable_edges = set()  # (pred, succ)
+        self.block_of = {}
+        self.n_folded = 0
+        self.n_branches = 0
+        self.n_blocks_removed = 0
+
+    def run(self):
+        blocks = self.graph.cfg().rpo
+        for block in blocks:
+            for instr in block.instrs:
+                self.block_of[instr] = block
+        self.propagate()
+        self.resolve_branches(blocks)
+        self.remove_unreachable(blocks)
+        self.fold_constants()
+        self.graph.stats["sccp.folded"] += self.n_folded
+        self.graph.stats["sccp.branches"] += self.n_branches
+        self.graph.stats["sccp.blocks_removed"] += self.n_blocks_removed
+        return self
+
+    # Analysis
+    def op_value(self, op):
+        if isinstance(op, smplSSA.ImmediateOp):
+            # keep uninitialized values, they are reported as warnings
+            return BOTTOM if op.un_init else smplSSA.wrap(op.val)
+        if isinstance(op, smplSSA.Instruction):
+            return self.values.get(op)
+        return BOTTOM
+
+    def evaluate(self, instr, block):
+        opcode = instr.instr
+        if opcode == Op.PHI:
+            result = None
+            for pred, op in zip(block.preds, instr.ops):
+                if (pred, block) not in self.executable_edges:
+                    continue
+                val = self.op_value(op)
+                if val is None:
+                    continue
+                if result is None:
+                    result = val
+                elif val is BOTTOM or val != result:
+                    return BOTTOM
+            return result
+        if opcode in FOLD_FUNCS:
+            left, right = (self.op_value(op) for op in instr.ops)
+            if opcode == Op.MUL and (left == 0 or right == 0):
+                return 0
+            if left is BOTTOM or right is BOTTOM:
+                return BOTTOM
+            if left is None or right is None:
+                return None
+            if opcode == Op.DIV and right == 0:
+                return BOTTOM
+            return FOLD_FUNCS[opcode](left, right)
+        return BOTTOM
+
+    def visit(self, instr, block, ssa_work, flow_work):
+        if instr.is_empty:
+            return
+        if instr.instr in BRANCH_FUNCS:
+            self.visit_branch(instr, block, flow_work)
+            return
+        val = self.evaluate(instr, block)
+        old = self.values.get(instr)
+        if val is None or old is BOTTOM or (old is not None and old == val):
+            return
+        if old is not None and val is not BOTTOM:
+            # two different constants, values only move down the lattice
+            val = BOTTOM
+        self.values[instr] = val
+        ssa_work.extend(instr.uses)
+
+    def visit_branch(self, instr, block, flow_work):
+        links = block.block_links()
+        cond = self.op_value(instr.ops[0])
+        if cond is None:
+            return
+        if cond is BOTTOM or BRANCH_FUNCS[instr.instr](cond):
+            flow_work.extend((block, succ) for succ in links.get("branch", []))
+        if cond is BOTTOM or not BRANCH_FUNCS[instr.instr](cond):
+            flow_work.extend((block, succ) for succ in links.get("fall_through", []))
+
+    def propagate(self):
+        flow_work = [(None, self.graph.root)]
+        ssa_work = []
+        while flow_work or ssa_work:
+            while flow_work:
+                edge = flow_work.pop()
+                if edge in self.executable_edges:
+                    continue
+                self.executable_edges.add(edge)
+                block = edge[1]
+                first_visit = block not in self.executable_blocks
+                self.executable_blocks.add(block)
+                for instr in block.instrs:
+                    # phis see a new incoming edge, the rest only runs once
+                    if first_visit or instr.instr == Op.PHI:
+                        self.visit(instr, block, ssa_work, flow_work)
+                if first_visit and block.branch_instr() is None:
+                    flow_work.extend((block, succ) for succ in block.successors())
+            while ssa_work:
+                instr = ssa_work.pop()
+                block = self.block_of.get(instr)
+                if block in self.executable_blocks:
+                    self.visit(instr, block, ssa_work, flow_work)
+
+    # Transformation
+    def resolve_branches(self, blocks):
+        for block in blocks:
+            if block not in self.executable_blocks:
+                continue
+            instr = block.branch_instr()
+            if instr is None:
+                continue
+            cond = self.op_value(instr.ops[0])
+            if cond is BOTTOM or cond is None:
+                continue
+            self.n_branches += 1
+            if BRANCH_FUNCS[instr.instr](cond):
+                # always taken
+                instr.instr = Op.BRA
+                instr.set_ops(instr.ops[1])
+            else:
+                # never taken
+                block.instrs.remove(instr)
+                instr.unlink()
+
+    def remove_unreachable(self, blocks):
+        for block in blocks:
+            for succ in block.successors():
+                if (block, succ) not in self.executable_edges:
+                    block.remove_child(succ)
+            if block not in self.executable_blocks:
+                self.n_blocks_removed += 1
+                for instr in block.instrs:
+                    instr.unlink()
+
+    def fold_constants(self):
+        for block in self.executable_blocks:
+            for instr in list(block.instrs):
+                val = self.values.get(instr)
+                if instr.instr == Op.PHI and len(instr.ops) == 1:
+                    # the other predecessor can never run
+                    new_op = instr.ops[0]
+                elif val is not None and val is not BOTTOM:
+                    new_op = smplSSA.ImmediateOp(val)
+                else:
+                    new_op = self.simplify(instr)
+                if new_op is None:
+                    continue
+                if instr.instr == Op.CMP and instr.uses:
+                    continue
+                block.instrs.remove(instr)
+                instr.unlink()
+                instr.replace_all_uses(new_op)
+                self.n_folded += 1
+
+    def simplify(self, instr):
+        # algebraic identities (add 0, mul 1...) on the remaining instructions
+        opcode = instr.instr
+        if opcode not in FOLD_FUNCS or opcode == Op.CMP:
+            return None
+        left, right = instr.ops
+        if isinstance(left, smplSSA.ImmediateOp) and not left.un_init:
+            if LEFT_UNIT.get(opcode) == left.val:
+                return right
+        if isinstance(right, smplSSA.ImmediateOp) and not right.un_init:
+            if RIGHT_UNIT.get(opcode) == right.val:
+                return left
+        return None
@@ -0,0 +1,157 @@
+import config
+import smplPhiElim
+import smplSSA
+
+Op = smplSSA.Op
+
+
+class SROA:
+    # Scalar replacement of aggregates: an array whose every access has a
+    # constant offset (after constant folding) is split into one SSA value
+    # per element. A store defines the element, a load is replaced by the
+    # value reaching it, and a phi is placed where different values of an
+    # element meet. The alloca, the addas, the loads and the stores go away
+    def __init__(self, graph):
+        self.graph = graph
+        self.n_promoted = 0
+        self.n_elements = 0
+
+    def run(self):
+        blocks = self.graph.cfg().rpo
+        promoted = []
+        for block in blocks:
+            for instr in block.instrs:
+                if not instr.is_empty and instr.instr == Op.ALLOCA:
+                    if self.promotable(instr):
+                        promoted.append(instr)
+        if promoted:
+            self.promote(blocks, set(promoted))
+        self.graph.stats["sroa.promoted"] += self.n_promoted
+        self.graph.stats["sroa.elements"] += self.n_elements
+        return self
+
+    # Analysis
+    def offset(self, addr):
+        # the constant offset of an address into its array, None if unknown
+        if addr.instr == Op.ALLOCA:
+            return 0
+        offset = addr.ops[0]
+        if isinstance(offset, smplSSA.ImmediateOp) and not offset.un_init:
+            return offset.val
+        return None
+
+    def is_access(self, instr, addr):
+        # a load from addr or a store to it (not a store of addr itself)
+        if instr.instr == Op.LOAD:
+            return True
+        return (
+            instr.instr == Op.STORE
+            and instr.ops[1] is addr
+            and instr.ops[0] is not addr
+        )
+
+    def promotable(self, alloca):
+        size = alloca.ops[0].val
+        for use in alloca.uses:
+            if use.instr == Op.ADDA:
+                if use.ops[1] is not alloca or use.ops[0] is alloca:
+                    return False
+                addr = use
+            elif self.is_access(use, alloca):
+                addr = alloca
+                continue
+            else:
+                return False
+            offset = self.offset(addr)
+            if offset is None or not 0 <= offset < size:
+                return False
+            if offset % config.INTEGER_SIZE:
+                return False
+            if not all(self.is_access(access, addr) for access in addr.uses):
+                return False
+        return True
+
+    # Transformation
+    def element(self, instr, promoted):
+        # (alloca, offset) accessed by a load or a store, None for other arrays
+        addr = instr.ops[0] if instr.instr == Op.LOAD else instr.ops[1]
+        if not isinstance(addr, smplSSA.Instruction):
+            return None
+        alloca = addr if addr.instr == Op.ALLOCA else addr.ops[1]
+        if addr.instr not in (Op.ALLOCA, Op.ADDA) or alloca not in promoted:
+            return None
+        return alloca, self.offset(addr)
+
+    def promote(self, blocks, promoted):
+        # the last value stored to each element in each block
+        self.stored = {block: {} for block in blocks}
+        for block in blocks:
+            for instr in block.instrs:
+                if not instr.is_empty and instr.instr == Op.STORE:
+                    element = self.element(instr, promoted)
+                    if element is not None:
+                        self.stored[block][element] = instr
+        self.replaced = {}  # removed load -> its value
+        self.at_entry = {}  # element -> block -> value at its entry
+        self.new_phis = {}  # phi -> block
+
+        removed = []
+        elements = set()
+        for block in blocks:
+            current = {}
+            # a phi might be added to this block on the way
+            for instr in list(block.instrs):
+                if instr.is_empty or instr.instr not in (Op.LOAD, Op.STORE):
+                    continue
+                element = self.element(instr, promoted)
+                if element is None:
+                    continue
+                elements.add(element)
+                if instr.instr == Op.STORE:
+                    current[element] = instr.ops[0]
+                else:
+                    if element not in current:
+                        current[element] = self.value_at_entry(block, element)
+                    value = self.resolve(current[element])
+                    instr.replace_all_uses(value)
+                    self.replaced[instr] = value
+                removed.append((block, instr))
+        for block in blocks:
+            for instr in block.instrs:
+                if instr.instr == Op.ADDA and instr.ops[1] in promoted:
+                    removed.append((block, instr))
+                elif instr.instr == Op.ALLOCA and instr in promoted:
+                    removed.append((block, instr))
+
+        for phi in self.new_phis:
+            # an operand cached before the load it came from was replaced
+            if any(op in self.replaced for op in phi.ops):
+                phi.set_ops(*(self.resolve(op) for op in phi.ops))
+        for block, instr in removed:
+            block.instrs.remove(instr)
+            instr.unlink()
+        smplPhiElim.remove_trivial_phis(self.new_phis)
+        self.n_promoted += len(promoted)
+        self.n_elements += len(elements)
+
+    def stored_at_end(self, block, element):
+        store = self.stored[block].get(element)
+        return None if store is None else self.resolve(store.ops[0])
+
+    def value_at_entry(self, block, element):
+        value = smplPhiElim.value_at_entry(
+            self.graph,
+            block,
+            lambda pred: self.stored_at_end(pred, element),
+            self.at_entry.setdefault(element, {}),
+            self.new_phis,
+            # never stored, the memory of an array starts zeroed
+            lambda: smplSSA.ImmediateOp(0),
+        )
+        return self.resolve(value)
+
+    def resolve(self, value):
+        # a value read before the load it came from was replaced
+        while value in self.replaced:
+            value = self.replaced[value]
+        return value
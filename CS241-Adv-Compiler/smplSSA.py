@@ -1,33 +1,113 @@
-class InstructionOp:
-    def __init__(self, instr):
-        self.i = instr.i
-        # for instruction reordering after constant elimination
-        self.has_reordered = False
+import enum
 
-    def __str__(self):
-        return "({})".format(self.i)
+import config
 
-    def __eq__(self, other):
-        return isinstance(other, InstructionOp) and self.i == other.i
+
+class Op(enum.IntEnum):
+    EMPTY = 0  # placeholder of an empty block
+    ADD = enum.auto()
+    SUB = enum.auto()
+    MUL = enum.auto()
+    DIV = enum.auto()
+    CMP = enum.auto()
+    ADDA = enum.auto()
+    LOAD = enum.auto()
+    STORE = enum.auto()
+    ALLOCA = enum.auto()
+    PHI = enum.auto()
+    END = enum.auto()
+    BRA = enum.auto()
+    BNE = enum.auto()
+    BEQ = enum.auto()
+    BLE = enum.auto()
+    BLT = enum.auto()
+    BGE = enum.auto()
+    BGT = enum.auto()
+    READ = enum.auto()
+    WRITE = enum.auto()
+    WRITENL = enum.auto()
+    CALL = enum.auto()
+    RETURN = enum.auto()
+
+
+# printed names, indexed by opcode
+OP_NAMES = (
+    "\<empty\>",
+    "add",
+    "sub",
+    "mul",
+    "div",
+    "cmp",
+    "adda",
+    "load",
+    "store",
+    "alloca",
+    "phi",
+    "end",
+    "bra",
+    "bne",
+    "beq",
+    "ble",
+    "blt",
+    "bge",
+    "bgt",
+    "read",
+    "write",
+    "writeNL",
+    "call",
+    "return",
+)
+# printed name -> opcode, for the names used in config
+OPCODES = {name: Op(i) for i, name in enumerate(OP_NAMES)}
+# conditional branches, "bra" is unconditional
+BRANCH_OPS = frozenset({Op.BNE, Op.BEQ, Op.BLE, Op.BLT, Op.BGE, Op.BGT})
+# printed without an opcode, the builtin name comes first (ex: "5:  read")
+BUILTIN_OPS = frozenset({Op.READ, Op.WRITE, Op.WRITENL})
+
+# values are words of config.INTEGER_SIZE bytes, the arithmetic wraps around
+WORD_SIGN = 1 << (8 * config.INTEGER_SIZE - 1)
+WORD_MASK = (WORD_SIGN << 1) - 1
+
+
+def wrap(value):
+    return (value + WORD_SIGN & WORD_MASK) - WORD_SIGN
 
 
 class ImmediateOp:
-    def __init__(self, val, un_init=False):
-        self.val = val
-        self.un_init = un_init
-        self.name = ""  # for printing uninit variables in warning
-        if self.un_init:
-            self.name = val
-            self.val = 0
+    __slots__ = ("val", "un_init", "name")
+    # immediates are immutable, so ImmediateOp(0) always returns the same object
+    interned = {}
+
+    def __new__(cls, val, un_init=False):
+        if not un_init:
+            op = cls.interned.get(val)
+            if op is not None:
+                return op
+        op = object.__new__(cls)
+        op.val = val
+        op.un_init = un_init
+        op.name = ""  # for printing uninit variables in warning
+        if un_init:
+            op.name = val
+            op.val = 0
+        else:
+            cls.interned[val] = op
+        return op
 
     def __str__(self):
         return "#{}".format(self.val)
 
     def __eq__(self, other):
-        return isinstance(other, ImmediateOp) and self.val == other.val
+        return self is other or (
+            isinstance(other, ImmediateOp) and self.val == other.val
+        )
+
+    __hash__ = object.__hash__
 
 
 class ArgumentOp:
+    __slots__ = ("name",)
+
     def __init__(self, ident):
         self.name = ident.name
 
@@ -35,28 +115,63 @@ class ArgumentOp:
         return "@{}".format(self.name)
 
 
+def op_str(op, block_label=None):
+    # an instruction operand is printed as the number of the instruction,
+    # a block (branch target) as its label
+    if isinstance(op, Instruction):
+        return "({})".format(op.i)
+    if hasattr(op, "instrs"):
+        return "(BB{})".format(block_label(op) if block_label else op.label)
+    return str(op)
+
+
 class Instruction:
-    # Instruction object consists of instr and ops (InstructionOp, ImmediateOp, and ArgumentOp)
+    # Instruction object consists of an opcode and ops (Instruction,
+    # ImmediateOp, ArgumentOp, a block for branches or a name for calls),
+    # an Instruction operand refers to the instruction defining the value
+    __slots__ = ("instr", "ops", "uses", "i", "is_empty")
+
     def __init__(self, instr, *ops):
         self.instr = instr
         self.ops = ops
+        # instructions that use this one as an operand (dict as an ordered set),
+        # filled in by link() once the instruction is placed in a block,
+        # the dict is only allocated for the first use
+        self.uses = ()
         self.i = -1
-        self.dom_by_instr = None
         self.is_empty = False
-        # for instruction reordering after constant elimination
-        self.has_reordered = False
 
     def __str__(self):
-        try:  # more than 1 arguments
-            args = " ".join(str(op) for op in self.ops)
-        except:  # (for load op)
-            args = self.ops
-        if not self.is_empty:
-            return "{}: {} {}".format(self.i, self.instr, args)
-        else:
-            return "{}".format(self.instr)
+        return self.format()
+
+    def format(self, block_label=None):
+        if self.is_empty:
+            return OP_NAMES[self.instr]
+        name = OP_NAMES[self.instr]
+        args = [op_str(op, block_label) for op in self.ops]
+        if self.instr in BUILTIN_OPS:
+            name, args = "", [name] + args
+        return "{}: {} {}".format(self.i, name, " ".join(args))
+
+    def link(self):
+        # register this instruction as a use of its operands
+        for op in self.ops:
+            if isinstance(op, Instruction):
+                if not op.uses:
+                    op.uses = {}
+                op.uses[self] = None
+
+    def unlink(self):
+        for op in self.ops:
+            if isinstance(op, Instruction) and op.uses:
+                op.uses.pop(self, None)
+
+    def set_ops(self, *ops):
+        self.unlink()
+        self.ops = ops
+        self.link()
 
-    def find_identical_instr(self, dom_list):
-        for candidate in dom_list:
-            if candidate.ops == self.ops:
-                return candidate
+    def replace_all_uses(self, new_op):
+        # replace every use of this instruction by new_op, O(#uses)
+        for user in list(self.uses):
+            user.set_ops(*(new_op if op is self else op for op in user.ops))
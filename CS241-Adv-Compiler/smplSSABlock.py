@@ -1,40 +1,125 @@
 import collections
 import operator
-from os import kill
 
 import smplSSA
 
+Op = smplSSA.Op
 
-class Block:
+# for constant elimination
+FOLD_FUNCS = {
+    Op.ADD: operator.add,
+    Op.ADDA: operator.add,
+    Op.DIV: operator.truediv,
+    Op.SUB: operator.sub,
+    Op.MUL: operator.mul,
+}
+# for removing unnecessary ops (ex: add 0, sub 0...)
+LEFT_UNIT = {
+    Op.ADD: smplSSA.ImmediateOp(0),
+    Op.ADDA: smplSSA.ImmediateOp(0),
+    Op.MUL: smplSSA.ImmediateOp(1),
+}
+RIGHT_UNIT = {
+    Op.ADD: smplSSA.ImmediateOp(0),
+    Op.ADDA: smplSSA.ImmediateOp(0),
+    Op.SUB: smplSSA.ImmediateOp(0),
+    Op.MUL: smplSSA.ImmediateOp(1),
+    Op.DIV: smplSSA.ImmediateOp(1),
+}
+
+# the variable values are kept in a 32-way trie
+TRIE_BITS = 5
+TRIE_WIDTH = 1 << TRIE_BITS
+TRIE_MASK = TRIE_WIDTH - 1
+
+
+class SymbolTable:
+    # Persistent map of the variables of a block. fork() is O(1): the new
+    # table shares the trie with its parent, and set() only copies the path
+    # to the changed slot, so a block costs O(#assignments) instead of
+    # O(#variables). Names and array strides are fixed once declared and
+    # shared by every fork.
     def __init__(self):
+        self.slots = {}  # name -> (slot, strides), in declaration order
+        self.root = [None] * TRIE_WIDTH
+        self.shift = 0
+        self.shared = False  # slots is shared with another table
+
+    def fork(self):
+        table = SymbolTable()
+        table.slots = self.slots
+        table.root = self.root
+        table.shift = self.shift
+        table.shared = self.shared = True
+        return table
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def declare(self, name, strides):
+        if self.shared:
+            self.slots = dict(self.slots)
+            self.shared = False
+        slot = len(self.slots)
+        self.slots[name] = (slot, strides)
+        # add a level on top when the trie is full
+        while slot >= TRIE_WIDTH << self.shift:
+            self.root = [self.root] + [None] * (TRIE_WIDTH - 1)
+            self.shift += TRIE_BITS
+
+    def in_order(self, names):
+        # the declared names among names, in declaration order
+        return sorted(
+            (name for name in names if name in self.slots),
+            key=lambda name: self.slots[name][0],
+        )
+
+    def strides(self, name):
+        return self.slots[name][1]
+
+    def get(self, name):
+        slot = self.slots[name][0]
+        node = self.root
+        shift = self.shift
+        while shift > 0:
+            node = node[(slot >> shift) & TRIE_MASK]
+            if node is None:
+                return None
+            shift -= TRIE_BITS
+        return node[slot & TRIE_MASK]
+
+    def set(self, name, val):
+        slot = self.slots[name][0]
+        self.root = self.copy_path(self.root, self.shift, slot, val)
+
+    def copy_path(self, node, shift, slot, val):
+        node = list(node) if node else [None] * TRIE_WIDTH
+        index = (slot >> shift) & TRIE_MASK
+        if shift == 0:
+            node[index] = val
+        else:
+            node[index] = self.copy_path(node[index], shift - TRIE_BITS, slot, val)
+        return node
+
+
+class Block:
+    def __init__(self, graph=None):
+        self.graph = graph  # the SubGraph, notified when edges change
         self.label = -1
         self.instrs = []
         self.children = collections.defaultdict(set)
-        self.local_variables = {}
-        self.local_arr_strides = {}
-        self.dominates = []
-        self.search_list = collections.defaultdict(list)
-        self.join_block_killed = []
-        self.possibly_killed_load = {}
-
-    def rename_op(self, old_op, new_op, visited=None):
-        if not visited:
-            visited = set()
-        if self in visited:
-            return
-        visited.add(self)
-        for instr in self.instrs:
-            new_instr_ops = list(instr.ops)
-            for i, op in enumerate(instr.ops):
-                if op == old_op:
-                    new_instr_ops[i] = new_op
-            instr.ops = tuple(new_instr_ops)
-        for _, succesors in self.children.items():
-            # rename instr in the children that has the same name as this instr
-            for child in succesors:
-                child.rename_op(old_op, new_op, visited)
-
-    def emit(self, instr_index, instr_name, *args, check_dup=True, is_empty=False):
+        # in the order the edges were added, phi operands follow preds
+        self.succs = []
+        self.preds = []
+        self.local_variables = SymbolTable()
+
+    def emit(self, instr_index, values, opcode, *args, check_dup=True, is_empty=False):
         # Return: emit instruction and change of instruction count
         # Default: increase one after emitting
         # We need to return -1 if we don't want the instruction count to increase
@@ -45,109 +130,115 @@ class Block:
             # then recreate it with empty instruction object
             del self.instrs[0]
 
-        instr = smplSSA.Instruction(instr_name, *args)
-        if instr_name == "adda":
-            dom_list = self.search_list["load"]
-        else:
-            dom_list = self.search_list[instr_name]
+        instr = smplSSA.Instruction(opcode, *args)
 
         if not is_empty:
             if check_dup:  # perform CSE
-                identical = instr.find_identical_instr(dom_list)
+                key = values.key(instr)
+                identical = values.lookup(key)
                 if identical is not None:
                     # identical instruction found, no need to increase the instruction count
-                    return smplSSA.InstructionOp(identical), instr_change - 1
+                    return identical, instr_change - 1
                 # Handle CSE for array
                 # potentially ignored op: load (adda then load)
                 elif (
                     # current is load
-                    instr.instr == "load"
+                    opcode == Op.LOAD
                     # load should be followed by an adda
                     and len(self.instrs) > 0
-                    and self.instrs[-1].instr == "adda"
+                    and self.instrs[-1].instr == Op.ADDA
                     # should be loading the previous adda instr
-                    and instr.ops[0] == smplSSA.InstructionOp(self.instrs[-1])
+                    and instr.ops[0] is self.instrs[-1]
                 ):
-                    adda_before_load = self.instrs[-1]  # get adda before this load
-                    orig_ops = instr.ops
-                    start_check_dup = True
-                    # first we check whether 'adda' is possibly killed by its predecessor
-                    for killed_adda in self.possibly_killed_load:
-                        if killed_adda.ops == adda_before_load.ops:
-                            # we should skip this case, since it is killed already
-                            start_check_dup = False
-                            # clear search list and add this (adda,load) pair to it
-                            self.search_list["load"] = [self.instrs[-1], instr]
-                            # clear possibly killed load, since the first one is killed
-                            self.possibly_killed_load = {}
-
-                    if start_check_dup:
-                        prev_identical_adda = adda_before_load.find_identical_instr(
-                            dom_list
-                        )
-                        if prev_identical_adda is not None:
-                            # load previous adda instr, check whether it already exists
-                            # this is to make it consistent with other load instrs
-                            instr.ops = (smplSSA.InstructionOp(prev_identical_adda),)
-                            identical = instr.find_identical_instr(dom_list)
-                            if identical is not None:
-                                # Both load and adda can be eliminated
-                                del self.instrs[-1]
-                                # need to remove one more line of instr!
-                                return (
-                                    smplSSA.InstructionOp(identical),
-                                    instr_change - 2,
-                                )
-                            else:
-                                instr.ops = orig_ops
-            # either perform cse or not, we still need to concatenate dom instr list
-            if (
-                instr_name == "store"
-                and len(self.instrs) > 0
-                and self.instrs[-1].instr == "adda"
-            ):
-                # 'adda' in this block will affect its child block
-                # need to check whether ops are the same (if same, it should be reloaded)
-                self.join_block_killed.append(self.instrs[-1])
-                # add kill to load searchlist
-                self.search_list["load"] = []
-            elif instr_name == "adda":
-                self.search_list["load"].append(instr)
-            else:
-                self.search_list[instr_name].append(instr)
+                    # a load is identified by the operands of its adda,
+                    # loads are only reused while memory is not killed
+                    key = values.key(self.instrs[-1], Op.LOAD)
+                    identical = values.lookup(key)
+                    if identical is not None:
+                        # Both load and adda can be eliminated
+                        self.instrs.pop().unlink()
+                        # need to remove one more line of instr!
+                        return identical, instr_change - 2
+                values.insert(key, instr)
+            if opcode == Op.STORE:
+                # loads emitted before this store might read a stale value
+                values.kill_memory()
             instr.i = instr_index
         elif is_empty:  # this is an '<empty>' instr
             instr.is_empty = True
             instr_change -= 1
+        instr.link()
         self.instrs.append(instr)
-        return smplSSA.InstructionOp(instr), instr_change
+        return instr, instr_change
+
+    def delete_instr(self, index, new_op):
+        # delete instrs[index] and let its uses refer to new_op instead
+        instr = self.instrs.pop(index)
+        instr.unlink()
+        instr.replace_all_uses(new_op)
 
     def add_child(self, type, block):
         self.children[type].add(block)
+        if block in self.succs:
+            return
+        self.succs.append(block)
+        block.preds.append(self)
+        if self.graph is not None:
+            self.graph.invalidate_cfg()
+
+    def remove_child(self, block):
+        # drop the edge self -> block, the phi operands for it are dropped too
+        for type in [t for t, blocks in self.children.items() if block in blocks]:
+            self.children[type].discard(block)
+            if not self.children[type]:
+                del self.children[type]
+        self.succs.remove(block)
+        index = block.preds.index(self)
+        del block.preds[index]
+        if self.graph is not None:
+            self.graph.invalidate_cfg()
+        for instr in block.instrs:
+            if instr.instr == Op.PHI:
+                ops = list(instr.ops)
+                del ops[index]
+                instr.set_ops(*ops)
+
+    def successors(self):
+        # fall through block first, then the branch target
+        return list(self.succs)
+
+    def branch_instr(self):
+        # the conditional branch ending this block, if any
+        for instr in reversed(self.instrs):
+            if instr.is_empty:
+                continue
+            if instr.instr in smplSSA.BRANCH_OPS:
+                return instr
+            return None
+        return None
 
     def declare_local_var(self, name, strides=None):
-        if name in self.local_variables.keys():
+        if name in self.local_variables:
             raise Exception("[ERROR] Attempted to redeclare variable '{}'".format(name))
-        self.local_variables[name] = None
-        self.local_arr_strides[name] = strides
+        self.local_variables.declare(name, strides)
 
     def get_local_var(self, name):
-        if name not in self.local_variables.keys():
+        if name not in self.local_variables:
             raise Exception(
                 "[ERROR] Accessing an undeclared variable '{}'".format(name)
             )
-        var = self.local_variables[name]
-        strides = self.local_arr_strides[name]
+        var = self.local_variables.get(name)
+        strides = self.local_variables.strides(name)
         if not var:
             return smplSSA.ImmediateOp(name, un_init=True), strides
         return var, strides
 
     def set_local_var(self, name, val):
-        if name not in self.local_variables.keys():
+        if name not in self.local_variables:
             raise Exception(
                 "[ERROR] Accessing an undeclared variable '{}'".format(name)
             )
-        self.local_variables[name] = val
+        self.local_variables.set(name, val)
 
     def block_links(self):
         children_keys = self.children.keys()
@@ -165,6 +256,11 @@ class Block:
                 }
             elif "then" not in children_keys and "join" in children_keys:
                 links = {"fall_through": self.children["join"]}
+            # the branch was resolved at compile time (see smplSCCP)
+            elif "then" in children_keys:
+                links = {"fall_through": self.children["then"]}
+            elif "else" in children_keys:
+                links = {"branch": self.children["else"]}
 
         # this is a whileStatement related block
         if (
@@ -179,39 +275,23 @@ class Block:
                     "fall_through": self.children["body"],
                     "branch": self.children["exit"],
                 }
+            # the loop condition was resolved at compile time (see smplSCCP)
+            elif "body" in children_keys:
+                links = {"fall_through": self.children["body"]}
+            elif "exit" in children_keys:
+                links = {"branch": self.children["exit"]}
 
-        links["dom"] = self.dominates
+        links["dom"] = self.graph.cfg().dom_tree.get(self, [])
 
         return links
 
     def constant_elimination(self):
-        pyfuns = {
-            "add": operator.add,
-            "adda": operator.add,
-            "div": operator.truediv,
-            "sub": operator.sub,
-            "mul": operator.mul,
-        }
-        # for removing unnecessary ops (ex: add 0, sub 0...)
-        left_unit = {
-            "add": smplSSA.ImmediateOp(0),
-            "adda": smplSSA.ImmediateOp(0),
-            "mul": smplSSA.ImmediateOp(1),
-        }
-        right_unit = {
-            "add": smplSSA.ImmediateOp(0),
-            "adda": smplSSA.ImmediateOp(0),
-            "sub": smplSSA.ImmediateOp(0),
-            "mul": smplSSA.ImmediateOp(1),
-            "div": smplSSA.ImmediateOp(1),
-        }
-
         n_eliminated = 1
         while n_eliminated > 0:  # need to keep iterating until we reach a fixed point
             n_eliminated = 0
             for i, instr in enumerate(self.instrs):
                 opcode = instr.instr
-                if opcode in pyfuns:
+                if opcode in FOLD_FUNCS:
                     assert len(instr.ops) == 2
                     left, right = instr.ops
                     if isinstance(left, smplSSA.ImmediateOp) and isinstance(
@@ -220,23 +300,21 @@ class Block:
                         if left.un_init or right.un_init:
                             # skip this command, since it consists of uninit variables
                             continue
-                        res = int(pyfuns[instr.instr](left.val, right.val))
+                        res = FOLD_FUNCS[opcode](
+                            smplSSA.wrap(left.val), smplSSA.wrap(right.val)
+                        )
+                        res = smplSSA.wrap(int(res))
 
                         # Delete instruction that should be eliminated
-                        del self.instrs[i]
-                        self.rename_op(
-                            smplSSA.InstructionOp(instr), smplSSA.ImmediateOp(res)
-                        )
+                        self.delete_instr(i, smplSSA.ImmediateOp(res))
                         n_eliminated += 1
 
-                    elif opcode in left_unit and left == left_unit[opcode]:
-                        del self.instrs[i]
-                        self.rename_op(smplSSA.InstructionOp(instr), right)
+                    elif opcode in LEFT_UNIT and left == LEFT_UNIT[opcode]:
+                        self.delete_instr(i, right)
                         n_eliminated += 1
 
-                    elif opcode in right_unit and right == right_unit[opcode]:
-                        del self.instrs[i]
-                        self.rename_op(smplSSA.InstructionOp(instr), left)
+                    elif opcode in RIGHT_UNIT and right == RIGHT_UNIT[opcode]:
+                        self.delete_instr(i, left)
                         n_eliminated += 1
 
     def build_instr_reorder_table(self, graph_reorder_table, block_start_i):
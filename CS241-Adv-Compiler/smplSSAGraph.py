@@ -1,5 +1,7 @@
-import copy
+import collections
+import itertools
 
+import smplSSA
 import smplSSABlock
 
 
@@ -9,38 +11,305 @@ class Graph:
         self.graphs = []
 
 
+class ValueTable:
+    # Scoped hash table for value numbering (CSE), (opcode, operand values) -> instr
+    # A scope is opened for every block and closed again when the compiler
+    # leaves its dominator subtree, so only dominating instructions are visible
+    def __init__(self):
+        self.table = {}  # key -> instr of the innermost scope
+        self.scopes = [[]]  # (key, shadowed instr) inserted in each open scope
+        self.epochs = itertools.count()
+        self.epoch = next(self.epochs)  # memory state, changed by every store
+        self.saved_epochs = []
+
+    def value_number(self, op):
+        if isinstance(op, smplSSA.Instruction):
+            return op
+        if isinstance(op, smplSSA.ImmediateOp):
+            # interned, an uninitialized value is the same as #0
+            return smplSSA.ImmediateOp(op.val) if op.un_init else op
+        if isinstance(op, smplSSA.ArgumentOp):
+            return ("@", op.name)
+        return op
+
+    def key(self, instr, opcode=None):
+        opcode = opcode or instr.instr
+        key = (opcode,) + tuple(self.value_number(op) for op in instr.ops)
+        if opcode == smplSSA.Op.LOAD:
+            # a load can only be reused if no store happened in between
+            key += (self.epoch,)
+        return key
+
+    def lookup(self, key):
+        return self.table.get(key)
+
+    def insert(self, key, instr):
+        # remember the shadowed entry, it is visible again when the scope closes
+        self.scopes[-1].append((key, self.table.get(key)))
+        self.table[key] = instr
+
+    def kill_memory(self):
+        self.epoch = next(self.epochs)
+
+    def push_scope(self):
+        self.scopes.append([])
+        self.saved_epochs.append(self.epoch)
+
+    def pop_scope(self):
+        for key, shadowed in reversed(self.scopes.pop()):
+            if shadowed is None:
+                del self.table[key]
+            else:
+                self.table[key] = shadowed
+        self.epoch = self.saved_epochs.pop()
+
+    def mark(self):
+        return len(self.scopes)
+
+    def rewind(self, mark):
+        # close every scope opened after mark
+        while len(self.scopes) > mark:
+            self.pop_scope()
+
+
+class Loop:
+    # A natural loop: the header and every block that reaches a back edge
+    # to the header without passing through it
+    def __init__(self, header):
+        self.header = header
+        self.latches = []  # sources of the back edges
+        self.blocks = {header}
+        self.parent = None  # the innermost enclosing loop
+        self.children = []
+        self.depth = 1
+
+    def preheader(self):
+        # the single block entering the loop, if it only leads to the header
+        entries = [pred for pred in self.header.preds if pred not in self.blocks]
+        if len(entries) != 1 or entries[0].succs != [self.header]:
+            return None
+        return entries[0]
+
+
+class CFG:
+    # Analyses of the control flow graph of a SubGraph: reverse postorder,
+    # dominator tree (Cooper, Harvey & Kennedy, "A Simple, Fast Dominance
+    # Algorithm"), dominance frontiers and the loop nest. Only blocks
+    # reachable from the root are included. Built by SubGraph.cfg(), which drops it again
+    # when an edge is added or removed.
+    def __init__(self, root):
+        self.root = root
+        self.rpo = self.reverse_postorder(root)
+        self.order = {block: i for i, block in enumerate(self.rpo)}
+        self.idom = self.build_dominators()
+        self.dom_tree = {block: [] for block in self.rpo}
+        for block in self.rpo[1:]:
+            self.dom_tree[self.idom[block]].append(block)
+        self.frontiers = None
+        self.loop_forest = None
+        self.loop_of = None  # block -> innermost loop
+
+    def reverse_postorder(self, root):
+        # the last successor is explored first, so the first one comes
+        # first in the result (then before else, body before exit)
+        visited = {root}
+        postorder = []
+        stack = [(root, reversed(root.succs))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in visited:
+                    visited.add(succ)
+                    stack.append((succ, reversed(succ.succs)))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block)
+        postorder.reverse()
+        return postorder
+
+    def intersect(self, a, b, idom):
+        while a is not b:
+            while self.order[a] > self.order[b]:
+                a = idom[a]
+            while self.order[b] > self.order[a]:
+                b = idom[b]
+        return a
+
+    def build_dominators(self):
+        idom = {self.root: self.root}
+        changed = True
+        while changed:
+            changed = False
+            for block in self.rpo[1:]:
+                new_idom = None
+                for pred in block.preds:
+                    if pred not in idom:  # not processed yet or unreachable
+                        continue
+                    if new_idom is None:
+                        new_idom = pred
+                    else:
+                        new_idom = self.intersect(pred, new_idom, idom)
+                if idom.get(block) is not new_idom:
+                    idom[block] = new_idom
+                    changed = True
+        return idom
+
+    def dominates(self, a, b):
+        # whether a dominates b
+        if a not in self.order or b not in self.order:
+            return False
+        while self.order[b] > self.order[a]:
+            b = self.idom[b]
+        return a is b
+
+    def dominance_frontiers(self):
+        if self.frontiers is None:
+            frontiers = {block: {} for block in self.rpo}  # dict as an ordered set
+            for block in self.rpo:
+                preds = [pred for pred in block.preds if pred in self.order]
+                if len(preds) < 2:
+                    continue
+                for pred in preds:
+                    runner = pred
+                    while runner is not self.idom[block]:
+                        frontiers[runner][block] = None
+                        runner = self.idom[runner]
+            self.frontiers = {
+                block: sorted(frontier, key=self.order.get)
+                for block, frontier in frontiers.items()
+            }
+        return self.frontiers
+
+    def loops(self):
+        # top level loops of the loop nest tree, in reverse postorder of the headers
+        if self.loop_forest is None:
+            loops = {}  # header -> loop
+            for block in self.rpo:
+                for succ in block.succs:
+                    if self.dominates(succ, block):  # back edge
+                        loop = loops.setdefault(succ, Loop(succ))
+                        loop.latches.append(block)
+            for loop in loops.values():
+                work = list(loop.latches)
+                while work:
+                    block = work.pop()
+                    if block in loop.blocks:
+                        continue
+                    loop.blocks.add(block)
+                    work.extend(pred for pred in block.preds if pred in self.order)
+            # the parent is the smallest other loop containing the header
+            by_size = sorted(loops.values(), key=lambda loop: len(loop.blocks))
+            for i, loop in enumerate(by_size):
+                for outer in by_size[i + 1 :]:
+                    if loop.header in outer.blocks:
+                        loop.parent = outer
+                        break
+            self.loop_forest = []
+            self.loop_of = {}
+            for header in sorted(loops, key=self.order.get):
+                loop = loops[header]
+                if loop.parent is None:
+                    self.loop_forest.append(loop)
+                else:
+                    loop.parent.children.append(loop)
+            for loop in self.loop_postorder():
+                for block in loop.blocks:
+                    self.loop_of.setdefault(block, loop)
+            for loop in reversed(self.loop_postorder()):
+                if loop.parent is not None:
+                    loop.depth = loop.parent.depth + 1
+        return self.loop_forest
+
+    def loop_postorder(self):
+        # inner loops before the loops containing them
+        order = []
+        stack = [(loop, False) for loop in reversed(self.loops())]
+        while stack:
+            loop, done = stack.pop()
+            if done:
+                order.append(loop)
+                continue
+            stack.append((loop, True))
+            stack.extend((child, False) for child in reversed(loop.children))
+        return order
+
+    def loop_depth(self, block):
+        self.loops()
+        loop = self.loop_of.get(block)
+        return loop.depth if loop else 0
+
+
 class SubGraph:
     def __init__(self):
         self.block_counter = 0
         self.instr_counter = 1
         self.root = None  # the starting node of the graph
         self.current_block = None
+        self.values = ValueTable()  # for CSE
+        # names assigned in each enclosing then/else/loop body, innermost last
+        self.assigned = [{}]
+        self.cfg_cache = None
+        self.stats = collections.Counter()  # pass name.counter -> value
+        self.pre_report = []  # (expression, inserted edges, deleted), see smplPRE
+        self.allocation = None  # registers of the values, see smplRegAlloc
         self.params = []  # for function printing
         self.is_void = False  # for function printing
 
     def emit(self, *args, check_dup=False, is_empty=False):
         result_op, decrease_i_count = self.current_block.emit(
-            self.instr_counter, *args, check_dup=check_dup, is_empty=is_empty
+            self.instr_counter,
+            self.values,
+            *args,
+            check_dup=check_dup,
+            is_empty=is_empty,
         )
         self.instr_counter += 1 + decrease_i_count
         return result_op
 
-    def get_new_block(self, root=False, add_counter=True, same_context=False):
-        block = smplSSABlock.Block()
+    def assign(self, name, val):
+        self.current_block.set_local_var(name, val)
+        self.assigned[-1][name] = None
+
+    def push_assigned(self):
+        self.assigned.append({})
+
+    def pop_assigned(self):
+        # the names assigned in a nested statement are assigned in its parent too
+        names = self.assigned.pop()
+        self.assigned[-1].update(names)
+        return names
+
+    def new_instr(self, opcode, *ops):
+        # an instruction made by an optimization pass, placed by the caller
+        instr = smplSSA.Instruction(opcode, *ops)
+        instr.i = self.instr_counter
+        self.instr_counter += 1
+        instr.link()
+        return instr
+
+    def get_new_block(self, root=False, same_context=False):
+        block = smplSSABlock.Block(self)
         if not block:
             raise Exception("[ERROR] Failed to get new block")
         if root:
             self.current_block = block
             self.root = block
         if same_context:  # for if and while loops
-            block.local_variables = copy.copy(self.current_block.local_variables)
-            block.local_arr_strides = copy.copy(self.current_block.local_arr_strides)
-            block.search_list = copy.copy(self.current_block.search_list)
-        if add_counter:
-            self.block_counter += 1
+            block.local_variables = self.current_block.local_variables.fork()
+        self.block_counter += 1
         block.label = self.block_counter
 
         return block
 
     def set_current_block(self, block):
         self.current_block = block
+
+    def cfg(self):
+        if self.cfg_cache is None:
+            self.cfg_cache = CFG(self.root)
+        return self.cfg_cache
+
+    def invalidate_cfg(self):
+        # called whenever an edge is added or removed
+        self.cfg_cache = None
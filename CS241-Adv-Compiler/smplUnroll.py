@@ -0,0 +1,242 @@
+import smplSCCP
+import smplSSA
+import smplSSAGraph
+
+Op = smplSSA.Op
+
+# instructions of a fully unrolled loop, bigger loops are unrolled by a factor
+UNROLL_BUDGET = 64
+UNROLL_FACTOR = 4
+# a loop is not simulated further than this to find its trip count
+MAX_TRIPS = 100000
+# reused by the CSE of the unrolled code, loads until memory may change
+CSE_OPS = frozenset({Op.ADD, Op.SUB, Op.MUL, Op.DIV, Op.CMP, Op.ADDA, Op.LOAD})
+MEMORY_KILL_OPS = frozenset({Op.STORE, Op.CALL})
+
+
+class Unroll:
+    # Unrolls the loops WhileStatement.compile produces when the header
+    # compares a counter (phi(#init, phi +/- #step)) with an immediate and
+    # the body is a single block. Up to the budget the loop is replaced by
+    # straight-line code, above it the body is repeated by a factor that
+    # divides the trip count, so the test only runs every factor
+    # iterations. The unrolled code is folded and CSE'd again
+    def __init__(self, graph, budget=UNROLL_BUDGET, factor=UNROLL_FACTOR):
+        self.graph = graph
+        self.budget = budget
+        self.factor = factor
+        self.n_full = 0
+        self.n_partial = 0
+
+    def run(self):
+        cfg = self.graph.cfg()
+        loops = [loop for loop in cfg.loop_postorder() if not loop.children]
+        for loop in loops:
+            shape = self.match(loop)
+            if shape is None:
+                continue
+            trips = self.trip_count(shape[4])
+            if trips is None:
+                continue
+            self.unroll(loop, shape, trips)
+        self.graph.stats["unroll.full"] += self.n_full
+        self.graph.stats["unroll.partial"] += self.n_partial
+        return self
+
+    # Analysis
+    def match(self, loop):
+        # -> (preheader, body, branch, exit, counter) or None, counter is
+        # (init, step, bound, whether the counter is the left operand, branch)
+        header = loop.header
+        if len(loop.blocks) != 2 or len(header.preds) != 2:
+            return None
+        (body,) = loop.blocks - {header}
+        preheader = loop.preheader()
+        branch = header.branch_instr()
+        if preheader is None or branch is None or body.succs != [header]:
+            return None
+        exit = branch.ops[1]
+        if exit in loop.blocks or header.succs != [body, exit]:
+            return None
+        body_instrs = [instr for instr in body.instrs if not instr.is_empty]
+        if not body_instrs or body_instrs[-1].instr != Op.BRA:
+            return None
+        if any(instr.instr in (Op.RETURN, Op.END) for instr in body_instrs):
+            return None
+
+        cmp = branch.ops[0]
+        if not isinstance(cmp, smplSSA.Instruction) or cmp.instr != Op.CMP:
+            return None
+        entry = header.preds.index(preheader)
+        back = 1 - entry
+        for counter, bound in (cmp.ops, reversed(cmp.ops)):
+            if not isinstance(counter, smplSSA.Instruction) or not self.is_constant(
+                bound
+            ):
+                continue
+            if counter.instr != Op.PHI or counter not in header.instrs:
+                continue
+            init, update = counter.ops[entry], counter.ops[back]
+            step = self.step(counter, update)
+            if self.is_constant(init) and step is not None:
+                counter_left = cmp.ops[0] is counter
+                return (
+                    preheader,
+                    body,
+                    branch,
+                    exit,
+                    (init.val, step, bound.val, counter_left, branch.instr),
+                )
+        return None
+
+    def is_constant(self, op):
+        return isinstance(op, smplSSA.ImmediateOp) and not op.un_init
+
+    def step(self, counter, update):
+        if not isinstance(update, smplSSA.Instruction):
+            return None
+        if update.instr not in (Op.ADD, Op.SUB):
+            return None
+        left, right = update.ops
+        if left is counter and self.is_constant(right):
+            return right.val if update.instr == Op.ADD else -right.val
+        if right is counter and self.is_constant(left) and update.instr == Op.ADD:
+            return left.val
+        return None
+
+    def trip_count(self, counter):
+        # the number of times the body runs, None if the loop runs too long
+        value, step, bound, counter_left, opcode = counter
+        taken = smplSCCP.BRANCH_FUNCS[opcode]
+        value, bound = smplSSA.wrap(value), smplSSA.wrap(bound)
+        for trips in range(MAX_TRIPS):
+            cmp = value - bound if counter_left else bound - value
+            if taken(cmp):  # the branch leaves the loop
+                return trips
+            value = smplSSA.wrap(value + step)
+        return None
+
+    # Transformation
+    def clone(self, instrs, values, code):
+        # copies of instrs, with the operands mapped by values
+        for instr in instrs:
+            ops = tuple(values.get(op, op) for op in instr.ops)
+            values[instr] = self.graph.new_instr(instr.instr, *ops)
+            code.append(values[instr])
+
+    def next_values(self, phis, back, values):
+        # the phi values of the next iteration, all read before any is set
+        values.update({phi: values.get(phi.ops[back], phi.ops[back]) for phi in phis})
+
+    def unroll(self, loop, shape, trips):
+        preheader, body, branch, exit, _ = shape
+        header = loop.header
+        back = 1 - header.preds.index(preheader)
+        phis = [instr for instr in header.instrs if instr.instr == Op.PHI]
+        # the header code besides the phis and the loop test
+        test = {branch}
+        if all(use is branch for use in branch.ops[0].uses):
+            test.add(branch.ops[0])
+        header_code = [
+            instr
+            for instr in header.instrs
+            if not instr.is_empty and instr.instr != Op.PHI and instr not in test
+        ]
+        body_code = [
+            instr
+            for instr in body.instrs
+            if not instr.is_empty and instr.instr != Op.BRA
+        ]
+        size = len(header_code) + len(body_code)
+
+        if trips * size <= self.budget:
+            self.unroll_fully(
+                header,
+                body,
+                exit,
+                branch,
+                phis,
+                back,
+                test,
+                header_code,
+                body_code,
+                trips,
+            )
+            self.n_full += 1
+            return
+        for factor in range(self.factor, 1, -1):
+            if trips % factor == 0 and factor * size <= self.budget:
+                self.unroll_partially(body, phis, back, header_code, body_code, factor)
+                self.n_partial += 1
+                return
+
+    def unroll_fully(
+        self,
+        header,
+        body,
+        exit,
+        branch,
+        phis,
+        back,
+        test,
+        header_code,
+        body_code,
+        trips,
+    ):
+        values = {phi: phi.ops[1 - back] for phi in phis}
+        code = []
+        for _ in range(trips):
+            self.clone(header_code + body_code, values, code)
+            self.next_values(phis, back, values)
+        # the header runs once more, for the test leaving the loop
+        self.clone(header_code, values, code)
+
+        for instr in body.instrs:
+            instr.unlink()
+        for instr in phis + header_code:
+            instr.replace_all_uses(values[instr])
+        for instr in phis + header_code + list(test - {branch}):
+            instr.unlink()
+        # the branch is always taken now, like a branch resolved by SCCP
+        branch.instr = Op.BRA
+        branch.set_ops(exit)
+        header.instrs = code + [branch]
+        header.remove_child(body)
+        body.remove_child(header)
+        self.simplify(header)
+
+    def unroll_partially(self, body, phis, back, header_code, body_code, factor):
+        values = {}
+        self.next_values(phis, back, values)
+        code = []
+        for _ in range(factor - 1):
+            self.clone(header_code + body_code, values, code)
+            self.next_values(phis, back, values)
+        body.instrs[-1:-1] = code  # before the branch back to the header
+        for phi in phis:
+            ops = list(phi.ops)
+            ops[back] = values[phi]
+            phi.set_ops(*ops)
+        self.simplify(body)
+
+    def simplify(self, block):
+        block.constant_elimination()
+        self.cse(block)
+        block.constant_elimination()
+
+    def cse(self, block):
+        values = smplSSAGraph.ValueTable()
+        for instr in list(block.instrs):
+            if instr.is_empty:
+                continue
+            if instr.instr in CSE_OPS:
+                key = values.key(instr)
+                same = values.lookup(key)
+                if same is not None:
+                    block.instrs.remove(instr)
+                    instr.unlink()
+                    instr.replace_all_uses(same)
+                    continue
+                values.insert(key, instr)
+            elif instr.instr in MEMORY_KILL_OPS:
+                values.kill_memory()